@@ -0,0 +1,381 @@
+#!/usr/bin/env python3
+
+"""This module provides the batch converter that (re)generates the txt files of an html/pdf corpus folder.
+
+Conversions run in BATCH_CONVERT_WORKERS worker processes. Each worker gets one file at a time, so a
+worker that takes longer than BATCH_CONVERT_TIMEOUT_SECS for a file (e.g. a broken PDF) is killed and
+replaced, and the file is recorded as timed out instead of stalling the run.
+
+A manifest db (BATCH_CONVERT_MANIFEST_PATH) records every source file: its size, mtime and hash,
+the hash and mtime of its txt file and the conversion status. Deciding what to convert is a lookup in
+the manifest:
+- a file whose size and mtime match its manifest row is unchanged and skipped
+- a file whose size or mtime changed is hashed, and only converted if the hash changed too
+- a file that is not in the manifest yet is converted, unless its txt file already exists (first run
+  on a corpus written by the crawler), then it is only recorded
+- failed and timed out files are skipped until they change (or with --retry-failed)
+- scanned pages of PDFs get the OCR text cached by the crawler (see ocr.py), PDFs with pages that were not
+  OCRed yet are recorded as needs_ocr and converted again with --retry-failed
+Results are committed every BATCH_CONVERT_COMMIT_EVERY_N files, so an interrupted run resumes where
+it stopped. The run ends with a throughput summary.
+
+Usage:
+    python batch_convert.py [corpus_dir] [--all] [--html] [--pdf] [--retry-failed] [--verify]
+        [--workers N] [--timeout SECS]
+--all converts every file, --verify also re-converts files whose txt file is missing or was modified.
+text_conversion.py and pdf_to_txt_conversion.py run it for html and pdf files.
+"""
+import multiprocessing
+import multiprocessing.connection
+import os
+import sqlite3
+import sys
+import time
+from collections import Counter, deque
+from datetime import datetime
+
+import config
+import utils
+
+KIND_EXTENSIONS = {"html": ".html", "pdf": ".pdf"}
+
+STATUS_CONVERTED = "converted"
+STATUS_EMPTY = "empty"          # no text could be extracted, no txt file was written
+STATUS_EXISTING = "existing"    # recorded with the txt file that was already there
+STATUS_FAILED = "failed"
+STATUS_NEEDS_OCR = "needs_ocr"  # converted, but pages without text have no OCR text in the cache db yet
+STATUS_TIMEOUT = "timeout"
+STATUS_UNCHANGED = "unchanged"  # only reported, not stored
+
+SQL_CREATE_MANIFEST = '''
+    CREATE TABLE IF NOT EXISTS conversions (
+        source_path TEXT PRIMARY KEY,
+        source_size INTEGER NOT NULL,
+        source_mtime_ns INTEGER NOT NULL,
+        source_hash TEXT,
+        output_path TEXT NOT NULL,
+        output_hash TEXT,
+        output_mtime_ns INTEGER,
+        status TEXT NOT NULL,
+        convert_secs REAL,
+        converted_time TEXT NOT NULL
+    )
+'''
+SQL_UPSERT_CONVERSION = '''
+    INSERT INTO conversions (source_path, source_size, source_mtime_ns, source_hash, output_path, output_hash,
+                             output_mtime_ns, status, convert_secs, converted_time)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT(source_path) DO UPDATE SET
+        source_size=excluded.source_size, source_mtime_ns=excluded.source_mtime_ns, source_hash=excluded.source_hash,
+        output_path=excluded.output_path, output_hash=excluded.output_hash, output_mtime_ns=excluded.output_mtime_ns,
+        status=excluded.status, convert_secs=excluded.convert_secs, converted_time=excluded.converted_time
+'''
+
+
+# Returns the txt file name the crawler uses for an html or pdf file, e.g. a.html.html -> a.txt.txt
+def get_output_path(source_path, kind):
+    dir_name, base_name = os.path.split(source_path)
+    return os.path.join(dir_name, base_name.replace(KIND_EXTENSIONS[kind], ".txt"))
+
+
+def _hash_file(path):
+    with open(path, "rb") as file:
+        return utils.hash_bytes(file.read())
+
+
+# Converts one file and writes its txt file, runs in a worker process.
+# Returns (status, source_hash, output_hash, output_mtime_ns, error message)
+def convert_file(kind, source_path, output_path):
+    with open(source_path, "rb") as file:
+        content = file.read()
+    source_hash = utils.hash_bytes(content)
+
+    if kind == "html":
+        import content_filter
+        import html_pipeline
+        page = html_pipeline.parse_html(content)
+        if page is None:
+            return STATUS_FAILED, source_hash, None, None, "html could not be parsed"
+        title, text = content_filter.extract_content_newspaper(content, page)
+        if not utils.save_txt_to_file(output_path, title, text):
+            return STATUS_EMPTY, source_hash, None, None, None
+    else:
+        import pdf_fetcher
+        _, ocr_pages = pdf_fetcher.extract_clean_pdf_text_to_file(content, output_path)
+        if ocr_pages:
+            # scanned pages get the OCR text the crawler saved in the cache db (see ocr.py)
+            import ocr
+            ocr_texts = {}
+            if os.path.exists(config.DB_CACHE_PATH):
+                with pdf_fetcher.open_pdf(content) as doc:
+                    ocr_texts = ocr.get_cached_ocr_texts(doc, ocr_pages, config.DB_CACHE_PATH)
+            if ocr_texts:
+                pdf_fetcher.extract_clean_pdf_text_to_file(content, output_path, ocr_texts=ocr_texts)
+            if len(ocr_texts) < len(ocr_pages):
+                return (STATUS_NEEDS_OCR, source_hash, _hash_file(output_path), os.stat(output_path).st_mtime_ns,
+                        f"{len(ocr_pages) - len(ocr_texts)} pages without text not OCRed")
+
+    return STATUS_CONVERTED, source_hash, _hash_file(output_path), os.stat(output_path).st_mtime_ns, None
+
+
+def _worker_main(conn):
+    # the extraction libraries print progress, the parent prints the summary
+    sys.stdout = open(os.devnull, "w")
+    while True:
+        task = conn.recv()
+        if task is None:
+            break
+        try:
+            result = convert_file(*task)
+        except Exception as e:
+            result = (STATUS_FAILED, None, None, None, f"{type(e).__name__}: {e}")
+        conn.send(result)
+
+
+class ConvertWorker:
+    def __init__(self, context):
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(target=_worker_main, args=(child_conn,), daemon=True)
+        self.process.start()
+        child_conn.close()
+        self.task = None
+        self.start_time = None
+        self.num_tasks = 0
+
+    def send(self, task):
+        self.conn.send((task.kind, task.source_path, task.output_path))
+        self.task = task
+        self.start_time = time.monotonic()
+        self.num_tasks += 1
+
+    def stop(self):
+        try:
+            self.conn.send(None)
+        except (OSError, ValueError):
+            pass
+        self.process.join(timeout=5)
+        self.kill()
+
+    def kill(self):
+        if self.process.is_alive():
+            self.process.kill()
+        self.process.join()
+        self.conn.close()
+
+
+class Task:
+    def __init__(self, kind, source_path, size, mtime_ns):
+        self.kind = kind
+        self.source_path = source_path
+        self.output_path = get_output_path(source_path, kind)
+        self.size = size
+        self.mtime_ns = mtime_ns
+
+
+# Yields a Task for every file of the given kinds under base_dir
+def scan_sources(base_dir, kinds):
+    extensions = {KIND_EXTENSIONS[kind]: kind for kind in kinds}
+    pending_dirs = [os.path.abspath(base_dir)]
+    while pending_dirs:
+        with os.scandir(pending_dirs.pop()) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    pending_dirs.append(entry.path)
+                    continue
+                kind = extensions.get(os.path.splitext(entry.name)[1])
+                if kind is not None and entry.is_file():
+                    stat = entry.stat()
+                    yield Task(kind, entry.path, stat.st_size, stat.st_mtime_ns)
+
+
+class Manifest:
+    def __init__(self, path):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.conn = sqlite3.connect(path)
+        self.conn.execute(SQL_CREATE_MANIFEST)
+        self.conn.commit()
+        self.rows = {row[0]: row for row in self.conn.execute(
+            "SELECT source_path, source_size, source_mtime_ns, source_hash, output_mtime_ns, status FROM conversions")}
+        self.num_uncommitted = 0
+
+    def get(self, source_path):
+        return self.rows.get(source_path)
+
+    def record(self, task, status, source_hash=None, output_hash=None, output_mtime_ns=None, convert_secs=None):
+        self.conn.execute(SQL_UPSERT_CONVERSION, (task.source_path, task.size, task.mtime_ns, source_hash,
+                                                  task.output_path, output_hash, output_mtime_ns, status,
+                                                  convert_secs, datetime.now()))
+        self.num_uncommitted += 1
+        if self.num_uncommitted >= config.BATCH_CONVERT_COMMIT_EVERY_N:
+            self.commit()
+
+    def commit(self):
+        self.conn.commit()
+        self.num_uncommitted = 0
+
+    def close(self):
+        self.commit()
+        self.conn.close()
+
+
+# Returns the tasks that need a conversion, records what can be decided without one
+def plan(tasks, manifest, regenerate_all, retry_failed, verify, counts):
+    todo = []
+    for task in tasks:
+        row = manifest.get(task.source_path)
+        if regenerate_all:
+            todo.append(task)
+        elif row is None:
+            if os.path.exists(task.output_path):
+                manifest.record(task, STATUS_EXISTING, output_mtime_ns=os.stat(task.output_path).st_mtime_ns)
+                counts[STATUS_EXISTING] += 1
+            else:
+                todo.append(task)
+        elif (row[1], row[2]) != (task.size, task.mtime_ns):
+            # touched but identical files keep their txt file
+            source_hash = _hash_file(task.source_path)
+            if source_hash == row[3]:
+                manifest.conn.execute("UPDATE conversions SET source_size=?, source_mtime_ns=? WHERE source_path=?",
+                                      (task.size, task.mtime_ns, task.source_path))
+                counts[STATUS_UNCHANGED] += 1
+            else:
+                todo.append(task)
+        elif row[5] in (STATUS_FAILED, STATUS_TIMEOUT, STATUS_NEEDS_OCR):
+            if retry_failed:
+                todo.append(task)
+            else:
+                counts[row[5] + "_skipped"] += 1
+        elif verify and row[5] in (STATUS_CONVERTED, STATUS_EXISTING) and \
+                (not os.path.exists(task.output_path) or os.stat(task.output_path).st_mtime_ns != row[4]):
+            todo.append(task)
+        else:
+            counts[STATUS_UNCHANGED] += 1
+    manifest.commit()
+    return todo
+
+
+# Converts the tasks in worker processes, records each result in the manifest
+def convert_all(todo, manifest, num_workers, timeout_secs, counts, slowest):
+    context = multiprocessing.get_context("spawn")
+    pending = deque(todo)
+    workers = [ConvertWorker(context) for _ in range(min(num_workers, len(todo)))]
+    num_done = 0
+    num_bytes = 0
+    next_report_time = time.monotonic() + 10
+
+    def finish(worker, status, source_hash=None, output_hash=None, output_mtime_ns=None, message=None):
+        nonlocal num_done, num_bytes
+        task = worker.task
+        secs = time.monotonic() - worker.start_time
+        manifest.record(task, status, source_hash, output_hash, output_mtime_ns, round(secs, 3))
+        counts[status] += 1
+        num_done += 1
+        num_bytes += task.size
+        slowest.append((secs, task.source_path))
+        if message is not None:
+            utils.error(f"Converting {task.source_path} {status}: {message}")
+        worker.task = None
+
+    try:
+        while pending or any(w.task is not None for w in workers):
+            for i, worker in enumerate(workers):
+                if worker.task is None and worker.num_tasks >= config.BATCH_CONVERT_MAX_TASKS_PER_WORKER:
+                    # a fresh process keeps the memory of the extraction libraries in check
+                    worker.stop()
+                    workers[i] = worker = ConvertWorker(context)
+                if worker.task is None and pending:
+                    worker.send(pending.popleft())
+
+            busy = [w for w in workers if w.task is not None]
+            now = time.monotonic()
+            wait_secs = max(0.0, min(w.start_time + timeout_secs for w in busy) - now)
+            ready = multiprocessing.connection.wait([w.conn for w in busy], timeout=wait_secs)
+            for i, worker in enumerate(workers):
+                if worker.task is None:
+                    continue
+                if worker.conn in ready:
+                    try:
+                        finish(worker, *worker.conn.recv())
+                        continue
+                    except EOFError:
+                        finish(worker, STATUS_FAILED, message="worker process died")
+                elif time.monotonic() - worker.start_time > timeout_secs:
+                    finish(worker, STATUS_TIMEOUT, message=f"no result after {timeout_secs}s")
+                else:
+                    continue
+                worker.kill()
+                workers[i] = ConvertWorker(context)
+
+            if time.monotonic() >= next_report_time:
+                utils.error(f"Converted {num_done}/{len(todo)} files")
+                next_report_time = time.monotonic() + 10
+    finally:
+        for worker in workers:
+            if worker.task is None:
+                worker.stop()
+            else:
+                worker.kill()
+        manifest.commit()
+    return num_bytes
+
+
+# Converts the html and/or pdf files under base_dir that are missing or changed (all files if regenerate_all)
+def run(base_dir=config.CORPUS_FOLDER_LOCATION, kinds=("html", "pdf"), regenerate_all=False, retry_failed=False,
+        verify=False, num_workers=config.BATCH_CONVERT_WORKERS, timeout_secs=config.BATCH_CONVERT_TIMEOUT_SECS,
+        manifest_path=config.BATCH_CONVERT_MANIFEST_PATH):
+    start_time = time.monotonic()
+    manifest = Manifest(manifest_path)
+    counts = Counter()
+    slowest = []
+    try:
+        tasks = list(scan_sources(base_dir, kinds))
+        todo = plan(tasks, manifest, regenerate_all, retry_failed, verify, counts)
+        print(f"Found {len(tasks)} {'/'.join(kinds)} files in {base_dir}, {len(todo)} to convert "
+              f"with {min(num_workers, len(todo))} workers", flush=True)
+        convert_start_time = time.monotonic()
+        num_bytes = convert_all(todo, manifest, num_workers, timeout_secs, counts, slowest) if todo else 0
+        convert_secs = time.monotonic() - convert_start_time
+    finally:
+        manifest.close()
+
+    print(f"Batch conversion finished in {time.monotonic() - start_time:.1f}s: "
+          + ", ".join(f"{status} {count}" for status, count in sorted(counts.items())))
+    if todo and convert_secs > 0:
+        print(f"Throughput: {len(todo) / convert_secs:.1f} files/s, {num_bytes / (1024 * 1024) / convert_secs:.1f} MB/s")
+        for secs, path in sorted(slowest, reverse=True)[:5]:
+            print(f"    {secs:.1f}s {path}")
+    return counts
+
+
+def main():
+    args = sys.argv[1:]
+    options = {"--all", "--html", "--pdf", "--retry-failed", "--verify"}
+    num_workers = config.BATCH_CONVERT_WORKERS
+    timeout_secs = config.BATCH_CONVERT_TIMEOUT_SECS
+    flags = set()
+    positional = []
+    i = 0
+    while i < len(args):
+        if args[i] in options:
+            flags.add(args[i])
+        elif args[i] == "--workers" and i + 1 < len(args):
+            num_workers = int(args[i + 1])
+            i += 1
+        elif args[i] == "--timeout" and i + 1 < len(args):
+            timeout_secs = float(args[i + 1])
+            i += 1
+        elif args[i].startswith("--"):
+            print(__doc__)
+            return
+        else:
+            positional.append(args[i])
+        i += 1
+
+    kinds = tuple(kind for kind in ("html", "pdf") if f"--{kind}" in flags) or ("html", "pdf")
+    base_dir = positional[0] if positional else config.CORPUS_FOLDER_LOCATION
+    run(base_dir, kinds, regenerate_all="--all" in flags, retry_failed="--retry-failed" in flags,
+        verify="--verify" in flags, num_workers=num_workers, timeout_secs=timeout_secs)
+
+
+if __name__ == "__main__":
+    main()
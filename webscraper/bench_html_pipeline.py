@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+
+"""Benchmark of the per-page html processing in web_scraper_base.process_page.
+
+Compares the CPU time per page of the old pipeline (BeautifulSoup html.parser, prettify, newspaper3k
+parsing the prettified html again) with the single-parse pipeline in html_pipeline.py. Link extraction,
+hashing and text extraction are timed, file writes are not.
+
+Usage:
+    python bench_html_pipeline.py [html_dir] [max_files]
+
+Without html_dir synthetic article pages are generated.
+"""
+import os
+import random
+import sys
+import time
+
+from bs4 import BeautifulSoup
+
+import content_filter
+import html_pipeline
+import utils
+
+
+def make_synthetic_pages(n, seed=1):
+    rnd = random.Random(seed)
+    words = ("peer review science journal study evidence data result method analysis research paper "
+             "author editor publish citation theory model experiment sample report").split()
+    pages = []
+    for i in range(n):
+        nav = "".join(f'<li><a href="/section/{j}/">Section {j}</a></li>' for j in range(120))
+        paragraphs = "".join(
+            "<p>" + " ".join(rnd.choice(words) for _ in range(rnd.randint(40, 120))) + "</p>"
+            for _ in range(rnd.randint(10, 30)))
+        links = "".join(f'<a href="/article/{i}-{j}#c{j}">related {j}</a> ' for j in range(30))
+        html = (f"<!DOCTYPE html><html><head><meta charset='utf-8'><title>Article {i}</title>"
+                f"<script src='https://substackcdn.com/bundle/{i}.js'></script></head>"
+                f"<body><script src='https://substackcdn.com/app.js'></script><nav><ul>{nav}</ul></nav>"
+                f"<main><article><h1>Article {i}</h1>{paragraphs}</article><aside>{links}</aside></main>"
+                f"<footer>footer text</footer></body></html>")
+        pages.append(html.encode("utf-8"))
+    return pages
+
+
+def load_pages(html_dir, max_files):
+    pages = []
+    for filename in sorted(os.listdir(html_dir)):
+        if utils.is_html_file(filename):
+            with open(os.path.join(html_dir, filename), "rb") as file:
+                pages.append(file.read())
+            if len(pages) >= max_files:
+                break
+    return pages
+
+
+# the pipeline as it was: three parses
+def old_pipeline(content):
+    soup = BeautifulSoup(content, 'html.parser')
+    utils.body_adjustments(soup)
+    html_content = soup.prettify().encode()
+    hash_val = utils.hash_html_content(html_content)
+    title, text = content_filter.extract_content_newspaper(html_content)
+    hrefs = [link['href'] for link in soup.find_all('a', href=True)]
+    return hash_val, title, text, hrefs
+
+
+def new_pipeline(content):
+    page = html_pipeline.parse_html(content)
+    html_pipeline.body_adjustments(page)
+    hash_val = utils.hash_html_content(page.html_bytes)
+    hrefs = html_pipeline.extract_links(page)
+    title, text = content_filter.extract_content_newspaper(page.html_bytes, page)
+    return hash_val, title, text, hrefs
+
+
+def run(name, pipeline, pages):
+    results = []
+    start = time.process_time()
+    for content in pages:
+        results.append(pipeline(content))
+    elapsed = time.process_time() - start
+    print(f"{name:>8}: {elapsed:.2f}s cpu, {1000 * elapsed / len(pages):.1f} ms/page")
+    return elapsed, results
+
+
+def main():
+    if len(sys.argv) > 1:
+        max_files = int(sys.argv[2]) if len(sys.argv) > 2 else 500
+        pages = load_pages(sys.argv[1], max_files)
+    else:
+        pages = make_synthetic_pages(200)
+    if not pages:
+        print("No html pages found")
+        return
+    print(f"Pages: {len(pages)}, avg size {sum(len(p) for p in pages) // len(pages)} bytes")
+
+    old_time, old_results = run("old", old_pipeline, pages)
+    new_time, new_results = run("new", new_pipeline, pages)
+    print(f"Speedup: {old_time / new_time:.2f}x")
+
+    same_text = sum(1 for o, n in zip(old_results, new_results) if o[1:3] == n[1:3])
+    same_links = sum(1 for o, n in zip(old_results, new_results) if o[3] == n[3])
+    print(f"Identical title/text: {same_text}/{len(pages)}, identical links: {same_links}/{len(pages)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+
+"""Benchmark of the page-parallel PDF extraction (pdf_fetcher.extract_clean_pdf_text_parallel).
+
+Builds a synthetic PDF with PyMuPDF (running headers, page numbers, footnotes and multi-line paragraphs
+with hyphenated words), then times the single-process extract_clean_pdf_text_to_file against the parallel
+extraction in a pool of worker processes and checks that both write the same txt file.
+
+Usage:
+    python bench_pdf_extract.py [num_pages] [num_processes]
+"""
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import fitz
+
+import config
+import pdf_fetcher
+
+WORDS = ("committee report testimony evidence government program classified document intelligence agency "
+         "investigation witness hearing congress secret operation funding disclosure").split()
+
+
+def build_pdf(path, num_pages):
+    doc = fitz.open()
+    for i in range(num_pages):
+        page = doc.new_page()
+        page.insert_text((72, 40), "Final Report of the Select Committee", fontsize=9)
+        y = 90
+        for paragraph in range(6):
+            for line in range(5):
+                words = [WORDS[(i * 7 + paragraph * 5 + line * 3 + k) % len(WORDS)] for k in range(9)]
+                text = " ".join(words) + ("-" if line == 2 else "")
+                page.insert_text((72, y), text, fontsize=11)
+                y += 14
+            y += 14
+        page.insert_text((72, 760), f"{i + 1} See the testimony of witness {i}.", fontsize=7)
+        page.insert_text((300, 815), str(i + 1), fontsize=9)
+    doc.set_metadata({"title": "Synthetic Committee Report"})
+    doc.save(path)
+    doc.close()
+
+
+def run(name, fn):
+    start = time.perf_counter()
+    fn()
+    elapsed = time.perf_counter() - start
+    print(f"{name:>9}: {elapsed:.2f}s")
+    return elapsed
+
+
+def main():
+    num_pages = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    num_processes = int(sys.argv[2]) if len(sys.argv) > 2 else config.EXTRACT_PROCESSES
+    with tempfile.TemporaryDirectory() as temp_dir:
+        pdf_path = os.path.join(temp_dir, "report.pdf")
+        build_pdf(pdf_path, num_pages)
+        with open(pdf_path, "rb") as file:
+            content = file.read()
+        print(f"Pages: {num_pages}, size: {len(content) / (1024 * 1024):.1f} MB, processes: {num_processes}")
+
+        serial_path = os.path.join(temp_dir, "serial.txt")
+        parallel_path = os.path.join(temp_dir, "parallel.txt")
+        serial_time = run("serial", lambda: pdf_fetcher.extract_clean_pdf_text_to_file(content, serial_path))
+        with ProcessPoolExecutor(max_workers=num_processes, mp_context=multiprocessing.get_context("spawn")) as executor:
+            # start the worker processes (and import pdf_fetcher) before timing, the crawler's pool is already running
+            list(executor.map(pdf_fetcher.dehyphenate_and_reflow, [[]] * num_processes))
+            parallel_time = run("parallel", lambda: pdf_fetcher.extract_clean_pdf_text_parallel(content, parallel_path,
+                                                                                              executor))
+        print(f"Speedup: {serial_time / parallel_time:.2f}x")
+
+        with open(serial_path, encoding="utf-8") as serial, open(parallel_path, encoding="utf-8") as parallel:
+            print(f"Same output: {serial.read() == parallel.read()}")
+
+
+if __name__ == "__main__":
+    main()
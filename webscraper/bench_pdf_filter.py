@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+
+"""Benchmark of the block filtering of pdf_fetcher (header/footer learning, font statistics, page numbers,
+footnotes).
+
+Compares the time per page of the old filtering, which walked the block/line/span dicts of a page several
+times per block, with pdf_fetcher.PageSpans. The page dicts are extracted once before timing (get_text is
+the same for both), so only the filtering is timed, then the kept blocks of both are compared.
+
+Usage:
+    python bench_pdf_filter.py [pdf_file] [repeat]
+
+pdf_file defaults to a synthetic 300 page PDF built by bench_pdf_extract.py.
+"""
+import os
+import statistics
+import sys
+import tempfile
+import time
+from collections import Counter
+
+import bench_pdf_extract
+import pdf_fetcher
+from pdf_fetcher import DIGITS_RE, FOOTNOTE_MARK_RE
+
+
+# the filtering of pdf_fetcher as it was
+def is_probable_page_number(text, bbox, page_w, page_h):
+    text = text.strip()
+    if not DIGITS_RE.match(text):
+        return False
+    x0, y0, x1, y1 = bbox
+    mid_x = (x0 + x1) / 2
+    mid_y = (y0 + y1) / 2
+    centered = abs(mid_x - page_w/2) < page_w * 0.2
+    top_or_bottom = (mid_y < page_h * 0.08) or (mid_y > page_h * 0.92)
+    return centered and top_or_bottom
+
+
+def learn_header_footer_bands(pages_dicts, n=5, band_frac=0.10):
+    top_texts = Counter()
+    bot_texts = Counter()
+    for p in pages_dicts[:n]:
+        h = p["height"]
+        for b in p["blocks"]:
+            y0 = b["bbox"][1]
+            if y0 < h * band_frac:
+                s = normalize_inline_text(b)
+                if s.strip():
+                    top_texts[s.strip()] += 1
+            if y0 > h * (1 - band_frac):
+                s = normalize_inline_text(b)
+                if s.strip():
+                    bot_texts[s.strip()] += 1
+    min_count = max(2, n // 2)
+    return {t for t, c in top_texts.items() if c >= min_count}, {t for t, c in bot_texts.items() if c >= min_count}
+
+
+def normalize_inline_text(block):
+    parts = []
+    for line in block.get("lines", []):
+        for span in line.get("spans", []):
+            parts.append(span.get("text", ""))
+    return " ".join(" ".join(p.split()) for p in parts)
+
+
+def page_font_stats(pdict):
+    sizes = [sp["size"] for b in pdict["blocks"] for ln in b.get("lines", []) for sp in ln.get("spans", [])
+             if sp.get("size")]
+    return statistics.median(sizes) if sizes else 10.0
+
+
+def block_avg_font(block):
+    sizes = [sp["size"] for ln in block.get("lines", []) for sp in ln.get("spans", []) if sp.get("size")]
+    return (sum(sizes)/len(sizes)) if sizes else 0.0
+
+
+def should_drop_block(block, page_w, page_h, med_font, headers, footers):
+    text = normalize_inline_text(block).strip()
+    if not text:
+        return True
+    if is_probable_page_number(text, block["bbox"], page_w, page_h):
+        return True
+    if text in headers or text in footers:
+        return True
+    y0 = block["bbox"][1]
+    avg_font = block_avg_font(block)
+    much_smaller_font = avg_font and avg_font < 0.8 * med_font
+    return y0 > page_h * 0.85 and (much_smaller_font or FOOTNOTE_MARK_RE.match(text) is not None)
+
+
+def old_filter(pages):
+    headers, footers = learn_header_footer_bands(pages)
+    kept = []
+    for p in pages:
+        med_font = page_font_stats(p)
+        kept.append([b for b in p["blocks"] if b.get("type", 0) == 0 and
+                     not should_drop_block(b, p["width"], p["height"], med_font, headers, footers)])
+    return kept
+
+
+def new_filter(pages):
+    learned = pdf_fetcher.PageSpans(pages[:5])
+    headers, footers = pdf_fetcher.learn_header_footer_bands(learned, n=learned.num_pages)
+    kept = learned.kept_blocks(headers, footers)
+    for batch in pdf_fetcher.iter_page_batches(iter(pages[5:])):
+        kept += batch.kept_blocks(headers, footers)
+    return kept
+
+
+def run(name, filter_pages, pages, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        kept = filter_pages(pages)
+    elapsed = (time.perf_counter() - start) / repeat
+    print(f"{name:>4}: {1000 * elapsed:.1f} ms, {1e6 * elapsed / len(pages):.1f} us/page")
+    return elapsed, kept
+
+
+def main():
+    repeat = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    with tempfile.TemporaryDirectory() as temp_dir:
+        pdf_path = sys.argv[1] if len(sys.argv) > 1 else os.path.join(temp_dir, "report.pdf")
+        if len(sys.argv) <= 1:
+            bench_pdf_extract.build_pdf(pdf_path, 300)
+        with pdf_fetcher.open_pdf(pdf_path) as doc:
+            pages = list(pdf_fetcher.iter_page_dicts(doc))
+    num_blocks = sum(len(p["blocks"]) for p in pages)
+    print(f"Pages: {len(pages)}, blocks: {num_blocks}")
+
+    old_time, old_kept = run("old", old_filter, pages, repeat)
+    new_time, new_kept = run("new", new_filter, pages, repeat)
+    print(f"Speedup: {old_time / new_time:.2f}x")
+    print(f"Same kept blocks: {old_kept == new_kept}, kept {sum(len(k) for k in new_kept)} of {num_blocks}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+
+"""Benchmark of the url filter in web_scraper_base.should_visit.
+
+Compares the time per url of the old regex chain of should_visit (pattern_filter_list, pattern_archive_url,
+the image regexes, mailto and the substack comment check, with its debug f-strings) with url_filter.py.
+The visited check is not part of either.
+
+Usage:
+    python bench_url_filter.py [url_file] [repeat]
+
+url_file defaults to the wanttoknow.info archive url list, a few typical outbound links of a page
+(social media, images, mailto) are mixed in so that both accepted and rejected urls are timed.
+"""
+import os
+import re
+import sys
+import time
+from collections import Counter
+
+import config
+import url_filter
+import utils
+
+DEFAULT_URL_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "train_ai", "wtk_corpus",
+                                "WTKarchiveurls.txt")
+
+OUTBOUND_URLS = [
+    "https://www.youtube.com/watch?v=abc123",
+    "https://twitter.com/share?url=https://www.wanttoknow.info/",
+    "https://www.facebook.com/sharer/sharer.php?u=https://www.wanttoknow.info/",
+    "mailto:info@wanttoknow.info",
+    "javascript:void(0)",
+    "https://www.wanttoknow.info/images/logo.png",
+    "https://www.wanttoknow.info/images/banner.jpeg",
+    "https://web.archive.org/web/2005/http://www.wanttoknow.info/",
+    "https://www.whitehouse.gov/briefing-room/",
+    "https://martintruther.substack.com/p/some-post?comments=true",
+    "https://www.theguardian.com/world/2024/may/01/some-article",
+    "https://www.dropbox.com/s/abc/document.pdf",
+]
+
+
+# the checks of should_visit as they were, without the visited check
+def old_filter(url):
+    utils.debug(f"Should visit url {url}?", flush=config.FLUSH_LOG)
+    if config.pattern_filter_list.search(url):
+        return False
+    if config.pattern_archive_url.match(url):
+        return False
+    if (bool(re.search('.jpe+g$', url)) or bool(re.search('.gif$', url)) or bool(re.search('.png$', url))):
+        return False
+    if (bool(re.search('^mailto:', url))):
+        return False
+    if utils.is_substack_comment_page(url):
+        return False
+    utils.debug(f"Accepted visit url {url}", flush=config.FLUSH_LOG)
+    return True
+
+
+def load_urls(url_file):
+    with open(url_file, "r", encoding="utf-8") as file:
+        urls = [line.strip() for line in file if line.strip()]
+    # about one outbound link per ten site links
+    return urls + OUTBOUND_URLS * max(1, len(urls) // (10 * len(OUTBOUND_URLS)))
+
+
+def run(name, classify, urls, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        results = [classify(url) for url in urls]
+    elapsed = (time.perf_counter() - start) / repeat
+    print(f"{name:>8}: {1000 * elapsed:.1f} ms, {1e6 * elapsed / len(urls):.2f} us/url")
+    return elapsed, results
+
+
+def main():
+    url_file = sys.argv[1] if len(sys.argv) > 1 else DEFAULT_URL_FILE
+    repeat = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    config.DEBUG_ENABLED = False
+    urls = load_urls(url_file)
+    print(f"Urls: {len(urls)}")
+
+    old_time, old_results = run("old", old_filter, urls, repeat)
+    new_time, new_results = run("new", url_filter.UrlFilter().classify, urls, repeat)
+    print(f"Speedup: {old_time / new_time:.2f}x")
+
+    print("Reasons: " + ", ".join(f"{reason} {count}" for reason, count in Counter(new_results).most_common()))
+    differences = [(url, old, new) for url, old, new in zip(urls, old_results, new_results)
+                   if old != (new == url_filter.ACCEPTED)]
+    print(f"Different decisions: {len(differences)}")
+    for url, old, new in sorted(set(differences))[:20]:
+        print(f"    old {'accepts' if old else 'rejects'}, new {new}: {url}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+
+"""This module provides a content-addressed blob store for the crawled corpus.
+
+Instead of one flat directory of files named after their url, page contents are stored once per content hash
+(the SHA-256 from utils.hash_html_content / utils.hash_bytes) in sharded subdirectories:
+
+    <BLOB_STORE_LOCATION>/ab/cd/abcd....html[.zst]
+
+- pages with identical content under different urls share one blob
+- two levels of 256 shards keep every directory small
+- blobs with an extension in BLOB_STORE_COMPRESS_EXTENSIONS are zstd-compressed if zstandard is installed
+- the url -> blob index lives in the cache db (url_blobs and blobs tables, see cache.py)
+
+Enable with CORPUS_BLOB_STORE_ENABLED in config.py. The txt files stay in the flat corpus folder.
+
+To export the blobs into the old flat layout (cleaned_url with '/' replaced by '_'):
+    python blob_store.py export <output_dir>
+"""
+import os
+import shutil
+import sys
+import tempfile
+
+import config
+from utils import debug, error
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+COMPRESSED_SUFFIX = ".zst"
+
+
+def should_compress(ext):
+    return zstandard is not None and config.BLOB_STORE_COMPRESS and ext in config.BLOB_STORE_COMPRESS_EXTENSIONS
+
+
+def get_blob_path(hash_val, ext, root=config.BLOB_STORE_LOCATION):
+    filename = hash_val + "." + ext
+    if should_compress(ext):
+        filename += COMPRESSED_SUFFIX
+    return os.path.join(root, hash_val[0:2], hash_val[2:4], filename)
+
+
+# Stores content under its hash if not stored yet, returns (blob_path, stored_size)
+def put_blob(hash_val, content, ext, root=config.BLOB_STORE_LOCATION):
+    blob_path = get_blob_path(hash_val, ext, root)
+    if os.path.exists(blob_path):
+        debug(f"Blob {blob_path} already stored")
+        return blob_path, os.path.getsize(blob_path)
+
+    data = content
+    if blob_path.endswith(COMPRESSED_SUFFIX):
+        data = zstandard.ZstdCompressor(level=config.BLOB_STORE_COMPRESS_LEVEL).compress(content)
+
+    # write to a temp file first so readers never see a partial blob
+    blob_dir = os.path.dirname(blob_path)
+    os.makedirs(blob_dir, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=blob_dir, suffix=".tmp")
+    with os.fdopen(fd, "wb") as file:
+        file.write(data)
+    os.replace(tmp_path, blob_path)
+    debug(f"Stored blob {blob_path} ({len(content)} bytes, {len(data)} stored)")
+    return blob_path, len(data)
+
+
+def is_blob_path(file_path):
+    return file_path.endswith(COMPRESSED_SUFFIX)
+
+
+# Reads a corpus file, decompressing it if it is a compressed blob
+def read_file(file_path):
+    with open(file_path, "rb") as file:
+        data = file.read()
+    if is_blob_path(file_path):
+        if zstandard is None:
+            raise RuntimeError(f"zstandard is required to read {file_path}")
+        data = zstandard.ZstdDecompressor().decompress(data)
+    return data
+
+
+# Writes every indexed url as a file in the old flat corpus layout, returns the number of files written
+def export_flat(output_dir, db_path=config.DB_CACHE_PATH):
+    import cache  # cache imports this module
+
+    os.makedirs(output_dir, exist_ok=True)
+    n = 0
+    for cleaned_url, blob_path, ext in cache.get_url_blobs(db_path):
+        out_path = os.path.join(output_dir, cleaned_url.replace('/', '_') + "." + ext)
+        if not os.path.exists(blob_path):
+            error(f"Missing blob {blob_path} for url {cleaned_url}")
+            continue
+        if os.path.exists(out_path):
+            os.remove(out_path)
+        if is_blob_path(blob_path):
+            with open(out_path, "wb") as file:
+                file.write(read_file(blob_path))
+        else:
+            # uncompressed blobs can share the bytes on disk
+            try:
+                os.link(blob_path, out_path)
+            except OSError:
+                shutil.copyfile(blob_path, out_path)
+        n = n + 1
+    return n
+
+
+def main():
+    if len(sys.argv) < 3 or sys.argv[1] != "export":
+        print("Usage: python blob_store.py export <output_dir>")
+        return
+    n = export_flat(sys.argv[2])
+    print(f"Exported {n} files to {sys.argv[2]}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+
+"""This module provides a pool of long-lived Playwright browsers for the playwright fetch strategy.
+
+Launching Chromium costs seconds, so instead of a browser per url every crawler thread keeps its own
+browser and context alive and only opens a fresh page per url. The Playwright sync API binds its
+objects to the thread that created them, so the pool holds one browser slot per thread, which
+sizes it to the number of crawl workers.
+
+- a browser is restarted after PLAYWRIGHT_PAGES_PER_BROWSER pages (keeps chromium memory in check)
+  or as soon as it is found disconnected/crashed
+- images, fonts and media are aborted at the route level since we only want the rendered html
+- release_thread() closes the calling thread's browser, workers call it when they exit
+"""
+import threading
+from contextlib import contextmanager
+
+from playwright.sync_api import sync_playwright
+
+import config
+from utils import debug, error
+
+
+class BrowserSlot:
+    def __init__(self):
+        self.playwright = None
+        self.browser = None
+        self.context = None
+        self.num_pages = 0
+        self.num_restarts = 0
+
+    def is_alive(self):
+        return self.browser is not None and self.browser.is_connected()
+
+
+def block_heavy_resources(route):
+    if route.request.resource_type in config.PLAYWRIGHT_BLOCKED_RESOURCE_TYPES:
+        route.abort()
+    else:
+        route.continue_()
+
+
+class BrowserPool:
+    def __init__(self, pages_per_browser=config.PLAYWRIGHT_PAGES_PER_BROWSER):
+        self.pages_per_browser = pages_per_browser
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.slots = []
+
+    def _slot(self):
+        slot = getattr(self.local, "slot", None)
+        if slot is None:
+            slot = BrowserSlot()
+            self.local.slot = slot
+            with self.lock:
+                self.slots.append(slot)
+        return slot
+
+    def _start(self, slot):
+        if slot.playwright is None:
+            slot.playwright = sync_playwright().start()
+        slot.browser = slot.playwright.chromium.launch(headless=True)
+        slot.context = slot.browser.new_context()
+        slot.context.route("**/*", block_heavy_resources)
+        slot.num_pages = 0
+        debug(f"Browser pool launched browser for thread {threading.current_thread().name}")
+
+    def _stop(self, slot):
+        try:
+            if slot.browser is not None:
+                slot.browser.close()
+        except Exception as e:
+            error(f"Browser pool failed closing browser: {e}")
+        slot.browser = None
+        slot.context = None
+
+    # Yields a new page in the calling thread's long-lived browser context, the page is closed afterwards
+    @contextmanager
+    def page(self):
+        slot = self._slot()
+        if slot.is_alive() and slot.num_pages >= self.pages_per_browser:
+            debug(f"Browser pool recycling browser after {slot.num_pages} pages")
+            self._stop(slot)
+            slot.num_restarts += 1
+        if not slot.is_alive():
+            if slot.browser is not None:
+                error("Browser pool found crashed browser, restarting")
+                self._stop(slot)
+                slot.num_restarts += 1
+            self._start(slot)
+
+        page = slot.context.new_page()
+        slot.num_pages += 1
+        try:
+            yield page
+        finally:
+            try:
+                page.close()
+            except Exception:
+                pass
+            if not slot.is_alive():
+                # crashed while rendering, next page() call starts a new one
+                error("Browser pool browser crashed while rendering")
+                self._stop(slot)
+                slot.num_restarts += 1
+
+    # Closes the calling thread's browser and playwright driver
+    def release_thread(self):
+        slot = getattr(self.local, "slot", None)
+        if slot is None:
+            return
+        self._stop(slot)
+        if slot.playwright is not None:
+            slot.playwright.stop()
+            slot.playwright = None
+        self.local.slot = None
+        with self.lock:
+            self.slots.remove(slot)
+
+    def stats(self):
+        with self.lock:
+            return {"browsers": len(self.slots),
+                    "pages": sum(s.num_pages for s in self.slots),
+                    "restarts": sum(s.num_restarts for s in self.slots)}
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+# Returns the shared browser pool
+def get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = BrowserPool()
+        return _pool
+
+
+# Closes the calling thread's browser if the pool was ever used
+def release_thread():
+    if _pool is not None:
+        _pool.release_thread()
@@ -1,9 +1,12 @@
-from playwright.sync_api import sync_playwright
-
+import blob_store
+import browser_pool
+import cache_db
 import config
 import sqlite3
 from datetime import datetime
 from utils import clean_url, debug, error
+import hot_cache
+import http_session
 import os
 import requests
 
@@ -27,28 +30,83 @@ Benefits
 - Handles corpus changes (e.g., deleted, truncated, or stale files)
 - SQLite is perfect for local metadata: portable, concurrent-safe, and fast
 - You can add more metadata later: content hashes, HTTP headers, extraction success status, etc.
+
+Connections are pooled per thread and writes can be group-committed by a background writer, see cache_db.py.
+Cache hits are kept in an in-memory LRU hot tier and urls that failed with a permanent error are
+remembered in a negative cache, see hot_cache.py.
 """
 
+# was_cached value of a cached copy that was served after a request to the host: a stale copy confirmed by
+# a 304, or kept because revalidating it failed (stale-if-error). It is truthy like True, but the host was contacted.
+CACHED_AFTER_REQUEST = "after_request"
+
+# Returns the status code of a recent permanent failure for cleaned_url, None if not known to be bad
+def _known_bad_status(cleaned_url):
+    if not config.NEGATIVE_CACHE_ENABLED:
+        return None
+    return hot_cache.negative_cache.get(cleaned_url)
+
+def _remember_bad_status(cleaned_url, status_code):
+    if config.NEGATIVE_CACHE_ENABLED and status_code in config.NEGATIVE_CACHE_STATUS_CODES:
+        hot_cache.negative_cache.add(cleaned_url, status_code)
+
 # return clean_url, status_code (200 if okay), content_type, content, was_cached
-def get_cached_content_or_request(url, headers=config.headers, timeout=15):
+# if response_headers is a dict it is filled with the headers of the http response (if one was made)
+# stale cached copies (see CACHE_MAX_AGE_RULES) are revalidated with a conditional request, a 304 keeps the cached copy,
+# so do a connection error or a 5xx response (stale-if-error), was_cached is CACHED_AFTER_REQUEST then
+def get_cached_content_or_request(url, headers=config.headers, timeout=15, response_headers=None):
     cleaned_url = clean_url(url)
 
     cached_data = None
+    request_headers = headers
     if config.CACHE_ENABLED:
         cached_data = get_cached_file_content(cleaned_url, config.DB_CACHE_PATH)
+        if cached_data is not None:
+            conditional_headers = get_revalidation_headers(cleaned_url, config.DB_CACHE_PATH)
+            if conditional_headers is None:
+                content, content_type = cached_data
+                debug(f"cleaned_url {cleaned_url} was retrieved from cache")
+                return cleaned_url, 200, content_type, content, True
+            debug(f"cleaned_url {cleaned_url} cached copy is stale. Revalidating using http request...")
+            request_headers = {**headers, **conditional_headers}
 
     if cached_data is None:
+        bad_status = _known_bad_status(cleaned_url)
+        if bad_status is not None:
+            debug(f"cleaned_url {cleaned_url} recently failed with status {bad_status}, not requesting again")
+            return cleaned_url, bad_status, "", b"", False
         debug(f"cleaned_url {cleaned_url} not found in cache. Retrieving using http request...")
-        response = requests.get(url, headers=headers, timeout=timeout)
-        content_type = response.headers.get('Content-Type')
-        return cleaned_url, response.status_code, content_type, response.content, False
-    else:
+
+    try:
+        response = http_session.get(url, headers=request_headers, timeout=timeout)
+    except requests.exceptions.RequestException as e:
+        if cached_data is None:
+            raise
+        error(f"Revalidating {url} failed, using the stale cached copy: {e}")
         content, content_type = cached_data
-        debug(f"cleaned_url {cleaned_url} was retrieved from cache")
-        return cleaned_url, 200, content_type, content, True
+        return cleaned_url, 200, content_type, content, CACHED_AFTER_REQUEST
+    content_type = response.headers.get('Content-Type')
+    if response_headers is not None:
+        response_headers.update(response.headers)
+
+    if cached_data is not None and response.status_code == 304:
+        debug(f"cleaned_url {cleaned_url} not modified, using cached copy")
+        mark_cache_entry_validated(cleaned_url, response.headers.get('ETag'), response.headers.get('Last-Modified'),
+                                   config.DB_CACHE_PATH)
+        content, content_type = cached_data
+        return cleaned_url, 200, content_type, content, CACHED_AFTER_REQUEST
+    if cached_data is not None and response.status_code >= 500:
+        # the entry stays stale, so it is revalidated again next time
+        error(f"Revalidating {url} got status {response.status_code}, using the stale cached copy")
+        content, content_type = cached_data
+        return cleaned_url, 200, content_type, content, CACHED_AFTER_REQUEST
+
+    _remember_bad_status(cleaned_url, response.status_code)
+    return cleaned_url, response.status_code, content_type, response.content, False
 
 # Return tuple (cleaned_url, status_code, content_type, content, was_cached)
-def get_cached_content_or_playwright_request(url, headers=config.headers, timeout=15000):
+# if response_headers is a dict it is filled with the headers of the http response (if one was made)
+def get_cached_content_or_playwright_request(url, headers=config.headers, timeout=15000, response_headers=None):
     cleaned_url = clean_url(url)
     cached_data = None
     debug(f"fetch_or_request for {url}", flush=config.FLUSH_LOG)
@@ -61,18 +119,26 @@ def get_cached_content_or_playwright_request(url, headers=config.headers, timeou
         debug(f"cleaned_url {cleaned_url} was retrieved from cache", flush=config.FLUSH_LOG)
         return cleaned_url, 200, content_type, content, True
 
+    bad_status = _known_bad_status(cleaned_url)
+    if bad_status is not None:
+        debug(f"cleaned_url {cleaned_url} recently failed with status {bad_status}, not requesting again")
+        return cleaned_url, bad_status, "", b"", False
+
     # If not cached, check whether this is a PDF
     try:
         debug(f"cleaned_url {cleaned_url} not found in cache. Retrieving headers...", flush=config.FLUSH_LOG)
-        head_response = requests.head(url, headers=headers, timeout=timeout, allow_redirects=True)
+        head_response = http_session.head(url, headers=headers, timeout=timeout, allow_redirects=True)
         content_type = head_response.headers.get('Content-Type', '').lower()
+        if response_headers is not None:
+            response_headers.update(head_response.headers)
+        _remember_bad_status(cleaned_url, head_response.status_code)
         if head_response.status_code == 429:
             return cleaned_url, 429, content_type, "", False
 
         # Handle PDF via direct GET
         if 'application/pdf' in content_type:
             debug(f"{url} detected as PDF. Downloading via requests.", flush=config.FLUSH_LOG)
-            response = requests.get(url, headers=headers, timeout=timeout)
+            response = http_session.get(url, headers=headers, timeout=timeout)
             if response.status_code == 200:
                 return cleaned_url, 200, content_type, response.content, False
             else:
@@ -81,14 +147,14 @@ def get_cached_content_or_playwright_request(url, headers=config.headers, timeou
         # Use Playwright only for HTML
         elif 'text/html' in content_type:
             debug(f"{url} detected as HTML. Attempting Playwright rendering.", flush=config.FLUSH_LOG)
-            with sync_playwright() as pw:
-                browser = pw.chromium.launch(headless=True)
-                page = browser.new_page()
+            with browser_pool.get_pool().page() as page:
                 response = page.goto(url, timeout=timeout)
 
                 if not response:
                     raise Exception("No response received from Playwright.", flush=config.FLUSH_LOG)
-                elif response.status == 429:
+                if response_headers is not None:
+                    response_headers.update(response.headers)
+                if response.status == 429:
                     return cleaned_url, 429, content_type, "", False
                 elif response.status != 200:
                     raise Exception(f"Non-200 response for html: {response.status} for {url}")
@@ -116,9 +182,7 @@ def get_cached_content_or_playwright_request(url, headers=config.headers, timeou
 
 def get_rendered_html(url, timeout=15000):
     try:
-        with sync_playwright() as pw:
-            browser = pw.chromium.launch(headless=True)
-            page = browser.new_page()
+        with browser_pool.get_pool().page() as page:
             response = page.goto(url, timeout=timeout)
 
             if not response:
@@ -141,8 +205,53 @@ def get_rendered_html(url, timeout=15000):
         return None
 
 
+SQL_UPSERT_DOWNLOAD = '''
+    INSERT INTO downloads (cleaned_url, content_type, url_file_path, url_file_size, text_file_path, text_file_size, hash, download_time, etag, last_modified)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT(cleaned_url) DO UPDATE SET
+        url_file_path=excluded.url_file_path,
+        url_file_size=excluded.url_file_size,
+        text_file_path=excluded.text_file_path,
+        text_file_size=excluded.text_file_size,
+        download_time=excluded.download_time,
+        hash=excluded.hash,
+        etag=excluded.etag,
+        last_modified=excluded.last_modified
+'''
+SQL_MARK_DOWNLOAD_VALIDATED = '''
+    UPDATE downloads SET
+        download_time=?,
+        etag=COALESCE(?, etag),
+        last_modified=COALESCE(?, last_modified)
+    WHERE cleaned_url=?
+'''
+SQL_UPDATE_TEXT_FILE_SIZE = 'UPDATE downloads SET text_file_size=? WHERE cleaned_url=?'
+SQL_UPSERT_PENDING_URL = '''
+    INSERT INTO url_queue (url, depth_actual, depth_effective, priority)
+    VALUES (?, ?, ?, ?)
+    ON CONFLICT(url) DO UPDATE SET priority=excluded.priority
+'''
+SQL_DELETE_PENDING_URL = 'DELETE FROM url_queue WHERE url = ?'
+SQL_UPSERT_WAYBACK_LOOKUP = '''
+    INSERT INTO wayback_lookups (cleaned_url, archived_url, lookup_time) VALUES (?, ?, ?)
+    ON CONFLICT(cleaned_url) DO UPDATE SET archived_url=excluded.archived_url, lookup_time=excluded.lookup_time
+'''
+SQL_UPSERT_OCR_PAGE = '''
+    INSERT INTO ocr_pages (image_hash, text, ocr_time) VALUES (?, ?, ?)
+    ON CONFLICT(image_hash) DO UPDATE SET text=excluded.text, ocr_time=excluded.ocr_time
+'''
+SQL_INSERT_BLOB = '''
+    INSERT OR IGNORE INTO blobs (hash, blob_path, blob_size, ext)
+    VALUES (?, ?, ?, ?)
+'''
+SQL_UPSERT_URL_BLOB = '''
+    INSERT INTO url_blobs (cleaned_url, hash) VALUES (?, ?)
+    ON CONFLICT(cleaned_url) DO UPDATE SET hash=excluded.hash
+'''
+
+
 def init_db(db_path=config.DB_CACHE_PATH):
-    conn = sqlite3.connect(db_path)
+    conn = cache_db.get_connection(db_path)
     cursor = conn.cursor()
 
     # create table for url downloads cache
@@ -155,89 +264,238 @@ def init_db(db_path=config.DB_CACHE_PATH):
             text_file_path TEXT NOT NULL,
             text_file_size INTEGER NOT NULL,
             hash TEXT NOT NULL,
-            download_time TEXT NOT NULL
+            download_time TEXT NOT NULL,
+            etag TEXT,
+            last_modified TEXT
         )
     ''')
     conn.commit()
 
+    # add columns missing from databases created by older versions
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(downloads)")}
+    for column in ("etag", "last_modified"):
+        if column not in columns:
+            conn.execute(f"ALTER TABLE downloads ADD COLUMN {column} TEXT")
+    conn.commit()
+
     # create table for pending url queue persistence
     conn.execute('''
         CREATE TABLE IF NOT EXISTS url_queue (
             url TEXT PRIMARY KEY,
             depth_actual INTEGER NOT NULL,
-            depth_effective INTEGER NOT NULL
+            depth_effective INTEGER NOT NULL,
+            priority REAL NOT NULL DEFAULT 0
         );
     ''')
+    conn.commit()
+
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(url_queue)")}
+    if "priority" not in columns:
+        conn.execute("ALTER TABLE url_queue ADD COLUMN priority REAL NOT NULL DEFAULT 0")
+    conn.commit()
+
+    # create tables for the content-addressed blob store (see blob_store.py)
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS blobs (
+            hash TEXT PRIMARY KEY,
+            blob_path TEXT NOT NULL,
+            blob_size INTEGER NOT NULL,
+            ext TEXT NOT NULL
+        );
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS url_blobs (
+            cleaned_url TEXT PRIMARY KEY,
+            hash TEXT NOT NULL
+        );
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS url_blobs_hash ON url_blobs (hash)')
+    conn.commit()
+
+    # create table for Wayback Machine availability lookups (see wayback.py), archived_url is NULL if there was none
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS wayback_lookups (
+            cleaned_url TEXT PRIMARY KEY,
+            archived_url TEXT,
+            lookup_time TEXT NOT NULL
+        );
+    ''')
+    conn.commit()
+
+    # create table for the OCR text of scanned PDF pages (see ocr.py), keyed by the hash of the page images
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS ocr_pages (
+            image_hash TEXT PRIMARY KEY,
+            text TEXT NOT NULL,
+            ocr_time TEXT NOT NULL
+        );
+    ''')
+    conn.commit()
+
+
+# Starts group-committing writes (queue inserts/deletes and download upserts) in a background thread.
+# Call stop_batch_writes() to commit everything that is still queued.
+def start_batch_writes(db_path=config.DB_CACHE_PATH):
+    cache_db.start_writer(db_path)
+
+
+def stop_batch_writes():
+    cache_db.stop_writer()
+
+
+# Blocks until all queued writes are committed (no-op without a batch writer)
+def flush_batch_writes(db_path=config.DB_CACHE_PATH):
+    writer = cache_db.get_writer(db_path)
+    if writer is not None:
+        writer.flush()
+
+
+# Runs a write through the batch writer if one is running for db_path, otherwise commits it right away
+def _write(db_path, sql, params, download_row=None):
+    writer = cache_db.get_writer(db_path)
+    if writer is not None:
+        writer.submit(sql, params, download_row)
+        return
+    conn = cache_db.get_connection(db_path)
+    conn.execute(sql, params)
+    conn.commit()
+
+
+# Returns the downloads row accepted by the batch writer but not committed yet, None otherwise
+def _pending_download(db_path, cleaned_url):
+    writer = cache_db.get_writer(db_path)
+    if writer is None:
+        return None
+    return writer.get_pending_download(cleaned_url)
 
-    conn.close()
 
 def clear_cache(db_path=config.DB_CACHE_PATH, delete_db=False):
+    flush_batch_writes(db_path)
+    hot_cache.content_cache.clear()
+    hot_cache.negative_cache.clear()
     if delete_db and os.path.exists(db_path):
+        cache_db.close_connections(db_path)
         os.remove(db_path)
         debug(f"Deleted entire cache database: {db_path}")
         return
 
     # Otherwise, just clear the downloads table
     if os.path.exists(db_path):
-        conn = sqlite3.connect(db_path)
+        conn = cache_db.get_connection(db_path)
         cursor = conn.cursor()
         cursor.execute("DELETE FROM downloads")
         conn.commit()
-        conn.close()
         debug("Cleared all entries from the downloads table.")
     else:
         debug("No cache database found.")
 
-def update_cache(cleaned_url, content_type, url_file_path, url_file_size, text_file_path, text_file_size, hash, download_time=None, db_path=config.DB_CACHE_PATH):
+# etag and last_modified are the validators from the response headers, used to revalidate the entry once stale
+def update_cache(cleaned_url, content_type, url_file_path, url_file_size, text_file_path, text_file_size, hash, download_time=None, db_path=config.DB_CACHE_PATH,
+                 etag=None, last_modified=None):
     if download_time is None:
         download_time = datetime.now()
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
-    cursor.execute('''
-        INSERT INTO downloads (cleaned_url, content_type, url_file_path, url_file_size, text_file_path, text_file_size, hash, download_time)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-        ON CONFLICT(cleaned_url) DO UPDATE SET
-            url_file_path=excluded.url_file_path,
-            url_file_size=excluded.url_file_size,
-            text_file_path=excluded.text_file_path,
-            text_file_size=excluded.text_file_size,
-            download_time=excluded.download_time,
-            hash=excluded.hash
-    ''', (cleaned_url, content_type, url_file_path, url_file_size, text_file_path, text_file_size, hash, download_time))
-    conn.commit()
-    conn.close()
+    row = (cleaned_url, content_type, url_file_path, url_file_size, text_file_path, text_file_size, hash, download_time, etag, last_modified)
+    hot_cache.content_cache.invalidate((db_path, cleaned_url))
+    hot_cache.negative_cache.invalidate(cleaned_url)
+    _write(db_path, SQL_UPSERT_DOWNLOAD, row, download_row=row)
     debug(f"update_cached saved entry with cleaned_url {cleaned_url}, url_file {url_file_path}, url_file_size {url_file_size}, text_file_path {text_file_path}, text_file_size {text_file_size}, hash {hash}")
 
-def remove_download_entry(cleaned_url, db_path="cache.db"):
+# Returns the max age in seconds of a cached copy of cleaned_url, None if cached copies never go stale
+def get_max_age(cleaned_url):
+    for pattern, max_age in config.CACHE_MAX_AGE_RULES:
+        if pattern.search(cleaned_url):
+            return max_age
+    return config.CACHE_DEFAULT_MAX_AGE_SECS
+
+# Returns None while the cached copy of cleaned_url is fresh. Once it is stale returns the conditional
+# request headers (If-None-Match/If-Modified-Since) to revalidate it with, which is {} without validators.
+def get_revalidation_headers(cleaned_url, db_path=config.DB_CACHE_PATH):
+    max_age = get_max_age(cleaned_url)
+    if max_age is None:
+        return None
+
+    row = get_cached_url_data(db_path, cleaned_url)
+    if row is None:
+        return None
+    download_time, etag, last_modified = row[7], row[8], row[9]
+    if isinstance(download_time, str):
+        download_time = datetime.fromisoformat(download_time)
+    if (datetime.now() - download_time).total_seconds() < max_age:
+        return None
+
+    conditional_headers = {}
+    if etag:
+        conditional_headers['If-None-Match'] = etag
+    if last_modified:
+        conditional_headers['If-Modified-Since'] = last_modified
+    return conditional_headers
+
+# Marks the cached copy of cleaned_url as fresh again after a 304 Not Modified response
+def mark_cache_entry_validated(cleaned_url, etag=None, last_modified=None, db_path=config.DB_CACHE_PATH):
+    row = _pending_download(db_path, cleaned_url)
+    if row is not None:
+        # not committed yet, upsert the full row again so reads keep seeing it
+        update_cache(*row[:7], download_time=datetime.now(), db_path=db_path,
+                     etag=etag or row[8], last_modified=last_modified or row[9])
+        return
+    _write(db_path, SQL_MARK_DOWNLOAD_VALIDATED, (datetime.now(), etag, last_modified, cleaned_url))
+
+# Records the new size of the txt file of cleaned_url after it was written again (e.g. with the OCR text of a PDF)
+def update_text_file_size(cleaned_url, text_file_size, db_path=config.DB_CACHE_PATH):
+    row = _pending_download(db_path, cleaned_url)
+    if row is not None:
+        # not committed yet, upsert the full row again so reads keep seeing it
+        update_cache(*row[:5], text_file_size, row[6], download_time=row[7], db_path=db_path,
+                     etag=row[8], last_modified=row[9])
+        return
+    _write(db_path, SQL_UPDATE_TEXT_FILE_SIZE, (text_file_size, cleaned_url))
+
+def remove_download_entry(cleaned_url, db_path=config.DB_CACHE_PATH):
+    hot_cache.content_cache.invalidate((db_path, cleaned_url))
     try:
-        conn = sqlite3.connect(db_path)
-        cursor = conn.cursor()
-        cursor.execute("DELETE FROM downloads WHERE cleaned_url = ?", (cleaned_url,))
-        conn.commit()
+        writer = cache_db.get_writer(db_path)
+        if writer is not None:
+            writer.forget_pending_download(cleaned_url)
+        _write(db_path, "DELETE FROM downloads WHERE cleaned_url = ?", (cleaned_url,))
     except sqlite3.Error as e:
         error(f"Error removing entry from downloads table: {e}")
-    finally:
-        conn.close()
+
+# Drops the cached copy of cleaned_url if it was downloaded before modified_time (e.g. a sitemap lastmod),
+# so the next request fetches it again. Returns True if it was dropped.
+def expire_if_modified(cleaned_url, modified_time, db_path=config.DB_CACHE_PATH):
+    row = get_cached_url_data(db_path, cleaned_url)
+    if row is None:
+        return False
+    download_time = row[7]
+    if isinstance(download_time, str):
+        download_time = datetime.fromisoformat(download_time)
+    if download_time >= modified_time:
+        return False
+    debug(f"cache expiring {cleaned_url} downloaded {download_time}, modified {modified_time}")
+    remove_download_entry(cleaned_url, db_path)
+    return True
 
 # Get metadata associated with cached url, returns None if not found
 def get_cached_url_data(db_path, cleaned_url):
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
-    cursor.execute("SELECT * FROM downloads WHERE cleaned_url = ?", (cleaned_url,))
-    row = cursor.fetchone()
-    conn.close()
-    return row
+    row = _pending_download(db_path, cleaned_url)
+    if row is not None:
+        return row
+    conn = cache_db.get_connection(db_path)
+    cursor = conn.execute("SELECT * FROM downloads WHERE cleaned_url = ?", (cleaned_url,))
+    return cursor.fetchone()
 
 # Returns url_file_path, url_file_size, text_file_path, text_file_size
 def get_cached_file_info(cleaned_url, db_path=config.DB_CACHE_PATH):
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
-    cursor.execute('SELECT url_file_path, url_file_size, text_file_path, text_file_size FROM downloads WHERE cleaned_url=?', (cleaned_url,))
-    row = cursor.fetchone()
-    conn.close()
+    row = _pending_download(db_path, cleaned_url)
+    if row is not None:
+        row = (row[2], row[3], row[4], row[5])
+    else:
+        conn = cache_db.get_connection(db_path)
+        cursor = conn.execute('SELECT url_file_path, url_file_size, text_file_path, text_file_size FROM downloads WHERE cleaned_url=?', (cleaned_url,))
+        row = cursor.fetchone()
 
     if row:
-        file_path, expected_size = row
+        file_path, expected_size = row[0], row[1]
         if os.path.exists(file_path):
             actual_size = os.path.getsize(file_path)
             if actual_size == expected_size:
@@ -246,48 +504,97 @@ def get_cached_file_info(cleaned_url, db_path=config.DB_CACHE_PATH):
 
 # Returns (contents, content_type) if cached, None otherwise
 def get_cached_file_content(cleaned_url, db_path=config.DB_CACHE_PATH):
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
-    cursor.execute('SELECT url_file_path, url_file_size, content_type FROM downloads WHERE cleaned_url=?', (cleaned_url,))
-    row = cursor.fetchone()
-    conn.close()
+    if config.HOT_CACHE_ENABLED:
+        cached_data = hot_cache.content_cache.get((db_path, cleaned_url))
+        if cached_data is not None:
+            return cached_data
+
+    row = _pending_download(db_path, cleaned_url)
+    if row is not None:
+        row = (row[2], row[3], row[1])
+    else:
+        conn = cache_db.get_connection(db_path)
+        cursor = conn.execute('SELECT url_file_path, url_file_size, content_type FROM downloads WHERE cleaned_url=?', (cleaned_url,))
+        row = cursor.fetchone()
 
     if row:
         file_path, expected_size, content_type = row
         if os.path.exists(file_path):
             actual_size = os.path.getsize(file_path)
             if actual_size == expected_size:
-                with open(file_path, 'rb') as file:
-                    contents = file.read()
-                    return contents, content_type
+                contents = blob_store.read_file(file_path)
+                if config.HOT_CACHE_ENABLED:
+                    hot_cache.content_cache.put((db_path, cleaned_url), (contents, content_type), len(contents))
+                return contents, content_type
         else:
             debug(f"cache removing bad entry for url {cleaned_url}")
-            remove_download_entry(cleaned_url) # remove bad entries
+            remove_download_entry(cleaned_url, db_path) # remove bad entries
 
     return None
 
-def save_pending_url_to_db(url, depth_actual, depth_effective, db_path=config.DB_CACHE_PATH):
-    with sqlite3.connect(db_path) as conn:
-        conn.execute('''
-            INSERT OR IGNORE INTO url_queue (url, depth_actual, depth_effective)
-            VALUES (?, ?, ?)
-        ''', (url, depth_actual, depth_effective))
-        conn.commit()
+# Saves a pending url, or updates its priority if it is already saved
+def save_pending_url_to_db(url, depth_actual, depth_effective, priority=0, db_path=config.DB_CACHE_PATH):
+    _write(db_path, SQL_UPSERT_PENDING_URL, (url, depth_actual, depth_effective, priority))
 
 def delete_pending_url_from_db(url, db_path=config.DB_CACHE_PATH):
-    with sqlite3.connect(db_path) as conn:
-        conn.execute('DELETE FROM url_queue WHERE url = ?', (url,))
-        conn.commit()
-
-def load_pending_urls_from_db(url_queue, db_path=config.DB_CACHE_PATH):
-    with sqlite3.connect(db_path) as conn:
-        cursor = conn.execute('SELECT url, depth_actual, depth_effective FROM url_queue')
-        rows = cursor.fetchall()
-        # populate the url_queue
-        for url, depth_actual, depth_effective in rows:
+    _write(db_path, SQL_DELETE_PENDING_URL, (url,))
+
+# Puts the pending urls into url_queue, best first. With restore_priority the saved priority is passed
+# to url_queue.put (for a host_scheduler.HostFrontier)
+def load_pending_urls_from_db(url_queue, restore_priority=False, db_path=config.DB_CACHE_PATH):
+    flush_batch_writes(db_path)
+    conn = cache_db.get_connection(db_path)
+    cursor = conn.execute('SELECT url, depth_actual, depth_effective, priority FROM url_queue '
+                          'ORDER BY priority DESC, rowid')
+    rows = cursor.fetchall()
+    # populate the url_queue
+    for url, depth_actual, depth_effective, priority in rows:
+        if restore_priority:
+            url_queue.put((url, depth_actual, depth_effective), priority)
+        else:
             url_queue.put((url, depth_actual, depth_effective))
 
 def clear_pending_url_queue_db(db_path=config.DB_CACHE_PATH):
-    with sqlite3.connect(db_path) as conn:
-        conn.execute('DELETE FROM url_queue')
-        conn.commit()
\ No newline at end of file
+    flush_batch_writes(db_path)
+    conn = cache_db.get_connection(db_path)
+    conn.execute('DELETE FROM url_queue')
+    conn.commit()
+
+# Returns (archived_url, lookup_time) of the last Wayback Machine lookup of cleaned_url, None if never looked up
+def get_wayback_lookup(cleaned_url, db_path=config.DB_CACHE_PATH):
+    conn = cache_db.get_connection(db_path)
+    row = conn.execute('SELECT archived_url, lookup_time FROM wayback_lookups WHERE cleaned_url = ?',
+                       (cleaned_url,)).fetchone()
+    if row is None:
+        return None
+    archived_url, lookup_time = row
+    if isinstance(lookup_time, str):
+        lookup_time = datetime.fromisoformat(lookup_time)
+    return archived_url, lookup_time
+
+def save_wayback_lookup(cleaned_url, archived_url, db_path=config.DB_CACHE_PATH):
+    _write(db_path, SQL_UPSERT_WAYBACK_LOOKUP, (cleaned_url, archived_url, datetime.now()))
+
+# Returns the OCR text of the page with image hash image_hash, None if it was not OCRed yet
+def get_ocr_text(image_hash, db_path=config.DB_CACHE_PATH):
+    conn = cache_db.get_connection(db_path)
+    row = conn.execute('SELECT text FROM ocr_pages WHERE image_hash = ?', (image_hash,)).fetchone()
+    return row[0] if row is not None else None
+
+def save_ocr_text(image_hash, text, db_path=config.DB_CACHE_PATH):
+    _write(db_path, SQL_UPSERT_OCR_PAGE, (image_hash, text, datetime.now()))
+
+# Records that cleaned_url's content is stored in the blob with hash hash_val
+def save_url_blob(cleaned_url, hash_val, blob_path, blob_size, ext, db_path=config.DB_CACHE_PATH):
+    _write(db_path, SQL_INSERT_BLOB, (hash_val, blob_path, blob_size, ext))
+    _write(db_path, SQL_UPSERT_URL_BLOB, (cleaned_url, hash_val))
+
+# Returns a list of (cleaned_url, blob_path, ext) for every url stored in the blob store
+def get_url_blobs(db_path=config.DB_CACHE_PATH):
+    flush_batch_writes(db_path)
+    conn = cache_db.get_connection(db_path)
+    cursor = conn.execute('''
+        SELECT url_blobs.cleaned_url, blobs.blob_path, blobs.ext
+        FROM url_blobs JOIN blobs ON url_blobs.hash = blobs.hash
+    ''')
+    return cursor.fetchall()
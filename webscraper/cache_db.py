@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+
+"""This module provides the sqlite access layer behind cache.py.
+
+- connections are kept open per thread and per database (no connect/close per call), which also lets
+  sqlite reuse its compiled (prepared) statements through the connection statement cache
+- databases run in WAL mode with synchronous=NORMAL, so readers don't block the writer and a commit
+  doesn't need a full fsync
+- an optional background CacheWriter group-commits write operations (queue inserts/deletes and download
+  upserts) in batches, so many pages share one transaction instead of each paying its own commits
+
+While a writer is running, rows it has accepted but not committed yet are kept in memory so that reads
+through cache.py still see their own writes.
+"""
+import queue
+import sqlite3
+import threading
+import time
+
+import config
+from utils import debug, error
+
+_local = threading.local()
+
+# Marker operations understood by the writer thread
+_FLUSH = "flush"
+_STOP = "stop"
+
+
+def connect(db_path):
+    conn = sqlite3.connect(db_path, timeout=30, cached_statements=256)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+
+# Returns the calling thread's connection to db_path, opening it on first use
+def get_connection(db_path):
+    connections = getattr(_local, "connections", None)
+    if connections is None:
+        connections = {}
+        _local.connections = connections
+    conn = connections.get(db_path)
+    if conn is None:
+        conn = connect(db_path)
+        connections[db_path] = conn
+    return conn
+
+
+# Closes the calling thread's connections (to db_path only if given)
+def close_connections(db_path=None):
+    connections = getattr(_local, "connections", {})
+    for path in list(connections):
+        if db_path is None or path == db_path:
+            connections.pop(path).close()
+
+
+class CacheWriter:
+    def __init__(self, db_path, batch_size=config.CACHE_WRITE_BATCH_SIZE, max_delay=config.CACHE_WRITE_BATCH_SECS):
+        self.db_path = db_path
+        self.batch_size = batch_size
+        self.max_delay = max_delay
+        self.ops = queue.Queue()
+        self.lock = threading.Lock()
+        # cleaned_url -> downloads row, for upserts accepted but not committed yet
+        self.pending_downloads = {}
+        self.num_ops = 0
+        self.num_batches = 0
+        self.thread = threading.Thread(target=self._run, name="cache-writer", daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    # Queues a write. download_row is given for downloads upserts so reads can see it before the commit.
+    def submit(self, sql, params, download_row=None):
+        if download_row is not None:
+            with self.lock:
+                self.pending_downloads[download_row[0]] = download_row
+        self.ops.put((sql, params, download_row))
+
+    def get_pending_download(self, cleaned_url):
+        with self.lock:
+            return self.pending_downloads.get(cleaned_url)
+
+    def forget_pending_download(self, cleaned_url):
+        with self.lock:
+            self.pending_downloads.pop(cleaned_url, None)
+
+    # Blocks until everything submitted so far is committed
+    def flush(self):
+        done = threading.Event()
+        self.ops.put((_FLUSH, done, None))
+        done.wait()
+
+    def stop(self):
+        self.ops.put((_STOP, None, None))
+        self.thread.join()
+
+    def _next_batch(self):
+        batch = [self.ops.get()]
+        deadline = time.monotonic() + self.max_delay
+        while len(batch) < self.batch_size and batch[-1][0] not in (_FLUSH, _STOP):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.ops.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    # Commits the writes in one transaction. If one of them fails the batch is rolled back and the writes are
+    # committed one at a time, so only the failing ones are lost. Returns the indexes of the failed writes.
+    def _commit(self, conn, writes):
+        try:
+            for sql, params, _ in writes:
+                conn.execute(sql, params)
+            conn.commit()
+            self.num_ops += len(writes)
+            self.num_batches += 1
+            return set()
+        except sqlite3.Error as e:
+            error(f"Cache writer failed committing batch of {len(writes)} writes, retrying them one by one: {e}")
+            conn.rollback()
+
+        failed = set()
+        for i, (sql, params, _) in enumerate(writes):
+            try:
+                conn.execute(sql, params)
+                conn.commit()
+                self.num_ops += 1
+            except sqlite3.Error as e:
+                error(f"Cache writer dropped write {sql.split()[0]} with params {params}: {e}")
+                conn.rollback()
+                failed.add(i)
+        self.num_batches += 1
+        return failed
+
+    def _run(self):
+        conn = connect(self.db_path)
+        running = True
+        while running:
+            batch = self._next_batch()
+            writes = [op for op in batch if op[0] not in (_FLUSH, _STOP)]
+            if writes:
+                failed = self._commit(conn, writes)
+                with self.lock:
+                    for i, (_, _, row) in enumerate(writes):
+                        # only forget the row if it was committed and wasn't replaced by a newer upsert meanwhile
+                        if row is not None and i not in failed and self.pending_downloads.get(row[0]) is row:
+                            del self.pending_downloads[row[0]]
+
+            for sql, params, _ in batch:
+                if sql == _FLUSH:
+                    params.set()
+                elif sql == _STOP:
+                    running = False
+        conn.close()
+        debug(f"Cache writer committed {self.num_ops} writes in {self.num_batches} batches")
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+# Starts group-committing cache writes for db_path in a background thread
+def start_writer(db_path):
+    global _writer
+    with _writer_lock:
+        if _writer is None:
+            _writer = CacheWriter(db_path)
+            _writer.start()
+        return _writer
+
+
+# Commits all queued writes and stops the background writer
+def stop_writer():
+    global _writer
+    with _writer_lock:
+        writer = _writer
+        _writer = None
+    if writer is not None:
+        writer.stop()
+
+
+# Returns the running writer if it serves db_path, None otherwise
+def get_writer(db_path):
+    writer = _writer
+    if writer is not None and writer.db_path == db_path:
+        return writer
+    return None
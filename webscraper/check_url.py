@@ -1,5 +1,6 @@
 import sys
 import config
+import url_filter
 
 
 def main():
@@ -18,8 +19,9 @@ def main():
     else:
         print(f"URL is NOT in Home Domain(s) {url}")
 
-    if config.pattern_filter_list.search(url):
-        print(f"URL was FILTERED: {url}")
+    reason = url_filter.classify(url)
+    if reason != url_filter.ACCEPTED:
+        print(f"URL was FILTERED ({reason}): {url}")
 
 if __name__ == "__main__":
     main()
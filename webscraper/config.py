@@ -1,4 +1,5 @@
 #!/usr/bin/env python3
+import os
 import re
 
 # config.py
@@ -8,11 +9,61 @@ import re
 CORPUS_FOLDER_LOCATION = "./corpus/"                           # Nate's setting
 #CORPUS_FOLDER_LOCATION = "C:\\Users\\rames\\ai\\CrawlTest\\"  # Marc's setting
 
+# content-addressed blob store for fetched html/pdf files (see blob_store.py)
+# when disabled files are saved flat into CORPUS_FOLDER_LOCATION named after their url
+CORPUS_BLOB_STORE_ENABLED = False
+BLOB_STORE_LOCATION = "./corpus_blobs/"
+BLOB_STORE_COMPRESS = True                  # zstd-compress blobs (needs the zstandard package)
+BLOB_STORE_COMPRESS_EXTENSIONS = ("html",)  # pdfs are already compressed
+BLOB_STORE_COMPRESS_LEVEL = 6
+
 # Set your db cache metadata location
 DB_CACHE_LOCATION = "./db_cache/"
 DB_CACHE_NAME = "meta_cache.db"
 DB_CACHE_PATH = DB_CACHE_LOCATION + DB_CACHE_NAME
 
+# visited url store of the crawler (see visited_store.py), snapshotted next to the cache db
+# the snapshot is kept when a crawl stops early and restored when the pending queue is resumed
+VISITED_STORE_PATH = DB_CACHE_LOCATION + "visited_urls.bin"
+VISITED_STORE_INITIAL_CAPACITY = 1_000_000      # urls before the table first grows
+VISITED_STORE_SNAPSHOT_EVERY_N = 50_000         # new urls between snapshots
+
+# content hashes seen by the crawler (see seen_filter.py), a scalable bloom filter memory-mapped under DB_CACHE_LOCATION
+# kept and reloaded together with the visited url store, so resumed crawls dedup against everything seen before
+SEEN_FILTER_LOCATION = DB_CACHE_LOCATION + "seen_content/"
+SEEN_FILTER_INITIAL_CAPACITY = 1_000_000    # hashes in the first slice, each further slice doubles
+SEEN_FILTER_ERROR_RATE = 0.00001            # overall false positive rate
+
+# near-duplicate detection of extracted html text (see near_dup.py)
+# new pages whose text is a near duplicate of an already saved page are not saved (their links are still followed)
+NEAR_DUP_ENABLED = True
+NEAR_DUP_MAX_DISTANCE = 3                   # max differing SimHash bits of near duplicates
+NEAR_DUP_MIN_WORDS = 50                     # shorter texts are never treated as near duplicates
+NEAR_DUP_INDEX_PATH = DB_CACHE_LOCATION + "near_dup.bin"
+
+# how long a cached copy is trusted before it is revalidated with a conditional request (If-None-Match/If-Modified-Since)
+# rules are (pattern on cleaned_url, max age in seconds), the first matching rule wins
+# None means cached copies never go stale and are never requested again
+CACHE_DEFAULT_MAX_AGE_SECS = None
+CACHE_MAX_AGE_RULES = [
+    (re.compile(r"^[^/]+$"), 24 * 60 * 60),                                                 # site home pages
+    (re.compile(r"/(archives?|category|categories|tags?|page)(/|$)", re.IGNORECASE), 24 * 60 * 60),  # listing pages link new articles
+]
+
+# batching of cache db writes during a crawl (see cache_db.py)
+CACHE_WRITE_BATCH_SIZE = 500        # max writes committed in one transaction
+CACHE_WRITE_BATCH_SECS = 0.5        # max time a write waits for its batch to fill up
+
+# in-memory hot tier in front of the download cache (see hot_cache.py)
+HOT_CACHE_ENABLED = True
+HOT_CACHE_MAX_BYTES = 256 * 1024 * 1024     # total size of cached contents kept in memory
+HOT_CACHE_MAX_ITEM_BYTES = 4 * 1024 * 1024  # larger contents (big PDFs) are never kept in memory
+
+# negative cache of urls that recently failed with a permanent error
+NEGATIVE_CACHE_ENABLED = True
+NEGATIVE_CACHE_TTL_SECS = 6 * 60 * 60
+NEGATIVE_CACHE_STATUS_CODES = (404, 410)
+
 # Set your log file locations
 LOGS_FOLDER_LOCATION = "./logs/"                            # Nate's setting
 #LOGS_FOLDER_LOCATION = "C:\\Users\\rames\\ai\\CrawlTest\\"  # Marc's setting
@@ -38,6 +89,15 @@ PROGRESS_REPORT_N_PAGES = 25
 RATELIMIT_RETRIES = 3
 RATELIMIT_RETRY_TIME_SECS = 0.1
 
+# per-host politeness scheduler settings (see host_scheduler.py)
+# concurrency and delay start at these values and adapt to latency, 429s and Retry-After
+SCHED_HOST_INITIAL_CONCURRENCY = 2      # concurrent requests allowed per host at start
+SCHED_HOST_MAX_CONCURRENCY = 6          # upper bound for concurrent requests per host
+SCHED_HOST_MIN_DELAY_SECS = 0.25        # starting delay between requests to the same host
+SCHED_HOST_DELAY_FLOOR_SECS = 0.05      # delay never shrinks below this
+SCHED_HOST_MAX_DELAY_SECS = 60.0        # delay and Retry-After waits are capped at this
+SCHED_HOST_LATENCY_TARGET_SECS = 3.0    # hosts slower than this on average get less concurrency
+
 # crawler behavior
 ENABLE_PROCESS_PDFS = True          # for testing
 SAVE_HTML_CONTENT = True            # for testing
@@ -50,16 +110,64 @@ LOAD_PENDING_QUEUE_ON_START = True  # set to true to load the pending queue on s
 # enumerates possible crawler fetch strategy
 CRAWLER_FETCH_REQUESTS = 1
 CRAWLER_FETCH_PLAYWRIGHT = 2
+CRAWLER_FETCH_AIOHTTP = 3           # asyncio crawl engine (see web_scraper_async.py)
 
 # this is the fetch strategy that the crawler will use
 CRAWLER_FETCH_STRATEGY = CRAWLER_FETCH_REQUESTS
 #CRAWLER_FETCH_STRATEGY = CRAWLER_FETCH_PLAYWRIGHT
+#CRAWLER_FETCH_STRATEGY = CRAWLER_FETCH_AIOHTTP
+
+# asyncio crawl engine settings (only used with CRAWLER_FETCH_AIOHTTP)
+ASYNC_MAX_IN_FLIGHT = 200           # max number of concurrent fetches
+ASYNC_LIMIT_PER_HOST = 16           # max number of concurrent connections to a single host
+ASYNC_EXECUTOR_WORKERS = 8          # threads used for parsing and file/db work off the event loop
+ASYNC_REQUEST_TIMEOUT_SECS = 15
+
+# process pool for html/pdf parsing and text extraction in the multi-threaded crawler (see extract_pool.py)
+# fetch threads only do network i/o and hand pages to the extraction stage through a bounded queue
+EXTRACT_PROCESS_POOL_ENABLED = True
+EXTRACT_PROCESSES = os.cpu_count() or 4     # extraction processes (and threads feeding them)
+EXTRACT_QUEUE_SIZE = 64                     # fetched pages waiting for extraction, fetching blocks when full
+EXTRACT_MAX_TASKS_PER_CHILD = 1000          # restart an extraction process after this many pages (memory)
+PDF_PARALLEL_MIN_PAGES = 100                # larger PDFs are split into page ranges extracted by all processes
+PDF_PARALLEL_RANGE_PAGES = 25               # pages per range
+PDF_FILTER_BATCH_PAGES = 16                 # pages whose blocks are filtered (and held in memory) at once, see PageSpans
+
+# playwright browser pool settings (see browser_pool.py)
+PLAYWRIGHT_PAGES_PER_BROWSER = 200                                  # restart a browser after this many pages
+PLAYWRIGHT_BLOCKED_RESOURCE_TYPES = {"image", "font", "media"}      # not needed for rendered html
 
 # test url for testing pdf functionality
 TEST_PDF_URL = "https://ontheline.trincoll.edu/images/bookdown/sample-local-pdf.pdf"
 
+# shared http session settings (see http_session.py)
+HTTP_POOL_NUM_HOSTS = 32            # number of hosts to keep connection pools for
+HTTP_POOL_MAXSIZE_PER_HOST = 12     # kept-alive connections per host, match the number of crawl workers
+HTTP_RETRIES = 2                    # retries for connection errors and 500/502/504 responses
+HTTP_RETRY_BACKOFF_SECS = 0.5       # exponential backoff factor between retries
+HTTP_DEFAULT_TIMEOUT_SECS = 30      # used when a caller doesn't pass a timeout
+
 # Wayback Machine API endpoint
 WAYBACK_API = "http://archive.org/wayback/available"
+
+# recovery of broken links from the Wayback Machine (see wayback.py), runs in its own thread pool
+WAYBACK_ENABLED = True
+WAYBACK_WORKERS = 4                         # concurrent archive.org lookups and downloads
+WAYBACK_MAX_PENDING = 1000                  # broken links waiting for recovery, more are not recovered
+WAYBACK_TIMEOUT_SECS = 20
+WAYBACK_NEGATIVE_TTL_SECS = 7 * 24 * 60 * 60    # urls without a snapshot are looked up again after this
+
+# OCR of scanned PDF pages (see ocr.py), runs in its own low-priority process pool
+# needs Tesseract with its language data (PyMuPDF OCR), the pool is not started without it
+OCR_ENABLED = True
+OCR_MIN_PAGE_CHARS = 50                     # pages with an image and less text than this are OCRed
+OCR_PROCESSES = 1                           # concurrent OCR processes
+OCR_NICENESS = 10                           # added to the niceness of the OCR processes
+OCR_MAX_PENDING = 100                       # PDFs waiting for OCR, more are not OCRed
+OCR_LANGUAGE = "eng"
+OCR_DPI = 300
+OCR_TESSDATA = None                         # tessdata folder, None to use TESSDATA_PREFIX or the Tesseract install
+OCR_SPOOL_LOCATION = DB_CACHE_LOCATION + "ocr_spool/"   # PDFs waiting for OCR
 headers = {"User-Agent": "AiBot/1.0"}
 
 # These are the sites we will be visiting
@@ -98,6 +206,7 @@ pattern_archive_url = re.compile(r"""
 pattern_hash_url = r'#([\w-]+)$'
 
 # don't visit any urls that match this
+# regex form of the URL_FILTER_* rules below, should_visit uses url_filter.py (compared in bench_url_filter.py)
 pattern_filter_list = re.compile(r"""
     ^java?script:              |  # javascript links
     ^mailto:                   |  # mailto links
@@ -130,3 +239,68 @@ pattern_filter_list = re.compile(r"""
     \.mil\b                       # military domains
 """, re.VERBOSE | re.IGNORECASE)
 
+
+# url filter rules of should_visit (see url_filter.py), the structured form of pattern_filter_list
+URL_FILTER_SCHEMES = {"javascript", "javscript", "mailto", "tel"}
+URL_FILTER_DOMAINS = {                      # these domains and all their subdomains
+    "amazon.com", "youtube.com", "youtu.be", "instagram.com", "facebook.com", "tiktok.com", "twitter.com", "x.com",
+    "linkedin.com", "reddit.com", "pinterest.com", "snapchat.com", "nytimes.com", "washingtontimes.com", "cnn.com",
+    "foxnews.com", "nbcnews.com", "abcnews.go.com", "example.com", "example.org", "rumble.com", "wa.me",
+}
+URL_FILTER_DOMAIN_LABELS = {"gov", "mil"}   # hosts with one of these labels after the first (*.gov, *.gov.uk, *.mil)
+URL_FILTER_KEYWORDS = ("redirect", "sign-in")   # anywhere in the url
+URL_FILTER_ARCHIVE_DOMAINS = {"web.archive.org"}
+URL_FILTER_IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".gif", ".png"}
+URL_FILTER_SUBSTACK_DOMAIN = "substack.com"     # comment pages (query keys with "comment") of substack hosts
+
+# url canonicalization (see url_canon.py), applied when urls are queued and to cache keys
+CANON_TRACKING_PARAMS = {"fbclid", "gclid", "dclid", "msclkid", "mc_cid", "mc_eid", "_ga", "_hsenc", "_hsmi",
+                         "igshid", "yclid", "ref_src", "ref_url"}
+CANON_TRACKING_PARAM_PREFIXES = ("utm_",)
+# per-host rules, matched by domain suffix (without www.)
+#   "www": True/False to always use the www./bare host, "drop_params": more parameters to remove,
+#   "lowercase_path": True for hosts with case-insensitive paths
+CANON_HOST_RULES = {
+    "wanttoknow.info": {"www": True},
+    "momentoflove.org": {"www": True},
+    "substack.com": {"drop_params": {"r", "s", "triedredirect", "showwelcome", "next"}},
+}
+
+# crawl frontier priority (see url_priority.py), urls with a higher score are crawled first
+PRIORITY_PEERS_FAMILY = 100.0       # bonus for urls of the peers family sites
+PRIORITY_PER_DEPTH = -10.0          # per hop from the start url
+PRIORITY_PER_INLINK = 5.0           # times log2(1 + number of pages linking to the url)
+PRIORITY_ARTICLE_URL = 20.0         # url looks like an article (slug, dated path, pdf)
+PRIORITY_LISTING_URL = -25.0        # url looks like a tag/archive/search/paging page
+PRIORITY_QUERY_STRING = -5.0        # url has a query string
+
+# urls that look like article pages: long hyphenated slugs, dated paths, documents
+pattern_priority_article_url = re.compile(r"""
+    /[a-z0-9]+(-[a-z0-9]+){3,}(\.s?html?|\.php)?/?$   |  # slug of at least four words
+    /(19|20)\d\d/\d\d?/                              |  # dated path like /2021/05/
+    \.pdf$
+""", re.VERBOSE | re.IGNORECASE)
+
+# urls that look like listing pages with mostly links to other pages
+pattern_priority_listing_url = re.compile(r"""
+    /(tags?|category|categories|archives?|author|search|feed|page|comments?|login|register)(/|$)  |
+    [?&](page|p|s|q|replytocom|share)=
+""", re.VERBOSE | re.IGNORECASE)
+
+# sitemap and feed discovery (see discovery.py)
+# the first time the crawl reaches a peers family host, the urls of its sitemaps (from robots.txt) and feeds are queued
+# a cached page whose sitemap lastmod (or feed date) is newer than its download time is fetched again
+DISCOVERY_ENABLED = True
+DISCOVERY_DEFAULT_SITEMAPS = ["/sitemap.xml", "/sitemap_index.xml", "/wp-sitemap.xml"]  # tried if robots.txt lists none
+DISCOVERY_FEEDS = ["/feed"]                 # WordPress and Substack feeds
+DISCOVERY_MAX_SITEMAPS = 500                # max sitemap files fetched per host (sitemap indexes nest)
+DISCOVERY_MAX_XML_BYTES = 50 * 1024 * 1024  # sitemaps are at most 50MB uncompressed
+DISCOVERY_TIMEOUT_SECS = 30
+DISCOVERY_WORKERS = 2                       # hosts discovered at once, fetches follow the host's politeness delay
+
+# batch conversion of the corpus html/pdf files to txt (see batch_convert.py)
+BATCH_CONVERT_MANIFEST_PATH = DB_CACHE_LOCATION + "convert_manifest.db"
+BATCH_CONVERT_WORKERS = os.cpu_count() or 4
+BATCH_CONVERT_TIMEOUT_SECS = 120            # a file taking longer is recorded as timed out and its worker replaced
+BATCH_CONVERT_MAX_TASKS_PER_WORKER = 500    # worker processes are replaced after this many files
+BATCH_CONVERT_COMMIT_EVERY_N = 100          # manifest rows committed at once, an interrupted run resumes from here
@@ -1,12 +1,39 @@
 from newspaper import Article
+from newspaper.cleaners import DocumentCleaner
+from newspaper.outputformatters import OutputFormatter
 
 import utils
 
+
+# The steps of newspaper3k's Article.parse that give the title and the text, run on an already parsed tree.
+# Only this first parse is shared, newspaper3k still parses the text fragments it rewrites while cleaning.
+def _parse_shared_doc(article, doc):
+    article.set_title(article.extractor.get_title(doc))
+    output_formatter = OutputFormatter(article.config)
+    if article.config.use_meta_language:
+        article.set_meta_language(article.extractor.get_meta_lang(doc))
+        article.extractor.update_language(article.meta_lang)
+        output_formatter.update_language(article.meta_lang)
+
+    doc = DocumentCleaner(article.config).clean(doc)
+    top_node = article.extractor.calculate_best_node(doc)
+    if top_node is not None:
+        top_node = article.extractor.post_cleanup(top_node)
+        text, _ = output_formatter.get_formatted(top_node)
+        article.set_text(text)
+
+
 # This strategy extracts the content using newspaper3k
-def extract_content_newspaper(html_content):
+# If page (an html_pipeline.ParsedPage) is given its tree is reused, newspaper3k cleans it in place
+def extract_content_newspaper(html_content, page=None):
     article = Article(url="https://dummy.com")  # dummy url
-    article.set_html(html_content)
-    article.parse()
+    if page is not None:
+        if not page.html_text:
+            return "", ""
+        _parse_shared_doc(article, page.doc)
+    else:
+        article.set_html(html_content)
+        article.parse()
     return article.title, article.text
 
 
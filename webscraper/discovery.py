@@ -0,0 +1,288 @@
+#!/usr/bin/env python3
+
+"""This module provides sitemap and feed discovery for seeding the crawl.
+
+Following navbar and archive links finds the articles of a large site only after hours of crawling.
+Most sites list all of them in their sitemaps and the newest ones in their feeds, so the first time the
+crawler reaches a peers family host SiteDiscovery reads (in its own DISCOVERY_WORKERS threads, every fetch
+waits for the host's politeness delay in the crawl frontier, or in a frontier of its own in the async engine):
+- robots.txt for its Sitemap: lines (or the DISCOVERY_DEFAULT_SITEMAPS if it lists none)
+- the sitemaps, following nested sitemap indexes, gzipped or not
+- the DISCOVERY_FEEDS (RSS or Atom, as served by WordPress and Substack)
+and returns every page url with its lastmod (or feed date). The crawler queues them and drops the cache
+entries of pages changed since they were downloaded (see web_scraper_base.discover_site_urls), so a
+re-crawl fetches exactly the pages that changed.
+
+Sitemaps and feeds reached by following links are parsed the same way (see web_scraper_base.process_page).
+"""
+import email.utils
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from urllib.parse import urljoin, urlparse
+
+import requests
+from lxml import etree
+
+import config
+import http_session
+from utils import debug, error
+
+# kinds of xml documents parse_discovery_xml understands
+SITEMAP_INDEX = "sitemapindex"
+SITEMAP = "urlset"
+FEED = "feed"
+
+_xml_parser = etree.XMLParser(recover=True, resolve_entities=False, no_network=True)
+
+
+# Returns the content, gunzipped if it is gzip data, None if it is larger than DISCOVERY_MAX_XML_BYTES
+def decompress(content):
+    if content[:2] != b"\x1f\x8b":
+        return content if len(content) <= config.DISCOVERY_MAX_XML_BYTES else None
+    decompressor = zlib.decompressobj(zlib.MAX_WBITS | 16)
+    try:
+        data = decompressor.decompress(content, config.DISCOVERY_MAX_XML_BYTES + 1)
+    except zlib.error as e:
+        error(f"Discovery failed to gunzip content: {e}")
+        return None
+    return data if len(data) <= config.DISCOVERY_MAX_XML_BYTES else None
+
+
+# Returns a naive local datetime (like the cache's download times) for a W3C or RFC 822 date, None if invalid
+def parse_date(text):
+    if not text:
+        return None
+    text = text.strip()
+    try:
+        date = datetime.fromisoformat(text.replace("Z", "+00:00"))
+    except ValueError:
+        try:
+            date = email.utils.parsedate_to_datetime(text)
+        except (TypeError, ValueError):
+            return None
+    if date.tzinfo is not None:
+        date = date.astimezone().replace(tzinfo=None)
+    return date
+
+
+def _local_name(element):
+    return etree.QName(element).localname if isinstance(element.tag, str) else ""
+
+
+def _child_text(element, name):
+    for child in element:
+        if _local_name(child) == name and child.text:
+            return child.text.strip()
+    return None
+
+
+# Parses a sitemap index, sitemap or RSS/Atom feed, relative urls are resolved against base_url.
+# Returns (kind, [(url, lastmod)]) with kind SITEMAP_INDEX, SITEMAP or FEED, (None, []) for any other content.
+def parse_discovery_xml(content, base_url=None):
+    content = decompress(content)
+    if not content:
+        return None, []
+    try:
+        root = etree.fromstring(content, _xml_parser)
+    except (etree.XMLSyntaxError, ValueError):
+        return None, []
+    if root is None:
+        return None, []
+
+    def resolve(link):
+        return urljoin(base_url, link) if base_url else link
+
+    kind = _local_name(root)
+    entries = []
+    if kind in (SITEMAP_INDEX, SITEMAP):
+        for element in root:
+            loc = _child_text(element, "loc")
+            if loc:
+                entries.append((resolve(loc), parse_date(_child_text(element, "lastmod"))))
+        return kind, entries
+
+    if kind == "rss":
+        for item in root.iter("{*}item"):
+            link = _child_text(item, "link")
+            if link:
+                entries.append((resolve(link), parse_date(_child_text(item, "pubDate"))))
+        return FEED, entries
+
+    if kind == "feed":
+        for entry in root.iter("{*}entry"):
+            date = parse_date(_child_text(entry, "updated") or _child_text(entry, "published"))
+            for link in entry:
+                if _local_name(link) == "link" and link.get("href") and link.get("rel", "alternate") == "alternate":
+                    entries.append((resolve(link.get("href")), date))
+                    break
+        return FEED, entries
+
+    return None, []
+
+
+# Returns the sitemap urls listed in a robots.txt
+def get_robots_sitemaps(robots_txt, base_url):
+    sitemaps = []
+    for line in robots_txt.splitlines():
+        name, _, value = line.partition(":")
+        if name.strip().lower() == "sitemap" and value.strip():
+            sitemaps.append(urljoin(base_url, value.strip()))
+    return sitemaps
+
+
+# Returns (status_code, content, Retry-After header) of url, content is None if it could not be fetched or is larger
+# than DISCOVERY_MAX_XML_BYTES (the download stops there), status_code is 0 if there was no response
+def fetch(url):
+    try:
+        with http_session.get(url, headers=config.headers, timeout=config.DISCOVERY_TIMEOUT_SECS,
+                              stream=True) as response:
+            if response.status_code != 200:
+                debug(f"Discovery got status {response.status_code} for {url}")
+                return response.status_code, None, response.headers.get("Retry-After")
+            chunks = []
+            size = 0
+            for chunk in response.iter_content(chunk_size=64 * 1024):
+                size += len(chunk)
+                if size > config.DISCOVERY_MAX_XML_BYTES:
+                    error(f"Discovery stopped reading {url}, it is larger than {config.DISCOVERY_MAX_XML_BYTES} bytes")
+                    return response.status_code, None, None
+                chunks.append(chunk)
+            return response.status_code, b"".join(chunks), None
+    except requests.exceptions.RequestException as e:
+        debug(f"Discovery failed to fetch {url}: {e}")
+        return 0, None, None
+
+
+class SiteDiscovery:
+    # If frontier (a host_scheduler.HostFrontier) is given, every fetch waits for the host's politeness delay
+    # and its response feeds back into the host's limits like a crawled page.
+    def __init__(self, fetch=fetch, frontier=None, num_workers=config.DISCOVERY_WORKERS):
+        self.fetch = fetch
+        self.frontier = frontier
+        self.executor = ThreadPoolExecutor(max_workers=num_workers, thread_name_prefix="discovery")
+        self.lock = threading.Lock()
+        self.hosts = set()
+        self.num_sitemaps = 0
+        self.num_feeds = 0
+        self.num_urls = 0
+
+    # Returns True the first time it is called for the host of url, so each host is discovered once
+    def claim(self, url):
+        host = urlparse(url).netloc.lower()
+        with self.lock:
+            if host in self.hosts:
+                return False
+            self.hosts.add(host)
+            return True
+
+    # Runs fn(*args) (a discovery) in the discovery threads, returns its Future
+    def submit(self, fn, *args):
+        return self.executor.submit(fn, *args)
+
+    def shutdown(self):
+        self.executor.shutdown(wait=True)
+
+    # Returns the content of url, None if it could not be fetched. Throttled fetches are retried after the
+    # host's backoff, up to RATELIMIT_RETRIES times.
+    def _fetch(self, url):
+        if self.frontier is None:
+            return self.fetch(url)[1]
+        for _ in range(config.RATELIMIT_RETRIES + 1):
+            if not self.frontier.acquire_host(url):
+                return None  # the crawl stopped
+            start_time = time.monotonic()
+            try:
+                status_code, content, retry_after = self.fetch(url)
+                self.frontier.record_response(url, status_code, latency=time.monotonic() - start_time,
+                                              retry_after=retry_after)
+            finally:
+                self.frontier.release_host(url)
+            if status_code not in (429, 503):
+                return content
+        error(f"Discovery exceeded allowed number of retries for {url}")
+        return None
+
+    # Returns the [(url, lastmod)] listed by the sitemaps and feeds of the host of url, lastmod may be None
+    def discover(self, url):
+        parts = urlparse(url)
+        base_url = f"{parts.scheme}://{parts.netloc}/"
+        found = {}
+
+        robots_txt = self._fetch(urljoin(base_url, "/robots.txt"))
+        sitemaps = []
+        if robots_txt is not None:
+            sitemaps = get_robots_sitemaps(robots_txt.decode("utf-8", errors="replace"), base_url)
+        if sitemaps:
+            self._read_sitemaps(sitemaps, found)
+        else:
+            # without a robots.txt entry, use the first default location that is a sitemap
+            for path in config.DISCOVERY_DEFAULT_SITEMAPS:
+                if self._read_sitemaps([urljoin(base_url, path)], found):
+                    break
+
+        for path in config.DISCOVERY_FEEDS:
+            feed_url = urljoin(base_url, path)
+            content = self._fetch(feed_url)
+            if content is None:
+                continue
+            kind, entries = parse_discovery_xml(content, feed_url)
+            if kind == FEED:
+                with self.lock:
+                    self.num_feeds += 1
+                self._add_entries(entries, found)
+
+        with self.lock:
+            self.num_urls += len(found)
+        error(f"Discovered {len(found)} urls in the sitemaps and feeds of {parts.netloc}")
+        return list(found.items())
+
+    # Reads the sitemaps and the sitemaps nested in them, returns the number of sitemaps read
+    def _read_sitemaps(self, sitemaps, found):
+        pending = list(sitemaps)
+        seen = set(pending)
+        num_read = 0
+        while pending and num_read < config.DISCOVERY_MAX_SITEMAPS:
+            sitemap_url = pending.pop(0)
+            content = self._fetch(sitemap_url)
+            if content is None:
+                continue
+            kind, entries = parse_discovery_xml(content, sitemap_url)
+            if kind == SITEMAP_INDEX:
+                for loc, _ in entries:
+                    if loc not in seen:
+                        seen.add(loc)
+                        pending.append(loc)
+            elif kind == SITEMAP:
+                self._add_entries(entries, found)
+            else:
+                debug(f"Discovery ignored {sitemap_url}, it is not a sitemap")
+                continue
+            num_read += 1
+        if pending:
+            error(f"Discovery stopped after {num_read} sitemaps, {len(pending)} not read")
+        with self.lock:
+            self.num_sitemaps += num_read
+        return num_read
+
+    # keeps the newest lastmod of urls listed more than once
+    @staticmethod
+    def _add_entries(entries, found):
+        for loc, lastmod in entries:
+            if loc in found and (lastmod is None or (found[loc] is not None and found[loc] >= lastmod)):
+                continue
+            found[loc] = lastmod
+
+    def stats(self):
+        with self.lock:
+            return {"hosts": len(self.hosts), "sitemaps": self.num_sitemaps, "feeds": self.num_feeds,
+                    "urls": self.num_urls}
+
+
+# Returns the crawl's site discovery, None if disabled. Its fetches follow the politeness of frontier if given.
+def open_discovery(frontier=None):
+    if not config.DISCOVERY_ENABLED:
+        return None
+    return SiteDiscovery(frontier=frontier)
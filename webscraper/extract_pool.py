@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+
+"""This module provides the process pool that runs html/pdf parsing and text extraction.
+
+BeautifulSoup/lxml parsing, newspaper3k and PyMuPDF extraction hold the GIL, so running them in the
+crawler threads does not scale past one core. ExtractPool runs them in worker processes instead:
+- run(fn, *args) submits a picklable function (web_scraper_base.extract_html,
+  pdf_fetcher.extract_clean_pdf_text_to_file) and blocks the calling thread until its result is back,
+  the waiting thread does not hold the GIL, submit(fn, *args) returns the Future instead (both are counted
+  in stats())
+- large PDFs are split into page ranges submitted to all processes, see
+  pdf_fetcher.extract_clean_pdf_text_parallel
+- worker processes are spawned (not forked) because the crawler process has running threads,
+  open sqlite connections and locks that must not be copied into the children
+- a worker process is replaced after EXTRACT_MAX_TASKS_PER_CHILD pages to keep its memory in check
+
+Only pure extraction runs in the pool: the seen-content filter, the cache db writer and the blob
+index live in the crawler process, so dedup and writes stay there.
+"""
+import multiprocessing
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import config
+from utils import debug
+
+
+class ExtractPool:
+    def __init__(self, num_processes=config.EXTRACT_PROCESSES, max_tasks_per_child=config.EXTRACT_MAX_TASKS_PER_CHILD):
+        self.num_processes = num_processes
+        self.executor = ProcessPoolExecutor(max_workers=num_processes,
+                                            mp_context=multiprocessing.get_context("spawn"),
+                                            max_tasks_per_child=max_tasks_per_child)
+        self.lock = threading.Lock()
+        self.num_tasks = 0
+        self.wait_secs = 0.0
+        debug(f"Extract pool started with {num_processes} processes")
+
+    def _count_task(self, start_time):
+        with self.lock:
+            self.num_tasks += 1
+            self.wait_secs += time.monotonic() - start_time
+
+    # Runs fn(*args) in a worker process and returns its result (exceptions are re-raised here)
+    def run(self, fn, *args):
+        start_time = time.monotonic()
+        try:
+            return self.executor.submit(fn, *args).result()
+        finally:
+            self._count_task(start_time)
+
+    # Submits fn(*args) to a worker process and returns its Future, for a task split over several processes.
+    # The task is counted in stats() once it is done.
+    def submit(self, fn, *args):
+        start_time = time.monotonic()
+        future = self.executor.submit(fn, *args)
+        future.add_done_callback(lambda f: None if f.cancelled() else self._count_task(start_time))
+        return future
+
+    def shutdown(self):
+        self.executor.shutdown(wait=True)
+
+    def stats(self):
+        with self.lock:
+            return {"processes": self.num_processes, "tasks": self.num_tasks,
+                    "avg_secs": round(self.wait_secs / self.num_tasks, 4) if self.num_tasks else 0.0}
@@ -0,0 +1,347 @@
+#!/usr/bin/env python3
+
+"""This module provides a per-host politeness scheduler used as the crawler frontier.
+
+Each host gets its own sub-queue together with a concurrency limit and a minimum delay between
+requests. Both are adapted from what we observe:
+- 429/503 responses halve the host concurrency, double its delay and honor any Retry-After header
+- slow responses (above SCHED_HOST_LATENCY_TARGET_SECS) reduce the host concurrency by one
+- a run of fast successful responses raises the concurrency by one and shortens the delay
+
+get() only hands out urls from hosts that are currently allowed to be fetched, so one throttled host
+does not hold up workers that could be busy with other hosts.
+
+Within that, the crawl is best-first instead of FIFO: every host queue is a heap ordered by the url score
+from url_priority.score_url, and get() takes the best url among the hosts that are ready. A url that is
+put again while it is still waiting is not queued twice, its in-link count goes up and it is re-scored.
+
+get() never scans the hosts: the hosts with waiting urls sit in a heap of ready hosts (ordered by their
+best url) or in a heap of delayed hosts (ordered by the time they may be fetched again). A host that runs
+out of work is forgotten once its delay is over, unless it keeps a backoff from being throttled or slow.
+
+The frontier mirrors the parts of queue.Queue the crawler uses (put, get, task_done, join, qsize, unfinished_tasks).
+Waiting is driven by its condition, never by polling: get() sleeps until an item is put, a host slot is
+freed or a host delay runs out, join() until the last task is done, and close() wakes everybody up.
+"""
+import email.utils
+import heapq
+import itertools
+import queue
+import threading
+import time
+from urllib.parse import urlparse
+
+import config
+import url_priority
+
+# returned by get() once the frontier is closed
+SHUTDOWN = (None, 0, 0)
+
+# number of consecutive fast responses before a host is allowed more concurrency
+SUCCESSES_BEFORE_SPEEDUP = 10
+
+
+# heap entry of a waiting url: [-priority, sequence number, item, number of in-links, valid]
+ENTRY_PRIORITY, ENTRY_SEQ, ENTRY_ITEM, ENTRY_INLINKS, ENTRY_VALID = range(5)
+
+
+class HostState:
+    def __init__(self, host):
+        self.host = host
+        self.pending = []  # heap of entries, re-scored entries stay behind as invalid ones
+        self.num_pending = 0
+        self.in_flight = 0
+        self.max_concurrency = config.SCHED_HOST_INITIAL_CONCURRENCY
+        self.min_delay = config.SCHED_HOST_MIN_DELAY_SECS
+        self.next_allowed_time = 0.0
+        self.latency_ewma = None
+        self.num_successes = 0
+        self.num_throttled = 0
+        self.version = 0  # entries of the ready and delayed heaps from older versions are stale
+
+    # True if the host was slowed down below its starting limits, it must be kept to remember that
+    def has_backoff(self):
+        return (self.min_delay > config.SCHED_HOST_MIN_DELAY_SECS
+                or self.max_concurrency < config.SCHED_HOST_INITIAL_CONCURRENCY)
+
+    # Returns the best valid entry without removing it
+    def top(self):
+        while not self.pending[0][ENTRY_VALID]:
+            heapq.heappop(self.pending)
+        return self.pending[0]
+
+
+def get_host(url):
+    return urlparse(url).netloc.lower()
+
+
+# Returns the number of seconds to wait from a Retry-After header value (seconds or http-date), None if unusable
+def parse_retry_after(value):
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        retry_time = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_time is None:
+        return None
+    return max(0.0, retry_time.timestamp() - time.time())
+
+
+class HostFrontier:
+    def __init__(self):
+        self.hosts = {}
+        self.retries = {}
+        self.mutex = threading.Lock()
+        self.not_empty = threading.Condition(self.mutex)
+        self.all_tasks_done = threading.Condition(self.mutex)
+        self.unfinished_tasks = 0
+        self.num_pending = 0
+        self.closed = False
+        self.entries = {}  # url -> heap entry of the urls waiting to be fetched
+        self.sequence = itertools.count()
+        self.ready = []  # heap of [-priority, seq of the best url, version, host state] of the hosts ready now
+        self.delayed = []  # heap of [ready time, version, seq, host state] of the hosts waiting for their delay
+
+    def _push(self, item, priority, num_inlinks):
+        entry = [-priority, next(self.sequence), item, num_inlinks, True]
+        heapq.heappush(self._host_state(get_host(item[0])).pending, entry)
+        self.entries[item[0]] = entry
+
+    def _host_state(self, host):
+        state = self.hosts.get(host)
+        if state is None:
+            state = HostState(host)
+            self.hosts[host] = state
+        return state
+
+    # Files the host under the ready or delayed hosts after any change of its queue or limits.
+    # A host at its concurrency limit is filed again once a slot is freed, an idle one is forgotten.
+    def _schedule(self, state, now):
+        state.version += 1
+        if state.num_pending == 0:
+            if state.in_flight > 0 or state.has_backoff():
+                return
+            if now >= state.next_allowed_time:
+                del self.hosts[state.host]
+            else:
+                heapq.heappush(self.delayed, [state.next_allowed_time, state.version, next(self.sequence), state])
+        elif state.in_flight < state.max_concurrency:
+            if now >= state.next_allowed_time:
+                entry = state.top()
+                heapq.heappush(self.ready, [entry[ENTRY_PRIORITY], entry[ENTRY_SEQ], state.version, state])
+            else:
+                heapq.heappush(self.delayed, [state.next_allowed_time, state.version, next(self.sequence), state])
+
+    # item is a tuple (url, depth_actual, depth_effective), priority overrides the computed score
+    # (used for urls restored from the db). Returns the url's priority.
+    def put(self, item, priority=None):
+        url = item[0]
+        with self.mutex:
+            entry = self.entries.get(url)
+            if entry is not None:
+                # still waiting: one more page links to it, re-score it
+                entry[ENTRY_VALID] = False
+                num_inlinks = entry[ENTRY_INLINKS] + 1
+                priority = url_priority.score_url(url, entry[ENTRY_ITEM][1], num_inlinks)
+                self._push(entry[ENTRY_ITEM], priority, num_inlinks)
+                self._schedule(self.hosts[get_host(url)], time.monotonic())
+                return priority
+
+            if priority is None:
+                priority = url_priority.score_url(url, item[1])
+            self._push(item, priority, 1)
+            state = self.hosts[get_host(url)]
+            state.num_pending += 1
+            self._schedule(state, time.monotonic())
+            self.num_pending += 1
+            self.unfinished_tasks += 1
+            self.not_empty.notify()
+            return priority
+
+    # Puts the item back at the front of its host queue after a throttled response.
+    # Returns False if the url has used up its RATELIMIT_RETRIES.
+    def retry_later(self, item):
+        url = item[0]
+        with self.mutex:
+            num_retries = self.retries.get(url, 0)
+            if num_retries >= config.RATELIMIT_RETRIES:
+                self.retries.pop(url, None)
+                return False
+            self.retries[url] = num_retries + 1
+            # ahead of everything else of its host
+            self._push(item, float("inf"), 1)
+            state = self.hosts[get_host(url)]
+            state.num_pending += 1
+            self._schedule(state, time.monotonic())
+            self.num_pending += 1
+            self.unfinished_tasks += 1
+            self.not_empty.notify()
+            return True
+
+    # Returns the next item from a host that may be fetched now, blocks up to timeout seconds.
+    # Raises queue.Empty if nothing became ready in time, returns SHUTDOWN once the frontier is closed.
+    def get(self, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self.not_empty:
+            while True:
+                if self.closed:
+                    return SHUTDOWN
+                now = time.monotonic()
+                # hosts whose delay ran out
+                while self.delayed and self.delayed[0][0] <= now:
+                    _, version, _, state = heapq.heappop(self.delayed)
+                    if version == state.version:
+                        self._schedule(state, now)
+                while self.ready and self.ready[0][2] != self.ready[0][3].version:
+                    heapq.heappop(self.ready)
+
+                if self.ready:
+                    state = heapq.heappop(self.ready)[3]
+                    item = heapq.heappop(state.pending)[ENTRY_ITEM]
+                    del self.entries[item[0]]
+                    state.num_pending -= 1
+                    state.in_flight += 1
+                    state.next_allowed_time = now + state.min_delay
+                    self._schedule(state, now)
+                    self.num_pending -= 1
+                    return item
+
+                while self.delayed and self.delayed[0][1] != self.delayed[0][3].version:
+                    heapq.heappop(self.delayed)
+                wait_time = self.delayed[0][0] - now if self.delayed else None
+                if deadline is not None:
+                    remaining = deadline - now
+                    if remaining <= 0:
+                        raise queue.Empty
+                    wait_time = remaining if wait_time is None else min(wait_time, remaining)
+                self.not_empty.wait(wait_time)
+
+    # Feeds the outcome of a fetch back into the host's limits.
+    # Cached responses did not touch the network so they give back the politeness delay.
+    def record_response(self, url, status_code, latency=None, retry_after=None, was_cached=False):
+        with self.mutex:
+            state = self._host_state(get_host(url))
+            now = time.monotonic()
+            self._adapt(state, url, status_code, latency, retry_after, was_cached, now)
+            self._schedule(state, now)
+
+    # Adapts the host's limits to the outcome of a fetch, the caller holds the mutex
+    def _adapt(self, state, url, status_code, latency, retry_after, was_cached, now):
+        if was_cached:
+            state.next_allowed_time = now
+            self.not_empty.notify_all()
+            return
+
+        if status_code in (429, 503):
+            state.num_throttled += 1
+            state.num_successes = 0
+            state.max_concurrency = max(1, state.max_concurrency // 2)
+            state.min_delay = min(config.SCHED_HOST_MAX_DELAY_SECS,
+                                  max(state.min_delay * 2, config.SCHED_HOST_MIN_DELAY_SECS))
+            backoff = state.min_delay
+            wait_secs = parse_retry_after(retry_after)
+            if wait_secs is not None:
+                backoff = max(backoff, min(wait_secs, config.SCHED_HOST_MAX_DELAY_SECS))
+            state.next_allowed_time = max(state.next_allowed_time, now + backoff)
+            return
+
+        self.retries.pop(url, None)
+        if latency is not None:
+            if state.latency_ewma is None:
+                state.latency_ewma = latency
+            else:
+                state.latency_ewma = 0.8 * state.latency_ewma + 0.2 * latency
+
+        if state.latency_ewma is not None and state.latency_ewma > config.SCHED_HOST_LATENCY_TARGET_SECS:
+            # the host is struggling, back off a little
+            state.num_successes = 0
+            state.max_concurrency = max(1, state.max_concurrency - 1)
+            return
+
+        state.num_successes += 1
+        if state.num_successes >= SUCCESSES_BEFORE_SPEEDUP:
+            state.num_successes = 0
+            state.max_concurrency = min(config.SCHED_HOST_MAX_CONCURRENCY, state.max_concurrency + 1)
+            state.min_delay = max(config.SCHED_HOST_DELAY_FLOOR_SECS, state.min_delay * 0.9)
+            self.not_empty.notify_all()
+
+    # Blocks until the host of url may be fetched now and takes one of its slots, like get() does for queued urls.
+    # For fetches that are not crawled pages (e.g. sitemaps), free the slot with release_host(url).
+    # Returns False once the frontier is closed.
+    def acquire_host(self, url):
+        with self.not_empty:
+            while True:
+                if self.closed:
+                    return False
+                # looked up again after every wait, get() forgets idle hosts
+                state = self._host_state(get_host(url))
+                now = time.monotonic()
+                if state.in_flight < state.max_concurrency and now >= state.next_allowed_time:
+                    state.in_flight += 1
+                    state.next_allowed_time = now + state.min_delay
+                    self._schedule(state, now)
+                    return True
+                wait_time = None
+                if state.in_flight < state.max_concurrency:
+                    wait_time = state.next_allowed_time - now
+                self.not_empty.wait(wait_time)
+
+    # Counts work for url that runs outside the frontier (e.g. site discovery) as unfinished, so join() waits
+    # for it. It must be finished with task_done(url, release_host=False).
+    def add_task(self):
+        with self.mutex:
+            self.unfinished_tasks += 1
+
+    # Frees the host slot of url once it is fetched, while its processing continues elsewhere.
+    # The item must then be finished with task_done(url, release_host=False).
+    def release_host(self, url):
+        with self.mutex:
+            state = self._host_state(get_host(url))
+            state.in_flight = max(0, state.in_flight - 1)
+            self._schedule(state, time.monotonic())
+            self.not_empty.notify_all()
+
+    # Marks the item for url as processed and frees its host slot
+    def task_done(self, url, release_host=True):
+        with self.mutex:
+            if release_host:
+                state = self._host_state(get_host(url))
+                state.in_flight = max(0, state.in_flight - 1)
+                self._schedule(state, time.monotonic())
+            if self.unfinished_tasks <= 0:
+                raise ValueError('task_done() called too many times')
+            self.unfinished_tasks -= 1
+            if self.unfinished_tasks == 0:
+                self.all_tasks_done.notify_all()
+            if release_host:
+                self.not_empty.notify_all()
+
+    # Blocks until every item put has been marked done or the frontier is closed
+    def join(self):
+        with self.all_tasks_done:
+            while self.unfinished_tasks > 0 and not self.closed:
+                self.all_tasks_done.wait()
+
+    # Wakes up join() and makes every get() return SHUTDOWN, pending items stay in place
+    def close(self):
+        with self.mutex:
+            self.closed = True
+            self.not_empty.notify_all()
+            self.all_tasks_done.notify_all()
+
+    def qsize(self):
+        with self.mutex:
+            return self.num_pending
+
+    def empty(self):
+        return self.qsize() == 0
+
+    # Returns a summary line per host for the progress report
+    def host_stats(self):
+        with self.mutex:
+            return [(s.host, s.num_pending, s.in_flight, s.max_concurrency, round(s.min_delay, 3), s.num_throttled)
+                    for s in self.hosts.values()]
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+
+"""This module provides the in-memory hot tier in front of the sqlite + filesystem download cache.
+
+ByteSizeLRU keeps recently used cache hits (content, content_type) bounded by their total size in bytes,
+so navbar pages that are hit thousands of times during a re-crawl are served without a db lookup, a stat
+and a file read. NegativeCache remembers urls that recently failed with a permanent error (404/410) so
+they are not fetched again within a ttl.
+
+Both are shared by all worker threads and expose stats() for sizing.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+import config
+
+
+class ByteSizeLRU:
+    def __init__(self, max_bytes, max_item_bytes=None):
+        self.max_bytes = max_bytes
+        self.max_item_bytes = max_item_bytes if max_item_bytes is not None else max_bytes
+        self.items = OrderedDict()  # key -> (value, size)
+        self.lock = threading.Lock()
+        self.num_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        with self.lock:
+            entry = self.items.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.items.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value, size):
+        if size > self.max_item_bytes:
+            return
+        with self.lock:
+            old = self.items.pop(key, None)
+            if old is not None:
+                self.num_bytes -= old[1]
+            self.items[key] = (value, size)
+            self.num_bytes += size
+            while self.num_bytes > self.max_bytes:
+                _, (_, evicted_size) = self.items.popitem(last=False)
+                self.num_bytes -= evicted_size
+                self.evictions += 1
+
+    def invalidate(self, key):
+        with self.lock:
+            old = self.items.pop(key, None)
+            if old is not None:
+                self.num_bytes -= old[1]
+
+    def clear(self):
+        with self.lock:
+            self.items.clear()
+            self.num_bytes = 0
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {"entries": len(self.items), "bytes": self.num_bytes, "max_bytes": self.max_bytes,
+                    "hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+                    "hit_ratio": round(self.hits / lookups, 3) if lookups else 0.0}
+
+
+class NegativeCache:
+    def __init__(self, ttl_secs, max_entries=100_000):
+        self.ttl_secs = ttl_secs
+        self.max_entries = max_entries
+        self.items = OrderedDict()  # key -> (status_code, expire_time)
+        self.lock = threading.Lock()
+        self.hits = 0
+
+    def add(self, key, status_code):
+        with self.lock:
+            self.items.pop(key, None)
+            self.items[key] = (status_code, time.monotonic() + self.ttl_secs)
+            while len(self.items) > self.max_entries:
+                self.items.popitem(last=False)
+
+    # Returns the remembered status code for key, None if unknown or expired
+    def get(self, key):
+        with self.lock:
+            entry = self.items.get(key)
+            if entry is None:
+                return None
+            status_code, expire_time = entry
+            if time.monotonic() > expire_time:
+                del self.items[key]
+                return None
+            self.hits += 1
+            return status_code
+
+    def invalidate(self, key):
+        with self.lock:
+            self.items.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.items.clear()
+
+    def stats(self):
+        with self.lock:
+            return {"entries": len(self.items), "hits": self.hits}
+
+
+content_cache = ByteSizeLRU(config.HOT_CACHE_MAX_BYTES, config.HOT_CACHE_MAX_ITEM_BYTES)
+negative_cache = NegativeCache(config.NEGATIVE_CACHE_TTL_SECS)
+
+
+def stats():
+    return {"content": content_cache.stats(), "negative": negative_cache.stats()}
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+
+"""This module provides the single-parse pipeline for crawled html pages.
+
+Every html page used to be parsed three times: by BeautifulSoup (html.parser) for the links, again by
+soup.prettify() to get something to hash and save, and a third time by newspaper3k for the text.
+Now a page is parsed once into an lxml tree (the same C parser newspaper3k uses internally) and
+every stage works on that tree:
+
+- body adjustments (dropping substack cdn scripts) are applied to the tree
+- the adjusted tree is serialized once (lxml.html.tostring), the bytes are both hashed and saved
+- links are read from the tree
+- the tree is handed to newspaper3k for the article text instead of letting it parse the html again
+  (content_filter.extract_content_newspaper)
+
+newspaper3k cleans the tree in place, so the text must be extracted last.
+"""
+import re
+
+import lxml.html
+from bs4 import UnicodeDammit
+
+XML_DECLARATION = re.compile(r'^\<\?.*?\?\>', re.DOTALL)
+
+
+class ParsedPage:
+    def __init__(self, doc, html_text):
+        self.doc = doc
+        self.html_text = html_text  # the decoded html the tree was parsed from
+        self._html_bytes = None
+
+    # The adjusted page serialized as utf-8 bytes, computed once (used for the hash and the saved file)
+    @property
+    def html_bytes(self):
+        if self._html_bytes is None:
+            self._html_bytes = lxml.html.tostring(self.doc, encoding="utf-8")
+        return self._html_bytes
+
+
+def decode_html(content):
+    if isinstance(content, str):
+        return content
+    try:
+        return content.decode("utf-8")
+    except UnicodeDecodeError:
+        # same detection newspaper3k and BeautifulSoup fall back on
+        converted = UnicodeDammit(content, is_html=True)
+        return converted.unicode_markup or content.decode("utf-8", errors="replace")
+
+
+# Parses html content (bytes or str) once, returns a ParsedPage or None if it isn't parseable html
+def parse_html(content):
+    html_text = decode_html(content)
+    # lxml refuses unicode strings with an encoding declaration
+    if html_text.startswith('<?'):
+        html_text = XML_DECLARATION.sub('', html_text)
+    try:
+        doc = lxml.html.fromstring(html_text)
+    except Exception:
+        return None
+    return ParsedPage(doc, html_text)
+
+
+# adjustments to the page body for ease of processing (lxml version of utils.body_adjustments)
+def body_adjustments(page):
+    for script in page.doc.xpath("//body//script[contains(@src, 'substackcdn')]"):
+        script.drop_tree()
+    page._html_bytes = None
+
+
+def extract_links(page):
+    return [a.get('href') for a in page.doc.xpath('//a[@href]')]
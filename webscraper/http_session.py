@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+
+"""This module provides the shared http session layer used by every fetch path of the crawler.
+
+All requests go through one HTTPAdapter so that connections to a host are kept alive and reused
+across pages and worker threads:
+- each thread gets its own requests.Session (sessions are not thread-safe), but all of them
+  share the adapter's connection pools (urllib3 pools are thread-safe)
+- one pool per host (up to HTTP_POOL_NUM_HOSTS hosts), each holding up to HTTP_POOL_MAXSIZE_PER_HOST connections
+- transient connection errors and 500/502/504 responses are retried with exponential backoff,
+  429/503 are left to the crawler's per-host scheduler
+- compression is negotiated with every encoding urllib3 can decode (gzip, deflate and br/zstd if installed)
+
+get_connection_stats() reports how often connections were reused instead of opened.
+"""
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.util import make_headers
+from urllib3.util.retry import Retry
+
+import config
+
+ACCEPT_ENCODING = make_headers(accept_encoding=True)["accept-encoding"]
+
+_stats_lock = threading.Lock()
+_stats = {"requests": 0, "new_connections": 0}
+
+_adapter = None
+_adapter_lock = threading.Lock()
+_local = threading.local()
+
+
+def _count(key):
+    with _stats_lock:
+        _stats[key] += 1
+
+
+# connection pools that count how many connections are handed out vs. newly opened
+class CountingHTTPConnectionPool(HTTPConnectionPool):
+    def _get_conn(self, timeout=None):
+        _count("requests")
+        return super()._get_conn(timeout)
+
+    def _new_conn(self):
+        _count("new_connections")
+        return super()._new_conn()
+
+
+class CountingHTTPSConnectionPool(HTTPSConnectionPool):
+    def _get_conn(self, timeout=None):
+        _count("requests")
+        return super()._get_conn(timeout)
+
+    def _new_conn(self):
+        _count("new_connections")
+        return super()._new_conn()
+
+
+class PooledHTTPAdapter(HTTPAdapter):
+    def init_poolmanager(self, connections, maxsize, block=False, **pool_kwargs):
+        super().init_poolmanager(connections, maxsize, block, **pool_kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": CountingHTTPConnectionPool,
+            "https": CountingHTTPSConnectionPool,
+        }
+
+
+def get_adapter():
+    global _adapter
+    with _adapter_lock:
+        if _adapter is None:
+            retries = Retry(
+                total=config.HTTP_RETRIES,
+                backoff_factor=config.HTTP_RETRY_BACKOFF_SECS,
+                status_forcelist=(500, 502, 504),
+                allowed_methods=frozenset(["GET", "HEAD"]),
+                respect_retry_after_header=True,
+                raise_on_status=False,
+            )
+            _adapter = PooledHTTPAdapter(pool_connections=config.HTTP_POOL_NUM_HOSTS,
+                                         pool_maxsize=config.HTTP_POOL_MAXSIZE_PER_HOST,
+                                         max_retries=retries)
+        return _adapter
+
+
+# Returns the calling thread's session, all sessions share the same connection pools
+def get_session():
+    session = getattr(_local, "session", None)
+    if session is None:
+        session = requests.Session()
+        session.headers.update(config.headers)
+        session.headers["Accept-Encoding"] = ACCEPT_ENCODING
+        adapter = get_adapter()
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        _local.session = session
+    return session
+
+
+def get(url, timeout=config.HTTP_DEFAULT_TIMEOUT_SECS, **kwargs):
+    return get_session().get(url, timeout=timeout, **kwargs)
+
+
+def head(url, timeout=config.HTTP_DEFAULT_TIMEOUT_SECS, **kwargs):
+    return get_session().head(url, timeout=timeout, **kwargs)
+
+
+# Returns a dict with the number of requests, new connections and reused connections
+def get_connection_stats():
+    with _stats_lock:
+        num_requests = _stats["requests"]
+        new_connections = _stats["new_connections"]
+    reused = max(0, num_requests - new_connections)
+    return {
+        "requests": num_requests,
+        "new_connections": new_connections,
+        "reused_connections": reused,
+        "reuse_ratio": round(reused / num_requests, 3) if num_requests else 0.0,
+    }
@@ -6,4 +6,7 @@
   python3 -m pip install frontend
   python3 -m pip install tools
   python3 -m pip install pypdf
+  python3 -m pip install numpy
+  python3 -m pip install aiohttp
+  python3 -m pip install zstandard
   mkdir -p static
@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+
+"""This module provides near-duplicate detection of extracted page text with SimHash.
+
+The exact content hash only catches byte-identical pages, pages that differ by a date, a counter or an
+ad slot are all stored, converted and end up in the training sets. A 64-bit SimHash of the word
+3-shingles of the text is nearly the same for such pages: two texts are near duplicates if their
+fingerprints differ in at most NEAR_DUP_MAX_DISTANCE bits.
+
+NearDupIndex finds them without comparing against every fingerprint: the fingerprint is split into
+NEAR_DUP_MAX_DISTANCE + 1 bands, two fingerprints within the distance share at least one band exactly
+(pigeonhole), so only fingerprints with an equal band are compared.
+
+The crawler checks the text of every new html page against the index before saving it (see
+web_scraper_base.process_page). To cluster an existing corpus directory by its txt files:
+    python near_dup.py cluster <corpus_dir> [--move-to <dir>]
+which prints the clusters and optionally moves all but the first file of each cluster (and its html/pdf) away.
+"""
+import hashlib
+import os
+import re
+import shutil
+import struct
+import sys
+import tempfile
+import threading
+from array import array
+
+import config
+from utils import debug, error
+
+FINGERPRINT_BITS = 64
+SHINGLE_SIZE = 3
+WORD_PATTERN = re.compile(r"\w+")
+
+SNAPSHOT_MAGIC = b"NDUP"
+SNAPSHOT_VERSION = 1
+SNAPSHOT_HEADER = struct.Struct("<4sIQ")
+
+
+def _feature_hash(feature):
+    return int.from_bytes(hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+# SimHash of a list of features, repeated features count repeatedly
+def simhash(features):
+    # one '0'/'1' string per feature hash, so counting a bit position over all features is a C-level slice count
+    bits = "".join(format(_feature_hash(f), "064b") for f in features)
+    threshold = len(features) / 2
+    fp = 0
+    for b in range(FINGERPRINT_BITS):
+        if bits[b::FINGERPRINT_BITS].count("1") > threshold:
+            fp |= 1 << (FINGERPRINT_BITS - 1 - b)
+    return fp
+
+
+# Returns the SimHash of the text, None if it is too short for a meaningful fingerprint
+def text_fingerprint(text, min_words=config.NEAR_DUP_MIN_WORDS):
+    if not text:
+        return None
+    words = WORD_PATTERN.findall(text.lower())
+    if len(words) < max(min_words, SHINGLE_SIZE):
+        return None
+    shingles = [" ".join(words[i:i + SHINGLE_SIZE]) for i in range(len(words) - SHINGLE_SIZE + 1)]
+    return simhash(shingles)
+
+
+def hamming_distance(fp1, fp2):
+    return (fp1 ^ fp2).bit_count()
+
+
+class NearDupIndex:
+    def __init__(self, max_distance=config.NEAR_DUP_MAX_DISTANCE, path=None):
+        self.max_distance = max_distance
+        self.path = path
+        self.num_bands = max_distance + 1
+        self.band_bits = FINGERPRINT_BITS // self.num_bands
+        self.band_mask = (1 << self.band_bits) - 1
+        self.lock = threading.Lock()
+        self.bands = [{} for _ in range(self.num_bands)]  # band value -> list of fingerprints
+        self.fingerprints = array("Q")
+        self.keys = {}  # fingerprint -> key, only for fingerprints added with a key
+
+    def _band_values(self, fp):
+        return [(fp >> (i * self.band_bits)) & self.band_mask for i in range(self.num_bands)]
+
+    def _find(self, fp):
+        for band, value in zip(self.bands, self._band_values(fp)):
+            for other in band.get(value, ()):
+                if hamming_distance(fp, other) <= self.max_distance:
+                    return other
+        return None
+
+    def _insert(self, fp):
+        for band, value in zip(self.bands, self._band_values(fp)):
+            band.setdefault(value, []).append(fp)
+        self.fingerprints.append(fp)
+
+    # Returns the fingerprint of a near duplicate of fp in the index, None if there is none
+    def find(self, fp):
+        with self.lock:
+            return self._find(fp)
+
+    # Adds fp unless the index holds a near duplicate, whose fingerprint is returned instead
+    def add_if_new(self, fp, key=None):
+        with self.lock:
+            other = self._find(fp)
+            if other is not None:
+                return other
+            self._insert(fp)
+            if key is not None:
+                self.keys[fp] = key
+            return None
+
+    def get_key(self, fp):
+        return self.keys.get(fp)
+
+    def __len__(self):
+        return len(self.fingerprints)
+
+    # Snapshots the fingerprints to the index's path
+    def save(self):
+        dir_name = os.path.dirname(self.path) or "."
+        os.makedirs(dir_name, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=dir_name, suffix=".tmp")
+        with self.lock, os.fdopen(fd, "wb") as file:
+            file.write(SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, len(self.fingerprints)))
+            self.fingerprints.tofile(file)
+        os.replace(tmp_path, self.path)
+        debug(f"Near duplicate index saved {len(self.fingerprints)} fingerprints to {self.path}")
+
+    def delete_snapshot(self):
+        if self.path is not None and os.path.exists(self.path):
+            os.remove(self.path)
+
+    # Adds the fingerprints of the snapshot at the index's path, returns False if there is none
+    def load(self):
+        if self.path is None or not os.path.exists(self.path):
+            return False
+        with open(self.path, "rb") as file:
+            magic, version, count = SNAPSHOT_HEADER.unpack(file.read(SNAPSHOT_HEADER.size))
+            if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION:
+                error(f"Ignoring near duplicate index snapshot {self.path} with unknown format")
+                return False
+            fingerprints = array("Q")
+            fingerprints.fromfile(file, count)
+        with self.lock:
+            for fp in fingerprints:
+                self._insert(fp)
+        return True
+
+
+# Returns the crawl's near duplicate index (None if disabled), restored from its snapshot if resume is True
+def open_index(resume, path=None):
+    if not config.NEAR_DUP_ENABLED:
+        return None
+    index = NearDupIndex(path=path or config.NEAR_DUP_INDEX_PATH)
+    if resume and index.load():
+        error(f"Near duplicate index resumed with {len(index)} fingerprints from {index.path}")
+    return index
+
+
+# Groups the txt files of corpus_dir into clusters of near duplicates.
+# Returns a list of clusters (lists of file paths, the first one is the file that is kept), largest first.
+def cluster_corpus(corpus_dir, max_distance=config.NEAR_DUP_MAX_DISTANCE):
+    index = NearDupIndex(max_distance=max_distance)
+    clusters = {}  # path of the first file -> cluster
+    for name in sorted(os.listdir(corpus_dir)):
+        if not name.endswith(".txt"):
+            continue
+        path = os.path.join(corpus_dir, name)
+        with open(path, "r", encoding="utf-8", errors="replace") as file:
+            fp = text_fingerprint(file.read())
+        if fp is None:
+            continue
+        other = index.add_if_new(fp, key=path)
+        if other is None:
+            clusters[path] = [path]
+        else:
+            clusters[index.get_key(other)].append(path)
+    return sorted((c for c in clusters.values() if len(c) > 1), key=len, reverse=True)
+
+
+# Moves a txt file and the html/pdf it was extracted from into target_dir
+def move_corpus_files(txt_path, target_dir):
+    base = txt_path[:-len(".txt")]
+    for path in (txt_path, base + ".html", base + ".pdf"):
+        if os.path.exists(path):
+            shutil.move(path, os.path.join(target_dir, os.path.basename(path)))
+
+
+def main():
+    if len(sys.argv) < 3 or sys.argv[1] != "cluster":
+        print("Usage: python near_dup.py cluster <corpus_dir> [--move-to <dir>]")
+        return
+    corpus_dir = sys.argv[2]
+    move_to = None
+    if len(sys.argv) > 4 and sys.argv[3] == "--move-to":
+        move_to = sys.argv[4]
+        os.makedirs(move_to, exist_ok=True)
+
+    clusters = cluster_corpus(corpus_dir)
+    num_duplicates = 0
+    for cluster in clusters:
+        print(f"Cluster of {len(cluster)}: keep {cluster[0]}")
+        for path in cluster[1:]:
+            print(f"    {path}")
+            if move_to is not None:
+                move_corpus_files(path, move_to)
+        num_duplicates += len(cluster) - 1
+    action = f", moved to {move_to}" if move_to is not None else ""
+    print(f"Found {len(clusters)} clusters with {num_duplicates} near duplicates{action}")
+
+
+if __name__ == "__main__":
+    main()
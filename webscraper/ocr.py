@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+
+"""This module provides the OCR fallback for scanned PDFs.
+
+Scanned PDFs have no text layer, their txt files used to come out empty. The PDF extraction (see
+pdf_fetcher.iter_clean_page_texts) reports the pages with an image and less than OCR_MIN_PAGE_CHARS of text,
+the crawler saves the txt file without them and hands the PDF over to the OcrPool:
+- OCR is slow and CPU bound, it runs in its own pool of OCR_PROCESSES processes with a lowered priority
+  (OCR_NICENESS), at most OCR_MAX_PENDING PDFs wait for it, so it never blocks the crawl
+- the PDF waits in OCR_SPOOL_LOCATION instead of in memory
+- only the reported pages are OCRed (Tesseract through PyMuPDF), then the txt file is written again with
+  their OCR text
+- OCR texts are cached in the ocr_pages table of the cache db, keyed by the hash of the page images and the
+  OCR settings, so the same page (a re-crawl, the same scan in another PDF) is never OCRed twice
+The pool is not started if Tesseract or its language data is missing.
+"""
+import hashlib
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+import fitz  # PyMuPDF
+
+import cache
+import config
+import pdf_fetcher
+from utils import debug, error
+
+
+# Returns the cache key of the OCR text of page: the hash of its images and the OCR settings
+def get_page_image_hash(doc, page):
+    image_hash = hashlib.sha256(f"{config.OCR_LANGUAGE}:{config.OCR_DPI}".encode("utf-8"))
+    for image in page.get_images(full=True):
+        image_hash.update(doc.xref_stream_raw(image[0]) or b"")
+    return image_hash.hexdigest()
+
+
+# Returns the clean text of page read by Tesseract
+def ocr_page(page):
+    textpage = page.get_textpage_ocr(language=config.OCR_LANGUAGE, dpi=config.OCR_DPI, full=True,
+                                     tessdata=config.OCR_TESSDATA)
+    pdict = page.get_text("dict", textpage=textpage)
+    pdict["width"] = page.rect.width
+    pdict["height"] = page.rect.height
+    # running headers of scans differ in every page, only page numbers and footnotes are dropped
+    return pdf_fetcher.clean_page_text(pdf_fetcher.PageSpans([pdict]).kept_blocks(set(), set())[0])
+
+
+# Returns {page number: text} of the pages page_numbers of doc that were already OCRed (see cache.get_ocr_text)
+def get_cached_ocr_texts(doc, page_numbers, db_path):
+    ocr_texts = {}
+    for page_number in page_numbers:
+        text = cache.get_ocr_text(get_page_image_hash(doc, doc[page_number]), db_path)
+        if text is not None:
+            ocr_texts[page_number] = text
+    return ocr_texts
+
+
+# OCRs the pages page_numbers of the PDF at pdf_path (cached pages are looked up in the cache db at db_path) and
+# writes txt_path again with their text. Runs in an OcrPool process, the cache db is only read here.
+# Returns ({image hash: text} of the pages that were OCRed, number of cached pages)
+def ocr_pdf(pdf_path, txt_path, page_numbers, db_path):
+    new_texts = {}
+    with pdf_fetcher.open_pdf(pdf_path) as doc:
+        ocr_texts = get_cached_ocr_texts(doc, page_numbers, db_path)
+        num_cached = len(ocr_texts)
+        for page_number in page_numbers:
+            if page_number in ocr_texts:
+                continue
+            page = doc[page_number]
+            image_hash = get_page_image_hash(doc, page)
+            text = new_texts.get(image_hash)
+            if text is None:
+                text = new_texts[image_hash] = ocr_page(page)
+            ocr_texts[page_number] = text
+
+    if any(ocr_texts.values()):
+        pdf_fetcher.extract_clean_pdf_text_to_file(pdf_path, txt_path, ocr_texts=ocr_texts)
+    return new_texts, num_cached
+
+
+def _lower_priority():
+    if hasattr(os, "nice"):
+        os.nice(config.OCR_NICENESS)
+
+
+class OcrPool:
+    def __init__(self, num_processes=config.OCR_PROCESSES, max_pending=config.OCR_MAX_PENDING, executor=None):
+        if executor is None:
+            executor = ProcessPoolExecutor(max_workers=num_processes, mp_context=multiprocessing.get_context("spawn"),
+                                           initializer=_lower_priority)
+        self.executor = executor
+        self.max_pending = max_pending
+        self.lock = threading.Lock()
+        self.pending = set()    # hashes of the PDFs waiting for OCR
+        self.num_submitted = 0
+        self.num_dropped = 0
+        self.num_failed = 0
+        self.num_ocr_pages = 0
+        self.num_cached_pages = 0
+
+    # Queues the pages page_numbers of the PDF content (with hash hash_val) for OCR, txt_path is written again
+    # when they are done and the txt file size of the cache entry of cleaned_url (if given) is updated.
+    # Returns the Future of the OCR or None if too many PDFs are already waiting.
+    def submit(self, content, hash_val, txt_path, page_numbers, cleaned_url=None):
+        with self.lock:
+            if len(self.pending) >= self.max_pending or hash_val in self.pending:
+                self.num_dropped += 1
+                return None
+            self.pending.add(hash_val)
+            self.num_submitted += 1
+
+        spool_path = os.path.join(config.OCR_SPOOL_LOCATION, hash_val + ".pdf")
+        try:
+            os.makedirs(config.OCR_SPOOL_LOCATION, exist_ok=True)
+            with open(spool_path, "wb") as file:
+                file.write(content)
+            future = self.executor.submit(ocr_pdf, spool_path, txt_path, page_numbers, config.DB_CACHE_PATH)
+        except Exception:
+            self._finish_pending(hash_val, spool_path)
+            raise
+        future.add_done_callback(lambda f: self._finish(f, hash_val, spool_path, txt_path, cleaned_url))
+        return future
+
+    def _finish(self, future, hash_val, spool_path, txt_path, cleaned_url):
+        try:
+            new_texts, num_cached = future.result()
+        except Exception as e:
+            error(f"OCR failed for {txt_path}: {e}")
+            with self.lock:
+                self.num_failed += 1
+        else:
+            # the cache db is written by the crawler process only
+            for image_hash, text in new_texts.items():
+                cache.save_ocr_text(image_hash, text, config.DB_CACHE_PATH)
+            if cleaned_url is not None and os.path.exists(txt_path):
+                cache.update_text_file_size(cleaned_url, os.path.getsize(txt_path), config.DB_CACHE_PATH)
+            with self.lock:
+                self.num_ocr_pages += len(new_texts)
+                self.num_cached_pages += num_cached
+            debug(f"OCR finished for {txt_path}: {len(new_texts)} pages OCRed, {num_cached} cached")
+        self._finish_pending(hash_val, spool_path)
+
+    def _finish_pending(self, hash_val, spool_path):
+        if os.path.exists(spool_path):
+            os.remove(spool_path)
+        with self.lock:
+            self.pending.discard(hash_val)
+
+    def shutdown(self):
+        self.executor.shutdown(wait=True)
+
+    def stats(self):
+        with self.lock:
+            return {"submitted": self.num_submitted, "dropped": self.num_dropped, "failed": self.num_failed,
+                    "ocr_pages": self.num_ocr_pages, "cached_pages": self.num_cached_pages}
+
+
+# Returns the crawl's OCR pool, None if disabled or Tesseract is not installed
+def open_pool():
+    if not config.OCR_ENABLED:
+        return None
+    try:
+        fitz.get_tessdata(config.OCR_TESSDATA)
+    except Exception as e:
+        error(f"OCR disabled, Tesseract language data not found: {e}")
+        return None
+    debug(f"Starting OCR pool with {config.OCR_PROCESSES} processes")
+    return OcrPool()
@@ -2,16 +2,19 @@
 
 """This module provides utility functions related to PDF retrieval and text extraction.
 """
-import requests
 import config
+import http_session
+import itertools
+import os
 import re
-import statistics
-from collections import Counter, defaultdict
+import tempfile
+from collections import Counter, defaultdict, deque
 import fitz  # PyMuPDF
+import numpy as np
 
 def download_pdf(url, output_path):
     """Download a PDF file from a URL and save it locally."""
-    response = requests.get(url)
+    response = http_session.get(url, headers=config.headers)
     if response.status_code == 200:
         with open(output_path, 'wb') as file:
             file.write(response.content)
@@ -53,92 +56,131 @@ def save_text_to_file(title, text, output_path):
 DIGITS_RE = re.compile(r"^\d{1,4}$")
 FOOTNOTE_MARK_RE = re.compile(r"^(\d+|[*†‡])\s")  # simple heuristic
 
-def is_probable_page_number(text, bbox, page_w, page_h):
-    text = text.strip()
-    if not DIGITS_RE.match(text):
-        return False
-    x0, y0, x1, y1 = bbox
-    mid_x = (x0 + x1) / 2
-    mid_y = (y0 + y1) / 2
-    # near bottom or top and roughly centered
-    centered = abs(mid_x - page_w/2) < page_w * 0.2
-    top_or_bottom = (mid_y < page_h * 0.08) or (mid_y > page_h * 0.92)
-    return centered and top_or_bottom
-
-def learn_header_footer_bands(pages_dicts, n=5, band_frac=0.10):
-    """Infer top/bottom bands and repeated lines in them from first n pages."""
+class PageSpans:
+    """Columnar form of the text dicts of a batch of pages (see iter_page_dicts), built in one pass over their
+    blocks, lines and spans.
+
+    The numbers are NumPy arrays: the page sizes, the page, bbox and type of every block, the font size and
+    block of every span, so the font statistics, page number positions and band tests of all pages of the
+    batch are a few array operations. The text of each block (its spans with whitespace collapsed, joined by
+    spaces) is computed once and used both to learn the headers/footers and to filter the blocks.
+    first_page is the page number of the first page of the batch.
+    """
+    def __init__(self, pdicts, first_page=0):
+        self.pdicts = pdicts
+        self.first_page = first_page
+        self.blocks = []
+        texts = []
+        sizes = []
+        num_spans = []
+        num_blocks = []
+        bboxes = []
+        for pdict in pdicts:
+            blocks = pdict["blocks"]
+            for block in blocks:
+                spans = [span for line in block.get("lines", ()) for span in line.get("spans", ())]
+                texts.append(" ".join([" ".join(span.get("text", "").split()) for span in spans]).strip())
+                sizes += [span.get("size") or 0.0 for span in spans]
+                num_spans.append(len(spans))
+                bboxes += block["bbox"]
+            self.blocks += blocks
+            num_blocks.append(len(blocks))
+        self.block_texts = texts
+        self.page_widths = np.array([p["width"] for p in pdicts], dtype=np.float64)
+        self.page_heights = np.array([p["height"] for p in pdicts], dtype=np.float64)
+        self.block_pages = np.repeat(np.arange(len(pdicts)), num_blocks)
+        self.block_bboxes = np.array(bboxes, dtype=np.float64).reshape(-1, 4)
+        self.block_is_text = np.array([b.get("type", 0) == 0 for b in self.blocks], dtype=bool)
+        self.span_sizes = np.array(sizes, dtype=np.float64)
+        self.span_blocks = np.repeat(np.arange(len(self.blocks)), num_spans)
+
+    @property
+    def num_pages(self):
+        return len(self.pdicts)
+
+    # Returns the median font size of the spans of each page, 10 for pages without spans
+    def median_fonts(self):
+        has_size = self.span_sizes != 0
+        span_pages = self.block_pages[self.span_blocks[has_size]]
+        sizes = self.span_sizes[has_size]
+        sizes = sizes[np.lexsort((sizes, span_pages))]
+        counts = np.bincount(span_pages, minlength=self.num_pages)
+        # the middle value, or the mean of the two middle values (same as statistics.median)
+        upper = np.cumsum(counts) - counts + counts // 2
+        lower = np.where(counts % 2 == 1, upper, upper - 1)
+        medians = np.full(self.num_pages, 10.0)
+        has_sizes = counts > 0
+        medians[has_sizes] = (sizes[lower[has_sizes]] + sizes[upper[has_sizes]]) / 2
+        return medians
+
+    # Returns a mask of the pages with image blocks
+    def page_has_images(self):
+        return np.bincount(self.block_pages[~self.block_is_text], minlength=self.num_pages) > 0
+
+    # Returns the average font size of the spans of each block, 0 for blocks without spans
+    def block_avg_fonts(self):
+        has_size = self.span_sizes != 0
+        span_blocks = self.span_blocks[has_size]
+        counts = np.bincount(span_blocks, minlength=len(self.blocks))
+        sums = np.bincount(span_blocks, weights=self.span_sizes[has_size], minlength=len(self.blocks))
+        return np.divide(sums, counts, out=np.zeros(len(counts)), where=counts > 0)
+
+    # Returns a mask of the blocks that are centered near the top or bottom of their page, where page numbers are
+    def page_number_positions(self):
+        widths = self.page_widths[self.block_pages]
+        heights = self.page_heights[self.block_pages]
+        mid_x = (self.block_bboxes[:, 0] + self.block_bboxes[:, 2]) / 2
+        mid_y = (self.block_bboxes[:, 1] + self.block_bboxes[:, 3]) / 2
+        centered = np.abs(mid_x - widths / 2) < widths * 0.2
+        top_or_bottom = (mid_y < heights * 0.08) | (mid_y > heights * 0.92)
+        return centered & top_or_bottom
+
+    # Returns the kept text blocks of each page: not empty, no page number, learned header/footer or footnote
+    def kept_blocks(self, headers, footers):
+        page_number_position = self.page_number_positions()
+        # small-font footnotes in bottom band or explicit footnote lines
+        avg_fonts = self.block_avg_fonts()
+        bottom_band = self.block_bboxes[:, 1] > self.page_heights[self.block_pages] * 0.85
+        small_fonts = (avg_fonts != 0) & (avg_fonts < 0.8 * self.median_fonts()[self.block_pages])
+        candidates = self.block_is_text & ~(bottom_band & small_fonts)
+
+        kept = [[] for _ in self.pdicts]
+        for i, page, number_position, bottom in zip(np.flatnonzero(candidates).tolist(),
+                                                    self.block_pages[candidates].tolist(),
+                                                    page_number_position[candidates].tolist(),
+                                                    bottom_band[candidates].tolist()):
+            text = self.block_texts[i]
+            if not text:
+                continue
+            if number_position and DIGITS_RE.match(text):
+                continue
+            if text in headers or text in footers:
+                continue
+            if bottom and FOOTNOTE_MARK_RE.match(text):
+                continue
+            kept[page].append(self.blocks[i])
+        return kept
+
+
+def learn_header_footer_bands(pages, n=5, band_frac=0.10):
+    """Infer top/bottom bands and repeated lines in them from first n pages of a PageSpans batch."""
     top_texts = Counter()
     bot_texts = Counter()
-    top_positions = []
-    bot_positions = []
-    for p in pages_dicts[:n]:
-        w, h = p["width"], p["height"]
-        top_y = h * band_frac
-        bot_y = h * (1 - band_frac)
-        for b in p["blocks"]:
-            y0 = b["bbox"][1]
-            if y0 < top_y:
-                s = normalize_inline_text(b)
-                if s.strip():
-                    top_texts[s.strip()] += 1
-                    top_positions.append(y0)
-            if y0 > bot_y:
-                s = normalize_inline_text(b)
-                if s.strip():
-                    bot_texts[s.strip()] += 1
-                    bot_positions.append(y0)
+    in_sample = pages.block_pages < n
+    y0 = pages.block_bboxes[:, 1]
+    heights = pages.page_heights[pages.block_pages]
+    for i in np.flatnonzero(in_sample & (y0 < heights * band_frac)).tolist():
+        if pages.block_texts[i]:
+            top_texts[pages.block_texts[i]] += 1
+    for i in np.flatnonzero(in_sample & (y0 > heights * (1 - band_frac))).tolist():
+        if pages.block_texts[i]:
+            bot_texts[pages.block_texts[i]] += 1
     # Repeated header/footer candidates: appear on majority of sampled pages
     min_count = max(2, n // 2)  # conservative
     headers = {t for t,c in top_texts.items() if c >= min_count}
     footers = {t for t,c in bot_texts.items() if c >= min_count}
     return headers, footers
 
-def normalize_inline_text(block):
-    # flatten lines->spans into simple text for signatures / duplicate matching
-    parts = []
-    for line in block.get("lines", []):
-        for span in line.get("spans", []):
-            parts.append(span.get("text", ""))
-    return " ".join(" ".join(p.split()) for p in parts)
-
-def page_font_stats(pdict):
-    sizes = []
-    for b in pdict["blocks"]:
-        for ln in b.get("lines", []):
-            for sp in ln.get("spans", []):
-                if sp.get("size"):
-                    sizes.append(sp["size"])
-    median = statistics.median(sizes) if sizes else 10.0
-    return median
-
-def block_avg_font(block):
-    sizes = []
-    for ln in block.get("lines", []):
-        for sp in ln.get("spans", []):
-            if sp.get("size"):
-                sizes.append(sp["size"])
-    return (sum(sizes)/len(sizes)) if sizes else 0.0
-
-def should_drop_block(block, page_w, page_h, med_font, headers, footers):
-    text = normalize_inline_text(block).strip()
-    if not text:
-        return True
-    # Drop obvious page numbers
-    if is_probable_page_number(text, block["bbox"], page_w, page_h):
-        return True
-    # Drop repeated headers/footers we learned
-    if text in headers or text in footers:
-        return True
-    # Drop small-font footnotes in bottom band or explicit footnote lines
-    y0, y1 = block["bbox"][1], block["bbox"][3]
-    avg_font = block_avg_font(block)
-    is_bottom_band = y0 > page_h * 0.85
-    looks_like_footnote = FOOTNOTE_MARK_RE.match(text) is not None
-    much_smaller_font = avg_font and avg_font < 0.8 * med_font
-    if is_bottom_band and (much_smaller_font or looks_like_footnote):
-        return True
-    return False
-
 def sort_blocks_reading_order(blocks):
     # Sort by top y, then by left x (helps keep columns separate)
     return sorted(blocks, key=lambda b: (round(b["bbox"][1], 1), round(b["bbox"][0], 1)))
@@ -187,47 +229,169 @@ def dehyphenate_and_reflow(lines):
     out = [" ".join(p.split()) for p in out]
     return "\n\n".join(out)
 
-def extract_clean_pdf_text(pdf_path, max_pages=None, learn_pages=5):
-    doc = fitz.open(pdf_path)
-    metadata = doc.metadata
-    title = metadata.get("title")
-
-    pages = []
-    for i, page in enumerate(doc):
-        if (max_pages is not None) and (i >= max_pages):
-            break
+# Opens a PDF from a file path, from bytes already in memory or from a binary stream
+def open_pdf(pdf_source):
+    if isinstance(pdf_source, (bytes, bytearray, memoryview)):
+        return fitz.open(stream=bytes(pdf_source), filetype="pdf")
+    if hasattr(pdf_source, "read"):
+        return fitz.open(stream=pdf_source.read(), filetype="pdf")
+    return fitz.open(pdf_source)
+
+# Yields the text dicts of pages [start, stop) of doc one page at a time, with the page size added
+def iter_page_dicts(doc, start=0, stop=None):
+    for page in doc.pages(start, stop):
         # Prefer dict to get bbox, lines, spans, fonts
         # If your PyMuPDF supports flags, you can try:
         # page.get_text("dict", flags=fitz.TEXT_DEHYPHENATE | fitz.TEXT_PRESERVE_LIGATURES)
         pdict = page.get_text("dict")
         pdict["width"] = page.rect.width
         pdict["height"] = page.rect.height
-        pages.append(pdict)
-
-    headers, footers = learn_header_footer_bands(pages, n=min(learn_pages, len(pages)))
-
-    all_blocks = []
-    for p in pages:
-        med_font = page_font_stats(p)
-        filtered = []
-        for b in p["blocks"]:
-            if b.get("type", 0) != 0:  # 0 = text, skip images etc.
-                continue
-            if should_drop_block(b, p["width"], p["height"], med_font, headers, footers):
-                continue
-            filtered.append(b)
-        all_blocks.extend(sort_blocks_reading_order(filtered))
-
-    # Convert kept blocks -> lines, then reflow & dehyphenate
-    lines = []
-    for b in all_blocks:
-        lines.extend(lines_from_block(b))
-        # add a blank line between blocks to mark paragraph-ish boundary
-        lines.append("")
-
-    text = dehyphenate_and_reflow(lines)
+        yield pdict
+
+# Returns the number of pages extracted from doc
+def get_num_pages(doc, max_pages=None):
+    return doc.page_count if max_pages is None else min(max_pages, doc.page_count)
+
+# Learns the repeated headers and footers of doc from its first learn_pages pages
+def learn_pdf_header_footer(doc, learn_pages=5, max_pages=None):
+    num_pages = min(learn_pages, get_num_pages(doc, max_pages))
+    learned = PageSpans(list(iter_page_dicts(doc, 0, num_pages)))
+    return learn_header_footer_bands(learned, n=learned.num_pages)
+
+# Yields PageSpans batches of PDF_FILTER_BATCH_PAGES pages of page_dicts, the first one is page first_page
+def iter_page_batches(page_dicts, first_page=0):
+    while True:
+        batch = list(itertools.islice(page_dicts, config.PDF_FILTER_BATCH_PAGES))
+        if not batch:
+            return
+        yield PageSpans(batch, first_page)
+        first_page += len(batch)
+
+# Returns the clean text of a page from its kept blocks: in reading order, reflowed & dehyphenated
+def clean_page_text(blocks):
+    # a block always ends a paragraph, so blocks are reflowed one at a time
+    paragraphs = []
+    for b in sort_blocks_reading_order(blocks):
+        text = dehyphenate_and_reflow(lines_from_block(b))
+        if text:
+            paragraphs.append(text)
+    return "\n\n".join(paragraphs)
+
+# Yields (page number, clean text, needs_ocr) for each page of a PageSpans batch, the text is "" for pages
+# without text. needs_ocr is True for pages with an image and less than OCR_MIN_PAGE_CHARS of text (scanned pages),
+# their text is replaced by their text in ocr_texts (page number -> OCR text, see ocr.py) if there is one
+def iter_clean_page_texts(pages, headers, footers, ocr_texts=None):
+    has_images = pages.page_has_images()
+    for i, blocks in enumerate(pages.kept_blocks(headers, footers)):
+        page_number = pages.first_page + i
+        text = clean_page_text(blocks)
+        needs_ocr = bool(has_images[i]) and len(text) < config.OCR_MIN_PAGE_CHARS
+        if needs_ocr and ocr_texts and ocr_texts.get(page_number):
+            text = ocr_texts[page_number]
+        yield page_number, text, needs_ocr
+
+# Yields (page number, clean text, needs_ocr) for the pages of doc one by one, see iter_clean_page_texts
+# (join the texts that are not empty with "\n\n").
+# The header/footer bands are learned from the first learn_pages pages, then the pages are cleaned in
+# batches of PDF_FILTER_BATCH_PAGES pages, so memory use does not grow with the page count
+def iter_clean_pdf_text(doc, max_pages=None, learn_pages=5, ocr_texts=None):
+    page_dicts = iter_page_dicts(doc, 0, get_num_pages(doc, max_pages))
+    learned = PageSpans(list(itertools.islice(page_dicts, learn_pages)))
+    headers, footers = learn_header_footer_bands(learned, n=learned.num_pages)
+
+    yield from iter_clean_page_texts(learned, headers, footers, ocr_texts)
+    first_page = learned.num_pages
+    learned = None
+    for pages in iter_page_batches(page_dicts, first_page):
+        yield from iter_clean_page_texts(pages, headers, footers, ocr_texts)
+
+# pdf_source can be a file path or the PDF content (bytes or a binary stream), see open_pdf()
+def extract_clean_pdf_text(pdf_source, max_pages=None, learn_pages=5):
+    with open_pdf(pdf_source) as doc:
+        metadata = doc.metadata
+        title = metadata.get("title")
+        text = "\n\n".join(text for _, text, _ in iter_clean_pdf_text(doc, max_pages, learn_pages) if text)
     return title, text
 
+# Writes the title and the page texts of page_results (see iter_clean_page_texts) to output_path in the format of
+# save_text_to_file, each page as soon as it is there. Returns the numbers of the pages that need OCR
+def write_page_texts(output_path, title, page_results):
+    ocr_pages = []
+    with open(output_path, 'w', encoding='utf-8') as file:
+        file.write((title or "no_title") + "\n\n")
+        separator = ""
+        for page_number, text, needs_ocr in page_results:
+            if needs_ocr:
+                ocr_pages.append(page_number)
+            if text:
+                file.write(separator)
+                file.write(text)
+                separator = "\n\n"
+    print(f"Text saved to {output_path}")
+    return ocr_pages
+
+# Streaming version of extract_clean_pdf_text + save_text_to_file (same output): each page is written to
+# output_path as soon as it is cleaned, so big PDFs never have their whole text in memory.
+# Returns (title, numbers of the pages that need OCR)
+def extract_clean_pdf_text_to_file(pdf_source, output_path, max_pages=None, learn_pages=5, ocr_texts=None):
+    with open_pdf(pdf_source) as doc:
+        metadata = doc.metadata
+        title = metadata.get("title")
+        ocr_pages = write_page_texts(output_path, title, iter_clean_pdf_text(doc, max_pages, learn_pages, ocr_texts))
+    return title, ocr_pages
+
+# Returns (page number, clean text, needs_ocr) of pages [start, stop) of a PDF file, see iter_clean_page_texts.
+# Runs in the worker processes of extract_clean_pdf_text_parallel, each one opens the document itself
+def extract_page_range(pdf_path, start, stop, headers, footers):
+    with open_pdf(pdf_path) as doc:
+        page_results = []
+        for pages in iter_page_batches(iter_page_dicts(doc, start, stop), start):
+            page_results.extend(iter_clean_page_texts(pages, headers, footers))
+        return page_results
+
+# Page-parallel version of extract_clean_pdf_text_to_file (same output) for large PDFs.
+# The headers/footers are learned here, then the pages are split into ranges of PDF_PARALLEL_RANGE_PAGES pages
+# that run in the processes of executor (anything with submit(), e.g. an extract_pool.ExtractPool) and are
+# written in page order. Blocks are reflowed one at a time, a paragraph (and a hyphenated word) never continues
+# from one block to the next, so the ranges are merged by joining them like the pages of a range.
+# PDFs with less than PDF_PARALLEL_MIN_PAGES pages are extracted by a single task.
+# Returns (title, numbers of the pages that need OCR)
+def extract_clean_pdf_text_parallel(pdf_source, output_path, executor, max_pages=None, learn_pages=5):
+    if hasattr(pdf_source, "read"):
+        pdf_source = pdf_source.read()
+    with open_pdf(pdf_source) as doc:
+        title = doc.metadata.get("title")
+        num_pages = get_num_pages(doc, max_pages)
+        if num_pages >= config.PDF_PARALLEL_MIN_PAGES:
+            headers, footers = learn_pdf_header_footer(doc, learn_pages, max_pages)
+    if num_pages < config.PDF_PARALLEL_MIN_PAGES:
+        return executor.submit(extract_clean_pdf_text_to_file, pdf_source, output_path, max_pages,
+                               learn_pages).result()
+
+    temp_path = None
+    if isinstance(pdf_source, (bytes, bytearray, memoryview)):
+        # the workers open the PDF from a file instead of each getting a copy of its bytes
+        with tempfile.NamedTemporaryFile(suffix=".pdf", delete=False) as file:
+            file.write(pdf_source)
+            temp_path = pdf_source = file.name
+    try:
+        range_pages = config.PDF_PARALLEL_RANGE_PAGES
+        futures = deque(executor.submit(extract_page_range, pdf_source, start, min(start + range_pages, num_pages),
+                                        headers, footers)
+                        for start in range(0, num_pages, range_pages))
+        def range_results():
+            while futures:
+                yield from futures.popleft().result()
+
+        try:
+            ocr_pages = write_page_texts(output_path, title, range_results())
+        finally:
+            for future in futures:
+                future.cancel()
+    finally:
+        if temp_path is not None:
+            os.remove(temp_path)
+    return title, ocr_pages
 
 # Example usage
 if __name__ == "__main__":
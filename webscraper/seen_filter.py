@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+
+"""This module provides the persistent filter of content hashes the crawler has already seen.
+
+SeenFilter is a scalable bloom filter whose bit arrays are memory-mapped files under
+SEEN_FILTER_LOCATION, so it survives a restart without rehashing the corpus:
+- the filter is a series of slices, each a plain bloom filter with a fixed capacity in its own file
+- when the last slice is full a new one with twice the capacity (and half the error rate) is added,
+  which keeps the overall false positive rate below SEEN_FILTER_ERROR_RATE however much is added
+- every add() writes straight into the mapped file, the OS writes it back, close() flushes it
+
+A slice file is a header (magic, version, capacity, error rate, number of hashes, number of bits,
+number of items) followed by the bit array.
+"""
+import hashlib
+import math
+import mmap
+import os
+import shutil
+import struct
+import threading
+
+import config
+from utils import debug, error
+
+SLICE_MAGIC = b"SEEN"
+SLICE_VERSION = 1
+SLICE_HEADER = struct.Struct("<4sIQdIQQ")
+SLICE_COUNT_OFFSET = SLICE_HEADER.size - 8
+SLICE_FILENAME = "slice_{:03d}.bloom"
+
+GROWTH_FACTOR = 2
+TIGHTENING_RATIO = 0.5
+
+
+# the two base hashes for double hashing of a key
+def _base_hashes(key):
+    digest = hashlib.blake2b(key.encode("utf-8"), digest_size=16).digest()
+    return int.from_bytes(digest[:8], "little"), int.from_bytes(digest[8:], "little") | 1
+
+
+class BloomSlice:
+    def __init__(self, path, capacity=None, error_rate=None):
+        self.path = path
+        if not os.path.exists(path):
+            self._create(capacity, error_rate)
+        self.file = open(path, "r+b")
+        self.mm = mmap.mmap(self.file.fileno(), 0)
+        magic, version, self.capacity, self.error_rate, self.num_hashes, self.num_bits, self.count = \
+            SLICE_HEADER.unpack_from(self.mm, 0)
+        if magic != SLICE_MAGIC or version != SLICE_VERSION:
+            self.close()
+            raise ValueError(f"{path} is not a seen filter slice")
+
+    def _create(self, capacity, error_rate):
+        num_bits = math.ceil(-capacity * math.log(error_rate) / (math.log(2) ** 2))
+        num_hashes = max(1, round(num_bits / capacity * math.log(2)))
+        with open(self.path, "wb") as file:
+            file.write(SLICE_HEADER.pack(SLICE_MAGIC, SLICE_VERSION, capacity, error_rate, num_hashes, num_bits, 0))
+            # sparse file, the bit array starts out as zeros
+            file.truncate(SLICE_HEADER.size + (num_bits + 7) // 8)
+
+    def _bit_positions(self, h1, h2):
+        return [SLICE_HEADER.size * 8 + (h1 + i * h2) % self.num_bits for i in range(self.num_hashes)]
+
+    def contains(self, h1, h2):
+        mm = self.mm
+        for pos in self._bit_positions(h1, h2):
+            if not mm[pos >> 3] & (1 << (pos & 7)):
+                return False
+        return True
+
+    def add(self, h1, h2):
+        mm = self.mm
+        for pos in self._bit_positions(h1, h2):
+            mm[pos >> 3] |= 1 << (pos & 7)
+        self.count += 1
+        struct.pack_into("<Q", mm, SLICE_COUNT_OFFSET, self.count)
+
+    def is_full(self):
+        return self.count >= self.capacity
+
+    def close(self):
+        self.mm.flush()
+        self.mm.close()
+        self.file.close()
+
+
+class SeenFilter:
+    def __init__(self, location, initial_capacity=config.SEEN_FILTER_INITIAL_CAPACITY,
+                 error_rate=config.SEEN_FILTER_ERROR_RATE):
+        self.location = location
+        self.initial_capacity = initial_capacity
+        # the slice error rates add up to at most error_rate
+        self.initial_error_rate = error_rate * (1 - TIGHTENING_RATIO)
+        self.lock = threading.Lock()
+        self.slices = []
+        os.makedirs(location, exist_ok=True)
+        while os.path.exists(self._slice_path(len(self.slices))):
+            self.slices.append(BloomSlice(self._slice_path(len(self.slices))))
+
+    def _slice_path(self, index):
+        return os.path.join(self.location, SLICE_FILENAME.format(index))
+
+    def _add_slice(self):
+        index = len(self.slices)
+        capacity = self.initial_capacity * GROWTH_FACTOR ** index
+        error_rate = self.initial_error_rate * TIGHTENING_RATIO ** index
+        self.slices.append(BloomSlice(self._slice_path(index), capacity, error_rate))
+        debug(f"Seen filter added slice {index} with capacity {capacity}")
+
+    def __contains__(self, key):
+        h1, h2 = _base_hashes(key)
+        with self.lock:
+            return any(s.contains(h1, h2) for s in self.slices)
+
+    # Adds key, returns False if it was (probably) seen before
+    def add(self, key):
+        h1, h2 = _base_hashes(key)
+        with self.lock:
+            if any(s.contains(h1, h2) for s in self.slices):
+                return False
+            if not self.slices or self.slices[-1].is_full():
+                self._add_slice()
+            self.slices[-1].add(h1, h2)
+            return True
+
+    def __len__(self):
+        with self.lock:
+            return sum(s.count for s in self.slices)
+
+    # Flushes and unmaps the slices, they are reloaded by the next SeenFilter on the same location
+    def close(self):
+        with self.lock:
+            for s in self.slices:
+                s.close()
+            self.slices = []
+
+    # Closes the filter and deletes its files, the next crawl starts with an empty filter
+    def delete(self):
+        self.close()
+        shutil.rmtree(self.location, ignore_errors=True)
+
+    def stats(self):
+        with self.lock:
+            return {"items": sum(s.count for s in self.slices), "slices": len(self.slices),
+                    "bytes": sum(os.path.getsize(s.path) for s in self.slices)}
+
+
+# Returns the crawl's seen content filter, reloaded from disk if resume is True, empty otherwise
+def open_filter(resume, location=None):
+    location = location or config.SEEN_FILTER_LOCATION
+    if not resume:
+        shutil.rmtree(location, ignore_errors=True)
+    try:
+        seen = SeenFilter(location)
+    except ValueError as e:
+        error(f"Discarding unreadable seen filter: {e}")
+        shutil.rmtree(location, ignore_errors=True)
+        seen = SeenFilter(location)
+    if len(seen) > 0:
+        error(f"Seen filter resumed with {len(seen)} content hashes from {location}")
+    return seen
@@ -0,0 +1,79 @@
+import os
+import tempfile
+import unittest
+from collections import Counter
+
+import batch_convert
+
+PAGE = ("<html><head><title>Page {0}</title></head><body><article>"
+        + "<p>This is paragraph {0} of a test article about batch conversion of the corpus. "
+        + "It has enough words to be kept as the text of the article by the extractor.</p>" * 5
+        + "</article></body></html>")
+
+# the shape of a real page: navigation, and a div that mixes text and inline tags with block children
+MIXED_PAGE = ("<!DOCTYPE html><html lang='en'><head><meta charset='utf-8'><title>Mixed Page</title></head><body>"
+              "<nav><a href='/a'>A</a> <a href='/b'>B</a></nav>"
+              "<div class='content'>Intro with <a href='/link'>a link</a> and <b>bold</b> words."
+              "<div><p>The first paragraph of the article has a good number of words so that it is kept.</p>"
+              "<p>The second paragraph continues with more words about the subject of the article.</p></div>"
+              "Tail text after the inner div with <i>italic</i> words.</div></body></html>")
+
+
+class TestBatchConvert(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.corpus = os.path.join(self.dir.name, "corpus")
+        os.makedirs(os.path.join(self.corpus, "site.org"))
+        self.manifest_path = os.path.join(self.dir.name, "manifest.db")
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def write_page(self, name, n, page=PAGE):
+        path = os.path.join(self.corpus, "site.org", name)
+        with open(path, "w") as file:
+            file.write(page.format(n))
+        return path
+
+    def run_convert(self, **kwargs):
+        return batch_convert.run(self.corpus, kinds=("html",), num_workers=1, timeout_secs=60,
+                                 manifest_path=self.manifest_path, **kwargs)
+
+    def test_output_path(self):
+        self.assertEqual(batch_convert.get_output_path("/c/a.html.html", "html"), "/c/a.txt.txt")
+        self.assertEqual(batch_convert.get_output_path("/c.pdf/b.pdf", "pdf"), "/c.pdf/b.txt")
+
+    def test_only_new_and_changed_files_are_converted(self):
+        path = self.write_page("a.html", 1)
+        self.assertEqual(self.run_convert()[batch_convert.STATUS_CONVERTED], 1)
+        with open(batch_convert.get_output_path(path, "html")) as file:
+            self.assertIn("paragraph 1", file.read())
+
+        self.assertEqual(self.run_convert(), Counter({batch_convert.STATUS_UNCHANGED: 1}))
+        # a touched file with the same content is not converted again
+        os.utime(path, ns=(0, 0))
+        self.assertEqual(self.run_convert(), Counter({batch_convert.STATUS_UNCHANGED: 1}))
+
+        self.write_page("a.html", 2)
+        self.assertEqual(self.run_convert()[batch_convert.STATUS_CONVERTED], 1)
+        self.assertEqual(self.run_convert(regenerate_all=True)[batch_convert.STATUS_CONVERTED], 1)
+
+    def test_mixed_content_page_is_converted(self):
+        path = self.write_page("mixed.html", 0, MIXED_PAGE)
+        self.assertEqual(self.run_convert(), Counter({batch_convert.STATUS_CONVERTED: 1}))
+        with open(batch_convert.get_output_path(path, "html")) as file:
+            self.assertIn("The second paragraph continues", file.read())
+
+    def test_existing_txt_files_are_recorded(self):
+        path = self.write_page("a.html", 1)
+        with open(batch_convert.get_output_path(path, "html"), "w") as file:
+            file.write("saved by the crawler")
+        self.assertEqual(self.run_convert(), Counter({batch_convert.STATUS_EXISTING: 1}))
+
+        os.remove(batch_convert.get_output_path(path, "html"))
+        self.assertEqual(self.run_convert(), Counter({batch_convert.STATUS_UNCHANGED: 1}))
+        self.assertEqual(self.run_convert(verify=True)[batch_convert.STATUS_CONVERTED], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,64 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import blob_store
+import cache
+import cache_db
+import utils
+
+HTML = b"<html><body>" + b"<p>The same paragraph of a page stored in the blob store.</p>" * 50 + b"</body></html>"
+PDF = b"%PDF-1.4 not really a pdf, but stored as one"
+
+
+class TestBlobStore(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.root = os.path.join(self.dir, "blobs")
+        self.db_path = os.path.join(self.dir, "cache.db")
+        cache.init_db(self.db_path)
+
+    def tearDown(self):
+        cache_db.close_connections()
+        shutil.rmtree(self.dir)
+
+    def test_identical_content_is_stored_once(self):
+        hash_val = utils.hash_bytes(PDF)
+        first = blob_store.put_blob(hash_val, PDF, "pdf", self.root)
+        self.assertEqual(blob_store.put_blob(hash_val, PDF, "pdf", self.root), first)
+        self.assertEqual(first[0], os.path.join(self.root, hash_val[:2], hash_val[2:4], hash_val + ".pdf"))
+        self.assertEqual(os.listdir(os.path.dirname(first[0])), [hash_val + ".pdf"])
+
+    @unittest.skipIf(blob_store.zstandard is None, "zstandard is not installed")
+    def test_compressed_round_trip(self):
+        blob_path, stored_size = blob_store.put_blob(utils.hash_bytes(HTML), HTML, "html", self.root)
+        self.assertTrue(blob_store.is_blob_path(blob_path))
+        self.assertLess(stored_size, len(HTML))
+        self.assertEqual(blob_store.read_file(blob_path), HTML)
+
+    def test_cached_content_is_read_from_the_blob(self):
+        blob_path, stored_size = blob_store.put_blob(utils.hash_bytes(HTML), HTML, "html", self.root)
+        cache.update_cache("site.org/page", "text/html", blob_path, stored_size, "site.org_page.txt", 0,
+                           utils.hash_bytes(HTML), db_path=self.db_path)
+        self.assertEqual(cache.get_cached_file_content("site.org/page", self.db_path), (HTML, "text/html"))
+
+    def test_export_flat(self):
+        pdf_hash, html_hash = utils.hash_bytes(PDF), utils.hash_bytes(HTML)
+        pdf_blob = blob_store.put_blob(pdf_hash, PDF, "pdf", self.root)
+        html_blob = blob_store.put_blob(html_hash, HTML, "html", self.root)
+        for cleaned_url in ("site.org/a.pdf", "site.org/copy/a.pdf"):
+            cache.save_url_blob(cleaned_url, pdf_hash, *pdf_blob, "pdf", db_path=self.db_path)
+        cache.save_url_blob("site.org/page", html_hash, *html_blob, "html", db_path=self.db_path)
+
+        out_dir = os.path.join(self.dir, "flat")
+        self.assertEqual(blob_store.export_flat(out_dir, self.db_path), 3)
+        # uncompressed blobs are hard linked, compressed ones written decompressed
+        for name in ("site.org_a.pdf.pdf", "site.org_copy_a.pdf.pdf"):
+            self.assertTrue(os.path.samefile(os.path.join(out_dir, name), pdf_blob[0]))
+        with open(os.path.join(out_dir, "site.org_page.html"), "rb") as file:
+            self.assertEqual(file.read(), HTML)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,9 +1,20 @@
 import unittest
 import os
+from unittest import mock
+import queue
 import tempfile
 import sqlite3
 from datetime import datetime
-from cache import init_db, update_cache, get_cached_url_data
+from datetime import timedelta
+import requests
+import cache
+import config
+import utils
+from cache import init_db, update_cache, get_cached_url_data, get_cached_file_content, \
+    save_pending_url_to_db, delete_pending_url_from_db, load_pending_urls_from_db, \
+    start_batch_writes, stop_batch_writes, get_revalidation_headers, mark_cache_entry_validated, expire_if_modified
+import cache_db
+from hot_cache import ByteSizeLRU
 
 class TestCacheFunctions(unittest.TestCase):
     def setUp(self):
@@ -29,6 +40,8 @@ class TestCacheFunctions(unittest.TestCase):
         init_db(db_path=self.db_path)
 
     def tearDown(self):
+        stop_batch_writes()
+        cache_db.close_connections()
         os.close(self.db_fd)
         os.remove(self.db_path)
         os.remove(self.html_file.name)
@@ -59,6 +72,141 @@ class TestCacheFunctions(unittest.TestCase):
         self.assertEqual(row[6], self.test_hash)
         #self.assertEqual(row[7], self.test_time)  # @TODO: Fix me later
 
+    def test_stale_entry_is_revalidated_with_validators(self):
+        saved = (config.CACHE_DEFAULT_MAX_AGE_SECS, config.CACHE_MAX_AGE_RULES)
+        config.CACHE_DEFAULT_MAX_AGE_SECS, config.CACHE_MAX_AGE_RULES = 60, []
+        try:
+            update_cache(self.test_url, self.content_type, self.url_file_path, self.url_file_size,
+                         self.text_file_path, self.text_file_size, self.test_hash,
+                         download_time=datetime.now() - timedelta(seconds=120), db_path=self.db_path,
+                         etag='"v1"', last_modified="Wed, 01 Jan 2025 00:00:00 GMT")
+
+            self.assertEqual(get_revalidation_headers(self.test_url, db_path=self.db_path),
+                             {'If-None-Match': '"v1"', 'If-Modified-Since': "Wed, 01 Jan 2025 00:00:00 GMT"})
+
+            mark_cache_entry_validated(self.test_url, db_path=self.db_path)
+            self.assertIsNone(get_revalidation_headers(self.test_url, db_path=self.db_path))
+            self.assertEqual(get_cached_url_data(self.db_path, self.test_url)[8], '"v1"')
+        finally:
+            config.CACHE_DEFAULT_MAX_AGE_SECS, config.CACHE_MAX_AGE_RULES = saved
+
+    def test_stale_copy_is_served_if_revalidation_fails(self):
+        url = "https://example.com/stale"
+        cleaned_url = utils.clean_url(url)
+        responses = [requests.exceptions.ConnectionError("refused"), mock.Mock(status_code=502, headers={}),
+                     mock.Mock(status_code=304, headers={})]
+        with mock.patch.multiple(config, CACHE_DEFAULT_MAX_AGE_SECS=60, CACHE_MAX_AGE_RULES=[],
+                                 DB_CACHE_PATH=self.db_path), \
+                mock.patch.object(cache.http_session, "get", side_effect=responses):
+            update_cache(cleaned_url, self.content_type, self.url_file_path, self.url_file_size,
+                         self.text_file_path, self.text_file_size, self.test_hash,
+                         download_time=datetime.now() - timedelta(seconds=120), db_path=self.db_path, etag='"v1"')
+            for _ in responses:
+                self.assertEqual(cache.get_cached_content_or_request(url),
+                                 (cleaned_url, 200, self.content_type, b"<html>Example</html>",
+                                  cache.CACHED_AFTER_REQUEST))
+                # only the 304 makes the entry fresh again
+                self.assertEqual(get_revalidation_headers(cleaned_url, db_path=self.db_path) is None,
+                                 cache.http_session.get.call_count == len(responses))
+
+    def test_init_db_adds_validator_columns_to_old_schema(self):
+        conn = sqlite3.connect(self.db_path)
+        conn.execute("DROP TABLE downloads")
+        conn.execute('''
+            CREATE TABLE downloads (
+                cleaned_url TEXT PRIMARY KEY, content_type TEXT NOT NULL, url_file_path TEXT NOT NULL,
+                url_file_size INTEGER NOT NULL, text_file_path TEXT NOT NULL, text_file_size INTEGER NOT NULL,
+                hash TEXT NOT NULL, download_time TEXT NOT NULL)
+        ''')
+        conn.commit()
+        conn.close()
+
+        init_db(db_path=self.db_path)
+        conn = sqlite3.connect(self.db_path)
+        columns = [row[1] for row in conn.execute("PRAGMA table_info(downloads)")]
+        conn.close()
+        self.assertEqual(columns[-2:], ["etag", "last_modified"])
+
+    def test_batch_writes_are_readable_before_commit(self):
+        start_batch_writes(db_path=self.db_path)
+        update_cache(self.test_url, self.content_type, self.url_file_path, self.url_file_size,
+                     self.text_file_path, self.text_file_size, self.test_hash, db_path=self.db_path)
+
+        content, content_type = get_cached_file_content(self.test_url, db_path=self.db_path)
+        self.assertEqual(content, b"<html>Example</html>")
+        self.assertEqual(content_type, self.content_type)
+
+        stop_batch_writes()
+        conn = sqlite3.connect(self.db_path)
+        rows = conn.execute("SELECT cleaned_url, hash FROM downloads").fetchall()
+        conn.close()
+        self.assertEqual(rows, [(self.test_url, self.test_hash)])
+
+    def test_failing_write_does_not_lose_its_batch(self):
+        start_batch_writes(db_path=self.db_path)
+        for url, text_file_path in (("https://example.com/1", self.text_file_path), ("https://example.com/bad", None),
+                                    ("https://example.com/2", self.text_file_path)):
+            update_cache(url, self.content_type, self.url_file_path, self.url_file_size, text_file_path,
+                         self.text_file_size, self.test_hash, db_path=self.db_path)
+        cache.flush_batch_writes(self.db_path)
+
+        conn = sqlite3.connect(self.db_path)
+        rows = conn.execute("SELECT cleaned_url FROM downloads ORDER BY cleaned_url").fetchall()
+        conn.close()
+        self.assertEqual(rows, [("https://example.com/1",), ("https://example.com/2",)])
+        # the failed upsert stays readable
+        self.assertIsNotNone(cache_db.get_writer(self.db_path).get_pending_download("https://example.com/bad"))
+        self.assertIsNone(cache_db.get_writer(self.db_path).get_pending_download("https://example.com/1"))
+
+    def test_expire_if_modified(self):
+        update_cache(self.test_url, self.content_type, self.url_file_path, self.url_file_size, self.text_file_path,
+                     self.text_file_size, self.test_hash, self.test_time, db_path=self.db_path)
+        self.assertFalse(expire_if_modified(self.test_url, self.test_time - timedelta(days=1), db_path=self.db_path))
+        self.assertTrue(expire_if_modified(self.test_url, self.test_time + timedelta(days=1), db_path=self.db_path))
+        self.assertIsNone(get_cached_url_data(self.db_path, self.test_url))
+
+    def test_batch_writes_keep_queue_order(self):
+        start_batch_writes(db_path=self.db_path)
+        save_pending_url_to_db("https://example.com/a", 1, 1, db_path=self.db_path)
+        save_pending_url_to_db("https://example.com/b", 1, 1, db_path=self.db_path)
+        delete_pending_url_from_db("https://example.com/a", db_path=self.db_path)
+
+        pending = queue.Queue()
+        load_pending_urls_from_db(pending, db_path=self.db_path)
+        self.assertEqual(list(pending.queue), [("https://example.com/b", 1, 1)])
+
+    def test_pending_urls_load_best_first(self):
+        save_pending_url_to_db("https://example.com/a", 1, 1, priority=5, db_path=self.db_path)
+        save_pending_url_to_db("https://example.com/b", 1, 1, priority=1, db_path=self.db_path)
+        # saving again updates the priority
+        save_pending_url_to_db("https://example.com/b", 1, 1, priority=10, db_path=self.db_path)
+
+        pending = queue.Queue()
+        load_pending_urls_from_db(pending, db_path=self.db_path)
+        self.assertEqual([item[0] for item in pending.queue], ["https://example.com/b", "https://example.com/a"])
+
+
+class TestByteSizeLRU(unittest.TestCase):
+    def test_evicts_least_recently_used_by_size(self):
+        lru = ByteSizeLRU(max_bytes=10)
+        lru.put("a", b"aaaa", 4)
+        lru.put("b", b"bbbb", 4)
+        self.assertEqual(lru.get("a"), b"aaaa")  # a is now most recently used
+        lru.put("c", b"cccc", 4)
+
+        self.assertIsNone(lru.get("b"))
+        self.assertEqual(lru.get("a"), b"aaaa")
+        self.assertEqual(lru.get("c"), b"cccc")
+        stats = lru.stats()
+        self.assertEqual((stats["entries"], stats["bytes"], stats["evictions"]), (2, 8, 1))
+        self.assertEqual((stats["hits"], stats["misses"]), (3, 1))
+
+    def test_skips_items_above_item_limit(self):
+        lru = ByteSizeLRU(max_bytes=100, max_item_bytes=5)
+        lru.put("big", b"x" * 6, 6)
+        self.assertIsNone(lru.get("big"))
+        self.assertEqual(lru.stats()["bytes"], 0)
+
 
 if __name__ == "__main__":
     unittest.main()
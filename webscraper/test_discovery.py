@@ -0,0 +1,109 @@
+import gzip
+import time
+import unittest
+from datetime import datetime
+from unittest import mock
+
+import config
+import discovery
+from host_scheduler import HostFrontier
+
+from discovery import FEED, SITEMAP, SiteDiscovery, get_robots_sitemaps, parse_discovery_xml
+
+SITEMAP_INDEX_XML = b"""<?xml version="1.0" encoding="UTF-8"?>
+<sitemapindex xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">
+  <sitemap><loc>https://site.org/posts.xml.gz</loc></sitemap>
+  <sitemap><loc>https://site.org/pages.xml</loc></sitemap>
+</sitemapindex>"""
+
+POSTS_XML = b"""<?xml version="1.0" encoding="UTF-8"?>
+<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">
+  <url><loc>https://site.org/a-post</loc><lastmod>2024-05-01T10:00:00+00:00</lastmod></url>
+  <url><loc>https://site.org/b-post</loc><lastmod>2024-05-02</lastmod></url>
+</urlset>"""
+
+PAGES_XML = b"""<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">
+  <url><loc>https://site.org/about</loc></url>
+</urlset>"""
+
+RSS_XML = b"""<rss version="2.0"><channel>
+  <item><link>https://site.org/c-post</link><pubDate>Fri, 03 May 2024 08:00:00 GMT</pubDate></item>
+  <item><link>https://site.org/b-post</link><pubDate>Sat, 04 May 2024 08:00:00 GMT</pubDate></item>
+</channel></rss>"""
+
+ATOM_XML = b"""<feed xmlns="http://www.w3.org/2005/Atom">
+  <entry><link rel="alternate" href="https://site.org/d-post"/><updated>2024-05-05T00:00:00Z</updated></entry>
+</feed>"""
+
+
+class TestDiscovery(unittest.TestCase):
+    def test_parse_sitemap_and_feeds(self):
+        kind, entries = parse_discovery_xml(gzip.compress(POSTS_XML))
+        self.assertEqual(kind, SITEMAP)
+        self.assertEqual([loc for loc, _ in entries], ["https://site.org/a-post", "https://site.org/b-post"])
+        self.assertEqual(entries[1][1], datetime(2024, 5, 2))
+
+        self.assertEqual(parse_discovery_xml(RSS_XML)[0], FEED)
+        self.assertEqual(parse_discovery_xml(ATOM_XML)[1][0][0], "https://site.org/d-post")
+        self.assertEqual(parse_discovery_xml(b"<html><body>not a sitemap</body></html>"), (None, []))
+
+    def test_robots_sitemaps(self):
+        robots = "User-agent: *\nDisallow: /wp-admin/\nSitemap: https://site.org/index.xml\nsitemap: /other.xml\n"
+        self.assertEqual(get_robots_sitemaps(robots, "https://site.org/"),
+                         ["https://site.org/index.xml", "https://site.org/other.xml"])
+
+    def test_discover_follows_sitemap_index_and_feeds(self):
+        responses = {
+            "https://site.org/robots.txt": b"Sitemap: https://site.org/index.xml",
+            "https://site.org/index.xml": SITEMAP_INDEX_XML,
+            "https://site.org/posts.xml.gz": gzip.compress(POSTS_XML),
+            "https://site.org/pages.xml": PAGES_XML,
+            "https://site.org/feed": RSS_XML,
+        }
+        discoverer = SiteDiscovery(fetch=lambda url: (200, responses[url], None) if url in responses else
+                                   (404, None, None))
+        self.assertTrue(discoverer.claim("https://site.org/"))
+        self.assertFalse(discoverer.claim("https://site.org/other-page"))
+
+        found = dict(discoverer.discover("https://site.org/"))
+        self.assertEqual(sorted(found), ["https://site.org/a-post", "https://site.org/about", "https://site.org/b-post",
+                                         "https://site.org/c-post"])
+        self.assertIsNone(found["https://site.org/about"])
+        # the newest date wins for urls listed twice
+        self.assertEqual(found["https://site.org/b-post"].day, 4)
+        self.assertEqual(discoverer.stats()["sitemaps"], 3)
+
+    def test_fetches_follow_the_host_politeness(self):
+        statuses = [429, 200, 200]
+        fetch_times = []
+
+        def fetch(url):
+            fetch_times.append(time.monotonic())
+            status_code = statuses.pop(0)
+            return status_code, (b"Sitemap: /index.xml" if status_code == 200 else None), None
+
+        with mock.patch.multiple(config, SCHED_HOST_MIN_DELAY_SECS=0.1, DISCOVERY_DEFAULT_SITEMAPS=[],
+                                 DISCOVERY_FEEDS=[]):
+            frontier = HostFrontier()
+            discoverer = SiteDiscovery(fetch=fetch, frontier=frontier)
+            # robots.txt is throttled once and fetched again after the doubled host delay, then the sitemap
+            self.assertEqual(discoverer.discover("https://site.org/"), [])
+            discoverer.shutdown()
+        self.assertEqual(len(fetch_times), 3)
+        self.assertGreaterEqual(fetch_times[1] - fetch_times[0], 0.2)
+        self.assertGreaterEqual(fetch_times[2] - fetch_times[1], 0.2)
+        self.assertEqual(frontier.hosts["site.org"].in_flight, 0)
+
+    def test_fetch_stops_reading_large_responses(self):
+        response = mock.MagicMock(status_code=200)
+        response.__enter__.return_value = response
+        response.iter_content.return_value = iter([b"x" * 600] * 10)
+        with mock.patch.object(config, "DISCOVERY_MAX_XML_BYTES", 1000), \
+                mock.patch.object(discovery.http_session, "get", return_value=response) as get:
+            self.assertEqual(discovery.fetch("https://site.org/sitemap.xml"), (200, None, None))
+        self.assertTrue(get.call_args.kwargs["stream"])
+        self.assertEqual(len(list(response.iter_content.return_value)), 8)
+
+
+if __name__ == "__main__":
+    unittest.main()
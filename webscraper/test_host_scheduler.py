@@ -0,0 +1,140 @@
+import queue
+import re
+import threading
+import time
+import unittest
+
+import config
+from host_scheduler import SHUTDOWN, HostFrontier, parse_retry_after
+
+
+class TestHostFrontier(unittest.TestCase):
+    def setUp(self):
+        self.saved = (config.SCHED_HOST_INITIAL_CONCURRENCY, config.SCHED_HOST_MIN_DELAY_SECS)
+        config.SCHED_HOST_INITIAL_CONCURRENCY = 1
+        config.SCHED_HOST_MIN_DELAY_SECS = 0.0
+        self.frontier = HostFrontier()
+
+    def tearDown(self):
+        config.SCHED_HOST_INITIAL_CONCURRENCY, config.SCHED_HOST_MIN_DELAY_SECS = self.saved
+
+    def test_busy_host_does_not_block_other_hosts(self):
+        self.frontier.put(("https://a.org/1", 0, 0))
+        self.frontier.put(("https://a.org/2", 0, 0))
+        self.frontier.put(("https://b.org/1", 0, 0))
+
+        self.assertEqual(self.frontier.get(timeout=0.1)[0], "https://a.org/1")
+        # a.org is at its concurrency limit so b.org must be handed out next
+        self.assertEqual(self.frontier.get(timeout=0.1)[0], "https://b.org/1")
+        with self.assertRaises(queue.Empty):
+            self.frontier.get(timeout=0.05)
+
+        self.frontier.task_done("https://a.org/1")
+        self.assertEqual(self.frontier.get(timeout=0.1)[0], "https://a.org/2")
+
+    def test_release_host_keeps_task_unfinished(self):
+        self.frontier.put(("https://a.org/1", 0, 0))
+        self.frontier.put(("https://a.org/2", 0, 0))
+        url = self.frontier.get(timeout=0.1)[0]
+
+        # fetched and handed to the extraction stage, the host can serve the next url
+        self.frontier.release_host(url)
+        self.assertEqual(self.frontier.get(timeout=0.1)[0], "https://a.org/2")
+        self.assertEqual(self.frontier.unfinished_tasks, 2)
+
+        self.frontier.task_done(url, release_host=False)
+        self.assertEqual(self.frontier.unfinished_tasks, 1)
+
+    def test_close_wakes_up_get_and_join(self):
+        self.frontier.put(("https://a.org/1", 0, 0))
+        self.frontier.get(timeout=0.1)
+        results = []
+        waiters = [threading.Thread(target=lambda: results.append(self.frontier.get())),
+                   threading.Thread(target=lambda: results.append(self.frontier.join()))]
+        for t in waiters:
+            t.start()
+        self.frontier.close()
+        for t in waiters:
+            t.join(timeout=1)
+            self.assertFalse(t.is_alive())
+        self.assertIn(SHUTDOWN, results)
+
+    def test_acquire_host_shares_the_host_slots(self):
+        self.frontier.put(("https://a.org/1", 0, 0))
+        url = self.frontier.get(timeout=0.1)[0]
+        acquired = []
+        waiter = threading.Thread(target=lambda: acquired.append(self.frontier.acquire_host("https://a.org/robots.txt")))
+        waiter.start()
+        waiter.join(timeout=0.05)
+        # a.org is at its concurrency limit until the page is done
+        self.assertTrue(waiter.is_alive())
+        self.frontier.task_done(url)
+        waiter.join(timeout=1)
+        self.assertEqual(acquired, [True])
+
+        self.frontier.close()
+        self.assertFalse(self.frontier.acquire_host("https://a.org/sitemap.xml"))
+
+    def test_best_url_first(self):
+        saved = config.pattern_peers_family
+        config.pattern_peers_family = re.compile(r"^https://peers\.org")
+        try:
+            self.frontier.put(("https://other.org/tag/news", 1, 1))
+            self.frontier.put(("https://other.org/about", 1, 1))
+            self.frontier.put(("https://peers.org/2023/05/an-article-about-a-topic", 1, 1))
+            self.assertEqual(self.frontier.get(timeout=0.1)[0], "https://peers.org/2023/05/an-article-about-a-topic")
+            self.assertEqual(self.frontier.get(timeout=0.1)[0], "https://other.org/about")
+        finally:
+            config.pattern_peers_family = saved
+
+    def test_inlinks_raise_priority(self):
+        self.frontier.put(("https://a.org/1", 1, 1))
+        self.frontier.put(("https://a.org/2", 1, 1))
+        # another page links to a.org/2: it is re-scored, not queued twice
+        self.frontier.put(("https://a.org/2", 1, 1))
+        self.assertEqual(self.frontier.qsize(), 2)
+        self.assertEqual(self.frontier.unfinished_tasks, 2)
+        self.assertEqual(self.frontier.get(timeout=0.1)[0], "https://a.org/2")
+
+    def test_retry_after_delays_only_that_host(self):
+        self.frontier.put(("https://a.org/1", 0, 0))
+        item = self.frontier.get(timeout=0.1)
+        self.frontier.record_response(item[0], 429, retry_after="30")
+        self.assertTrue(self.frontier.retry_later(item))
+        self.frontier.task_done(item[0])
+
+        self.frontier.put(("https://b.org/1", 0, 0))
+        self.assertEqual(self.frontier.get(timeout=0.1)[0], "https://b.org/1")
+        with self.assertRaises(queue.Empty):
+            self.frontier.get(timeout=0.05)
+        self.assertEqual(self.frontier.unfinished_tasks, 2)
+
+    def test_idle_hosts_are_forgotten(self):
+        config.SCHED_HOST_INITIAL_CONCURRENCY = 2
+        self.frontier.put(("https://a.org/1", 0, 0))
+        self.frontier.put(("https://b.org/1", 0, 0))
+        for _ in range(2):
+            url = self.frontier.get(timeout=0.1)[0]
+            self.frontier.record_response(url, 429 if url.startswith("https://a.org") else 200)
+            self.frontier.task_done(url)
+
+        # b.org has nothing left to fetch, a.org is kept for its backoff
+        self.assertEqual(list(self.frontier.hosts), ["a.org"])
+        self.frontier.put(("https://b.org/2", 0, 0))
+        self.assertEqual(self.frontier.get(timeout=0.1)[0], "https://b.org/2")
+
+    def test_retries_are_limited(self):
+        item = ("https://a.org/1", 0, 0)
+        for _ in range(config.RATELIMIT_RETRIES):
+            self.assertTrue(self.frontier.retry_later(item))
+        self.assertFalse(self.frontier.retry_later(item))
+
+    def test_parse_retry_after(self):
+        self.assertEqual(parse_retry_after("5"), 5.0)
+        self.assertIsNone(parse_retry_after("soon"))
+        future = time.strftime("%a, %d %b %Y %H:%M:%S GMT", time.gmtime(time.time() + 60))
+        self.assertGreater(parse_retry_after(future), 30)
+
+
+if __name__ == "__main__":
+    unittest.main()
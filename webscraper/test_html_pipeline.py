@@ -0,0 +1,47 @@
+import unittest
+
+import content_filter
+import extract_pool
+import html_pipeline
+import web_scraper_base
+
+# a div that mixes text and inline tags with block children, newspaper3k rewrites it into paragraphs
+MIXED_PAGE = """<!DOCTYPE html><html lang="en"><head><meta charset="utf-8"><title>Mixed Page</title></head><body>
+<script src="https://substackcdn.com/bundle/app.js"></script>
+<nav><a href="/a">A</a> <a href="/b">B</a></nav>
+<div class="content">Intro with <a href="/link">a link</a> and <b>bold</b> words in a div that mixes text and tags.
+<div><p>The first paragraph of the article has a good number of words so that it is kept as the body text.</p>
+<p>The second paragraph continues with more words about the subject of the article and the evidence.</p></div>
+Tail text after the inner div with <i>italic</i> words.</div>
+<div>Another div with <span>inline</span> text only and a <a href="/x">link</a>.</div>
+</body></html>"""
+
+
+class TestHtmlPipeline(unittest.TestCase):
+    def test_shared_tree_gives_the_text_of_a_full_parse(self):
+        page = html_pipeline.parse_html(MIXED_PAGE)
+        self.assertEqual(html_pipeline.extract_links(page), ["/a", "/b", "/link", "/x"])
+        title, text = content_filter.extract_content_newspaper(MIXED_PAGE, page)
+        self.assertEqual((title, text), content_filter.extract_content_newspaper(MIXED_PAGE))
+        self.assertEqual(title, "Mixed Page")
+        self.assertIn("The second paragraph continues", text)
+
+    def test_extract_html_in_the_pool(self):
+        result = web_scraper_base.extract_html(MIXED_PAGE, True)
+        hash_val, html_content, hrefs, title, text, _ = result
+        self.assertNotIn(b"substackcdn", html_content)
+        self.assertEqual(hash_val, web_scraper_base.hash_html_content(html_content))
+        self.assertEqual(hrefs, ["/a", "/b", "/link", "/x"])
+        self.assertEqual(title, "Mixed Page")
+        self.assertIn("The first paragraph of the article", text)
+
+        pool = extract_pool.ExtractPool(num_processes=1)
+        try:
+            self.assertEqual(pool.run(web_scraper_base.extract_html, MIXED_PAGE, True), result)
+            self.assertEqual(pool.stats()["tasks"], 1)
+        finally:
+            pool.shutdown()
+
+
+if __name__ == "__main__":
+    unittest.main()
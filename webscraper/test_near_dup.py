@@ -0,0 +1,47 @@
+import os
+import random
+import tempfile
+import unittest
+
+from near_dup import NearDupIndex, cluster_corpus, hamming_distance, text_fingerprint
+
+WORDS = ("peer review science journal study evidence data result method analysis research paper author editor "
+         "publish citation theory model experiment sample report health policy government public").split()
+
+
+def make_text(seed, num_words=400):
+    rnd = random.Random(seed)
+    return " ".join(rnd.choice(WORDS) for _ in range(num_words))
+
+
+class TestNearDup(unittest.TestCase):
+    def test_small_edits_are_near_duplicates(self):
+        text = make_text(1)
+        edited = "Updated on March 3, 2024. " + text + " 1,234 views"
+        fp, edited_fp, other_fp = text_fingerprint(text), text_fingerprint(edited), text_fingerprint(make_text(2))
+        self.assertLessEqual(hamming_distance(fp, edited_fp), 3)
+        self.assertGreater(hamming_distance(fp, other_fp), 3)
+
+    def test_short_texts_have_no_fingerprint(self):
+        self.assertIsNone(text_fingerprint("just a few words"))
+
+    def test_index_finds_near_duplicates_only(self):
+        index = NearDupIndex(max_distance=3)
+        fp = text_fingerprint(make_text(1))
+        self.assertIsNone(index.add_if_new(fp))
+        self.assertEqual(index.add_if_new(fp ^ 0b101), fp)
+        self.assertIsNone(index.add_if_new(fp ^ 0b11111))
+        self.assertEqual(len(index), 2)
+
+    def test_cluster_corpus(self):
+        with tempfile.TemporaryDirectory() as corpus_dir:
+            texts = {"a.txt": make_text(1), "b.txt": make_text(1) + " 42 comments", "c.txt": make_text(3)}
+            for name, text in texts.items():
+                with open(os.path.join(corpus_dir, name), "w") as file:
+                    file.write(text)
+            clusters = cluster_corpus(corpus_dir)
+        self.assertEqual([[os.path.basename(p) for p in c] for c in clusters], [["a.txt", "b.txt"]])
+
+
+if __name__ == "__main__":
+    unittest.main()
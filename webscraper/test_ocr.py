@@ -0,0 +1,99 @@
+import os
+import shutil
+import tempfile
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+import fitz  # PyMuPDF
+
+import batch_convert
+import cache
+import cache_db
+import config
+import ocr
+import pdf_fetcher
+
+
+# Returns a PDF with a text page and a scanned page (an image without text)
+def make_scanned_pdf():
+    doc = fitz.open()
+    page = doc.new_page()
+    page.insert_text((72, 72), "Committee Report", fontsize=20)
+    page.insert_text((72, 120), "The first page has a text layer and needs no OCR at all.", fontsize=11)
+    page = doc.new_page()
+    pixmap = fitz.Pixmap(fitz.csGRAY, fitz.IRect(0, 0, 64, 64), False)
+    pixmap.clear_with(200)
+    page.insert_image(fitz.Rect(72, 72, 500, 500), pixmap=pixmap)
+    content = doc.tobytes()
+    doc.close()
+    return content
+
+
+class TestOcr(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.db_path = os.path.join(self.tmp_dir, "cache.db")
+        self.saved = config.DB_CACHE_PATH, config.OCR_SPOOL_LOCATION
+        config.DB_CACHE_PATH = self.db_path
+        config.OCR_SPOOL_LOCATION = os.path.join(self.tmp_dir, "spool")
+        cache.init_db(self.db_path)
+
+    def tearDown(self):
+        config.DB_CACHE_PATH, config.OCR_SPOOL_LOCATION = self.saved
+        cache_db.close_connections()
+        shutil.rmtree(self.tmp_dir)
+
+    def test_scanned_pages_are_reported(self):
+        txt_path = os.path.join(self.tmp_dir, "report.txt")
+        _, ocr_pages = pdf_fetcher.extract_clean_pdf_text_to_file(make_scanned_pdf(), txt_path)
+        self.assertEqual(ocr_pages, [1])
+        with open(txt_path, "r", encoding="utf-8") as file:
+            self.assertIn("needs no OCR at all.", file.read())
+
+    def test_ocr_text_is_written_and_cached(self):
+        content = make_scanned_pdf()
+        for run in range(2):
+            txt_path = os.path.join(self.tmp_dir, f"report{run}.txt")
+            _, ocr_pages = pdf_fetcher.extract_clean_pdf_text_to_file(content, txt_path)
+            pool = ocr.OcrPool(max_pending=1, executor=ThreadPoolExecutor(max_workers=1))
+            with mock.patch.object(ocr, "ocr_page", return_value="Text read from the scanned page.") as ocr_page:
+                pool.submit(content, "hash", txt_path, ocr_pages).result()
+                pool.shutdown()
+            with open(txt_path, "r", encoding="utf-8") as file:
+                self.assertTrue(file.read().endswith("\n\nText read from the scanned page."))
+            # the second run finds the page in the cache
+            self.assertEqual(ocr_page.call_count, 1 - run)
+            self.assertEqual(pool.stats()["cached_pages"], run)
+        self.assertEqual(os.listdir(config.OCR_SPOOL_LOCATION), [])
+
+    def run_ocr(self, content, txt_path, ocr_pages, cleaned_url=None):
+        pool = ocr.OcrPool(executor=ThreadPoolExecutor(max_workers=1))
+        with mock.patch.object(ocr, "ocr_page", return_value="Text read from the scanned page."):
+            pool.submit(content, "hash", txt_path, ocr_pages, cleaned_url).result()
+            pool.shutdown()
+
+    def test_cache_entry_gets_the_new_txt_size(self):
+        content = make_scanned_pdf()
+        txt_path = os.path.join(self.tmp_dir, "report.txt")
+        _, ocr_pages = pdf_fetcher.extract_clean_pdf_text_to_file(content, txt_path)
+        cache.update_cache("site.org/report.pdf", "application/pdf", "report.pdf", len(content), txt_path,
+                           os.path.getsize(txt_path), "hash", db_path=self.db_path)
+        self.run_ocr(content, txt_path, ocr_pages, "site.org/report.pdf")
+        self.assertEqual(cache.get_cached_url_data(self.db_path, "site.org/report.pdf")[5], os.path.getsize(txt_path))
+
+    def test_batch_convert_uses_cached_ocr_texts(self):
+        pdf_path = os.path.join(self.tmp_dir, "report.pdf")
+        with open(pdf_path, "wb") as file:
+            file.write(make_scanned_pdf())
+        txt_path = os.path.join(self.tmp_dir, "report.txt")
+        self.assertEqual(batch_convert.convert_file("pdf", pdf_path, txt_path)[0], batch_convert.STATUS_NEEDS_OCR)
+
+        self.run_ocr(make_scanned_pdf(), os.path.join(self.tmp_dir, "crawled.txt"), [1])
+        self.assertEqual(batch_convert.convert_file("pdf", pdf_path, txt_path)[0], batch_convert.STATUS_CONVERTED)
+        with open(txt_path, "r", encoding="utf-8") as file:
+            self.assertTrue(file.read().endswith("\n\nText read from the scanned page."))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,100 @@
+import os
+import statistics
+import tempfile
+import tracemalloc
+import unittest
+from concurrent.futures import ProcessPoolExecutor
+from unittest import mock
+
+import fitz
+
+import config
+import extract_pool
+import pdf_fetcher
+
+
+def make_pdf(num_pages):
+    doc = fitz.open()
+    for i in range(num_pages):
+        page = doc.new_page()
+        page.insert_text((72, 30), "Report of the Committee")
+        page.insert_text((72, 100), f"Paragraph of page {i} about the find-")
+        page.insert_text((72, 114), "ings of the committee.")
+        page.insert_text((300, 820), str(i + 1))
+    doc.set_metadata({"title": "Committee Report"})
+    content = doc.tobytes()
+    doc.close()
+    return content
+
+
+class TestPdfFetcher(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.output_path = os.path.join(self.dir.name, "report.txt")
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def test_streaming_output_matches_extract(self):
+        content = make_pdf(8)
+        title, text = pdf_fetcher.extract_clean_pdf_text(content)
+        self.assertEqual(title, "Committee Report")
+        # headers and page numbers are dropped, lines are reflowed
+        self.assertNotIn("Report of the Committee", text)
+        self.assertIn("Paragraph of page 7 about the findings of the committee.", text)
+
+        self.assertEqual(pdf_fetcher.extract_clean_pdf_text_to_file(content, self.output_path), (title, []))
+        with open(self.output_path, encoding="utf-8") as file:
+            self.assertEqual(file.read(), title + "\n\n" + text)
+
+    def test_streaming_memory_does_not_grow_with_pages(self):
+        peaks = []
+        # one batch of pages is held in memory, 20 pages must span several batches
+        with mock.patch.object(config, "PDF_FILTER_BATCH_PAGES", 4):
+            for num_pages in (20, 200):
+                content = make_pdf(num_pages)
+                tracemalloc.start()
+                pdf_fetcher.extract_clean_pdf_text_to_file(content, self.output_path)
+                peaks.append(tracemalloc.get_traced_memory()[1])
+                tracemalloc.stop()
+        self.assertLess(peaks[1], 2 * peaks[0])
+
+    def test_page_spans_font_statistics(self):
+        def block(sizes, y0=100):
+            return {"type": 0, "bbox": (72, y0, 300, y0 + 20),
+                    "lines": [{"spans": [{"text": f"span {size}", "size": size} for size in sizes]}]}
+        pages = [{"width": 600, "height": 800, "blocks": [block([10.0, 12.0]), block([11.5, 0, 9.0])]},
+                 {"width": 600, "height": 800, "blocks": [block([8.0, 14.0, 10.5])]},
+                 {"width": 600, "height": 800, "blocks": [{"type": 1, "bbox": (0, 0, 10, 10)}]}]
+        spans = pdf_fetcher.PageSpans(pages)
+        self.assertEqual(spans.median_fonts().tolist(), [statistics.median([10.0, 12.0, 11.5, 9.0]),
+                                                         statistics.median([8.0, 14.0, 10.5]), 10.0])
+        self.assertEqual(spans.block_avg_fonts().tolist(), [11.0, 10.25, 32.5 / 3, 0.0])
+        self.assertEqual(spans.block_texts, ["span 10.0 span 12.0", "span 11.5 span 0 span 9.0",
+                                             "span 8.0 span 14.0 span 10.5", ""])
+
+    def test_parallel_output_matches_streaming(self):
+        content = make_pdf(30)
+        pdf_fetcher.extract_clean_pdf_text_to_file(content, self.output_path)
+        parallel_path = os.path.join(self.dir.name, "parallel.txt")
+        with mock.patch.multiple(config, PDF_PARALLEL_MIN_PAGES=10, PDF_PARALLEL_RANGE_PAGES=7), \
+                ProcessPoolExecutor(max_workers=2) as executor:
+            self.assertEqual(pdf_fetcher.extract_clean_pdf_text_parallel(content, parallel_path, executor),
+                             ("Committee Report", []))
+        with open(self.output_path, encoding="utf-8") as serial, open(parallel_path, encoding="utf-8") as parallel:
+            self.assertEqual(parallel.read(), serial.read())
+
+    def test_extract_pool_counts_pdf_tasks(self):
+        pool = extract_pool.ExtractPool(num_processes=2)
+        try:
+            with mock.patch.multiple(config, PDF_PARALLEL_MIN_PAGES=10, PDF_PARALLEL_RANGE_PAGES=7):
+                pdf_fetcher.extract_clean_pdf_text_parallel(make_pdf(30), self.output_path, pool)
+                pdf_fetcher.extract_clean_pdf_text_parallel(make_pdf(5), self.output_path, pool)
+        finally:
+            pool.shutdown()
+        # 5 page ranges and one small PDF
+        self.assertEqual(pool.stats()["tasks"], 6)
+
+
+if __name__ == '__main__':
+    unittest.main()
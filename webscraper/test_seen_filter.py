@@ -0,0 +1,48 @@
+import os
+import tempfile
+import unittest
+
+from seen_filter import SeenFilter
+
+
+class TestSeenFilter(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.location = os.path.join(self.temp_dir.name, "seen_content")
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_add_is_check_and_insert(self):
+        seen = SeenFilter(self.location, initial_capacity=100)
+        self.assertTrue(seen.add("abc"))
+        self.assertFalse(seen.add("abc"))
+        self.assertIn("abc", seen)
+        self.assertNotIn("def", seen)
+        seen.close()
+
+    def test_grows_past_capacity(self):
+        seen = SeenFilter(self.location, initial_capacity=100)
+        for i in range(1000):
+            seen.add(f"hash{i}")
+        self.assertGreater(seen.stats()["slices"], 1)
+        self.assertTrue(all(f"hash{i}" in seen for i in range(1000)))
+        false_positives = sum(1 for i in range(1000) if f"other{i}" in seen)
+        self.assertLess(false_positives, 5)
+        seen.close()
+
+    def test_reloads_from_disk(self):
+        seen = SeenFilter(self.location, initial_capacity=100)
+        for i in range(300):
+            seen.add(f"hash{i}")
+        seen.close()
+
+        resumed = SeenFilter(self.location, initial_capacity=100)
+        self.assertEqual(len(resumed), 300)
+        self.assertFalse(resumed.add("hash42"))
+        resumed.delete()
+        self.assertFalse(os.path.exists(self.location))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,37 @@
+import unittest
+
+import config
+from url_canon import canonicalize
+from utils import clean_url
+
+
+class TestUrlCanon(unittest.TestCase):
+    def setUp(self):
+        self.saved = config.CANON_HOST_RULES
+        config.CANON_HOST_RULES = {"site.org": {"www": True}, "other.org": {"www": False, "drop_params": {"ref"}}}
+
+    def tearDown(self):
+        config.CANON_HOST_RULES = self.saved
+
+    def test_variants_share_one_form(self):
+        variants = ["https://www.site.org/a/b?y=2&x=1",
+                    "HTTPS://site.org:443/a/b?x=1&utm_source=news&y=2#comments",
+                    "https://WWW.SITE.ORG/a/%62?fbclid=abc&x=1&y=2"]
+        self.assertEqual({canonicalize(url) for url in variants}, {"https://www.site.org/a/b?x=1&y=2"})
+
+    def test_host_rules(self):
+        self.assertEqual(canonicalize("http://www.other.org/p?ref=home&id=3"), "http://other.org/p?id=3")
+        # hosts without a rule keep their form
+        self.assertEqual(canonicalize("http://www.unknown.org"), "http://www.unknown.org/")
+        self.assertEqual(canonicalize("http://unknown.org:8080/A"), "http://unknown.org:8080/A")
+
+    def test_other_urls_unchanged(self):
+        for url in ("mailto:someone@site.org", "javascript:void(0)", "site.org/no-scheme"):
+            self.assertEqual(canonicalize(url), url)
+
+    def test_cache_key(self):
+        self.assertEqual(clean_url("https://site.org/a/?utm_medium=x#top"), "www.site.org/a")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,37 @@
+import unittest
+
+import url_filter
+from url_filter import UrlFilter
+
+
+class TestUrlFilter(unittest.TestCase):
+    def setUp(self):
+        self.filter = UrlFilter()
+
+    def test_reason_codes(self):
+        cases = {
+            "https://www.wanttoknow.info/a-some-article": url_filter.ACCEPTED,
+            "mailto:someone@wanttoknow.info": url_filter.REJECTED_SCHEME,
+            "javascript:void(0)": url_filter.REJECTED_SCHEME,
+            "https://m.youtube.com/watch?v=1": url_filter.REJECTED_DOMAIN,
+            "https://www.cdc.gov/page": url_filter.REJECTED_DOMAIN,
+            "https://www.gov.uk/page": url_filter.REJECTED_DOMAIN,
+            "https://site.org/redirect?to=somewhere": url_filter.REJECTED_KEYWORD,
+            "https://web.archive.org/web/2005/http://site.org/": url_filter.REJECTED_ARCHIVE,
+            "https://site.org/images/Photo.JPG": url_filter.REJECTED_IMAGE,
+            "https://site.org/image.png?w=300": url_filter.REJECTED_IMAGE,
+            "https://author.substack.com/p/post?comments=true": url_filter.REJECTED_SUBSTACK_COMMENT,
+            "https://author.substack.com/p/post?utm_source=x": url_filter.ACCEPTED,
+        }
+        for url, reason in cases.items():
+            self.assertEqual(self.filter.classify(url), reason, url)
+
+    def test_domains_match_by_suffix_only(self):
+        # "x.com" used to match anywhere in the url
+        self.assertEqual(self.filter.classify("https://www.dropbox.com/s/file.pdf"), url_filter.ACCEPTED)
+        self.assertEqual(self.filter.classify("https://api.x.com/post"), url_filter.REJECTED_DOMAIN)
+        self.assertEqual(self.filter.classify("https://www.government.org/"), url_filter.ACCEPTED)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,77 @@
+import os
+import tempfile
+import threading
+import unittest
+
+from visited_store import VisitedStore
+
+
+class TestVisitedStore(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.temp_dir.name, "visited_urls.bin")
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_add_is_check_and_insert(self):
+        store = VisitedStore(capacity=10)
+        self.assertTrue(store.add("https://example.com/a"))
+        self.assertFalse(store.add("https://example.com/a"))
+        self.assertIn("https://example.com/a", store)
+        self.assertNotIn("https://example.com/b", store)
+        self.assertEqual(len(store), 1)
+
+    def test_grow_and_discard_keep_all_urls(self):
+        store = VisitedStore(capacity=10)
+        urls = [f"https://example.com/page/{i}" for i in range(5000)]
+        for url in urls:
+            store.add(url)
+        for url in urls[::2]:
+            self.assertTrue(store.discard(url))
+        self.assertEqual(len(store), 2500)
+        for i, url in enumerate(urls):
+            self.assertEqual(url in store, i % 2 == 1)
+
+    def test_snapshot_roundtrip(self):
+        store = VisitedStore(path=self.path, snapshot_every=0)
+        store.add("https://example.com/a")
+        store.save()
+
+        resumed = VisitedStore(path=self.path)
+        self.assertTrue(resumed.load())
+        self.assertIn("https://example.com/a", resumed)
+        self.assertEqual(len(resumed), 1)
+
+        resumed.delete_snapshot()
+        self.assertFalse(VisitedStore(path=self.path).load())
+
+
+    def test_add_does_not_wait_for_the_snapshot_write(self):
+        store = VisitedStore(path=self.path, snapshot_every=2)
+        writing, finish_write = threading.Event(), threading.Event()
+        write = store._write
+
+        def slow_write(count, table):
+            writing.set()
+            finish_write.wait(5)
+            write(count, table)
+
+        store._write = slow_write
+        store.add("https://example.com/a")
+        snapshot = threading.Thread(target=store.add, args=("https://example.com/b",))
+        snapshot.start()
+        self.assertTrue(writing.wait(5))
+        # the table was copied, adding goes on while it is written
+        self.assertTrue(store.add("https://example.com/c"))
+        finish_write.set()
+        snapshot.join(5)
+
+        resumed = VisitedStore(path=self.path)
+        self.assertTrue(resumed.load())
+        self.assertEqual(len(resumed), 2)
+        self.assertNotIn("https://example.com/c", resumed)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,53 @@
+import os
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+import cache
+import cache_db
+import config
+import wayback
+
+
+class TestWayback(unittest.TestCase):
+    def setUp(self):
+        self.db_fd, self.db_path = tempfile.mkstemp()
+        self.saved_db_path = config.DB_CACHE_PATH
+        config.DB_CACHE_PATH = self.db_path
+        cache.init_db(self.db_path)
+
+    def tearDown(self):
+        config.DB_CACHE_PATH = self.saved_db_path
+        cache_db.close_connections()
+        os.close(self.db_fd)
+        os.remove(self.db_path)
+
+    def test_raw_snapshot_url(self):
+        self.assertEqual(wayback.get_raw_snapshot_url("http://web.archive.org/web/20050101000000/http://site.org/a"),
+                         "http://web.archive.org/web/20050101000000id_/http://site.org/a")
+
+    def test_lookups_are_cached(self):
+        snapshot = "http://web.archive.org/web/20050101000000/http://site.org/a"
+        with mock.patch.object(wayback, "query_availability", side_effect=[snapshot, None]) as query:
+            for _ in range(2):
+                self.assertEqual(wayback.lookup("http://site.org/a"), snapshot)
+                # no snapshot is remembered too
+                self.assertIsNone(wayback.lookup("http://site.org/gone"))
+            self.assertEqual(query.call_count, 2)
+
+    def test_pool_limits_pending_recoveries(self):
+        pool = wayback.WaybackPool(num_workers=1, max_pending=1)
+        release = threading.Event()
+        blocker = lambda: release.wait(1)
+        first = pool.submit(blocker)
+        self.assertIsNone(pool.submit(blocker))
+        release.set()
+        first.result(timeout=1)
+        self.assertIsNotNone(pool.submit(blocker))
+        pool.shutdown()
+        self.assertEqual(pool.stats()["dropped"], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
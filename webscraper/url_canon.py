@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+
+"""This module provides the url canonicalization of the crawler.
+
+Links to the same page are written in many ways, each one used to be its own frontier entry, cache row
+and corpus file. canonicalize() rewrites an http(s) url into one canonical, still fetchable form:
+- scheme and host are lowercased, default ports and the #fragment are removed, an empty path becomes /
+- percent-escapes are uppercased and escaped unreserved characters (letters, digits, -._~) are decoded
+- tracking parameters (CANON_TRACKING_PARAMS, CANON_TRACKING_PARAM_PREFIXES) are removed and the
+  remaining query parameters are sorted
+- CANON_HOST_RULES apply per host (matched by domain suffix): the www. or bare form of the host, extra
+  parameters to drop, case-insensitive paths
+
+The crawl engines canonicalize urls when they are queued, and utils.clean_url canonicalizes before it
+makes a cache key, so cache rows and corpus file names follow the canonical form too.
+
+To see how many duplicate fetches canonicalization would have saved on an existing cache db:
+    python url_canon.py report [db_path]
+"""
+import re
+import sqlite3
+import sys
+from collections import defaultdict
+from urllib.parse import unquote, urlsplit, urlunsplit
+
+import config
+
+DEFAULT_PORTS = {"http": 80, "https": 443}
+UNRESERVED = frozenset("ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789-._~")
+PERCENT_ESCAPE = re.compile(r"%[0-9a-fA-F]{2}")
+
+
+def _normalize_escape(match):
+    char = chr(int(match.group(0)[1:], 16))
+    return char if char in UNRESERVED else match.group(0).upper()
+
+
+# Returns the CANON_HOST_RULES entry of host (without www.), {} if there is none
+def get_host_rule(host):
+    labels = host.split(".")
+    for i in range(len(labels) - 1):
+        rule = config.CANON_HOST_RULES.get(".".join(labels[i:]))
+        if rule is not None:
+            return rule
+    return {}
+
+
+def _is_tracking_param(name, rule):
+    name = unquote(name).lower()
+    return (name in config.CANON_TRACKING_PARAMS or name.startswith(config.CANON_TRACKING_PARAM_PREFIXES)
+            or name in rule.get("drop_params", ()))
+
+
+# Returns the canonical form of an http(s) url, other urls are returned unchanged
+def canonicalize(url):
+    try:
+        parts = urlsplit(url.strip())
+        port = parts.port
+    except ValueError:
+        return url
+    scheme = parts.scheme.lower()
+    if scheme not in DEFAULT_PORTS or not parts.hostname:
+        return url
+
+    host = parts.hostname.rstrip(".")
+    bare_host = host[4:] if host.startswith("www.") else host
+    rule = get_host_rule(bare_host)
+    www = rule.get("www")
+    if www is True:
+        host = "www." + bare_host
+    elif www is False:
+        host = bare_host
+    netloc = f"[{host}]" if ":" in host else host
+    if port is not None and port != DEFAULT_PORTS[scheme]:
+        netloc = f"{netloc}:{port}"
+    if parts.username is not None:
+        netloc = parts.netloc.rpartition("@")[0] + "@" + netloc
+
+    path = PERCENT_ESCAPE.sub(_normalize_escape, parts.path) or "/"
+    if rule.get("lowercase_path"):
+        path = path.lower()
+
+    query = ""
+    if parts.query:
+        params = [p for p in parts.query.split("&") if p and not _is_tracking_param(p.partition("=")[0], rule)]
+        query = "&".join(sorted(PERCENT_ESCAPE.sub(_normalize_escape, p) for p in params))
+    return urlunsplit((scheme, netloc, path, query, ""))
+
+
+# Reads the cleaned urls of a cache db and prints how many of them are duplicates after canonicalization
+def report(db_path):
+    conn = sqlite3.connect(db_path)
+    rows = conn.execute("SELECT cleaned_url, url_file_size FROM downloads").fetchall()
+    pending = [row[0] for row in conn.execute("SELECT url FROM url_queue").fetchall()]
+    conn.close()
+
+    groups = defaultdict(list)
+    www_groups = defaultdict(set)
+    for cleaned_url, size in rows:
+        canonical = canonicalize("http://" + cleaned_url)
+        key = canonical[len("http://"):].rstrip("/")
+        groups[key].append((cleaned_url, size))
+        host, _, rest = key.partition("/")
+        www_groups[(host[4:] if host.startswith("www.") else host, rest)].add(host)
+
+    duplicates = [group for group in groups.values() if len(group) > 1]
+    num_duplicates = sum(len(group) - 1 for group in duplicates)
+    duplicate_bytes = sum(sum(size for _, size in sorted(group)[1:]) for group in duplicates)
+    print(f"Cached downloads: {len(rows)}, canonical urls: {len(groups)}")
+    print(f"Duplicate fetches saved: {num_duplicates} ({duplicate_bytes / (1024 * 1024):.1f} MB)")
+    for group in sorted(duplicates, key=len, reverse=True)[:20]:
+        print(f"    {len(group)}x: " + ", ".join(cleaned_url for cleaned_url, _ in group[:4]))
+
+    # pages cached under both the www. and the bare host, a CANON_HOST_RULES www rule would merge them
+    hosts = defaultdict(int)
+    for (bare_host, _), seen_hosts in www_groups.items():
+        if len(seen_hosts) > 1:
+            hosts[bare_host] += 1
+    for bare_host, count in sorted(hosts.items(), key=lambda item: item[1], reverse=True):
+        print(f"Cached under both www.{bare_host} and {bare_host} without a www rule: {count} pages")
+
+    pending_canonical = {canonicalize(url) for url in pending}
+    print(f"Pending urls: {len(pending)}, canonical: {len(pending_canonical)}")
+
+
+def main():
+    if len(sys.argv) < 2 or sys.argv[1] != "report":
+        print("Usage: python url_canon.py report [db_path]")
+        return
+    report(sys.argv[2] if len(sys.argv) > 2 else config.DB_CACHE_PATH)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,31 @@
+#!/usr/bin/env python3
+
+"""This module scores urls for the best-first crawl frontier (see host_scheduler.HostFrontier).
+
+The score adds up:
+- a bonus for the peers family sites (config.pattern_peers_family)
+- a penalty per hop from the start url
+- a bonus growing with the number of crawled pages that link to the url (log scale)
+- url heuristics: article slugs, dated paths and pdfs score up, tag/archive/search/paging pages score down
+
+All weights are PRIORITY_* settings in config.py.
+"""
+import math
+from urllib.parse import urlparse
+
+import config
+
+
+def score_url(url, depth_actual, num_inlinks=1):
+    score = config.PRIORITY_PER_DEPTH * depth_actual
+    if config.pattern_peers_family.match(url):
+        score += config.PRIORITY_PEERS_FAMILY
+    score += config.PRIORITY_PER_INLINK * math.log2(1 + num_inlinks)
+
+    if config.pattern_priority_listing_url.search(url):
+        score += config.PRIORITY_LISTING_URL
+    elif config.pattern_priority_article_url.search(urlparse(url).path):
+        score += config.PRIORITY_ARTICLE_URL
+    if '?' in url:
+        score += config.PRIORITY_QUERY_STRING
+    return score
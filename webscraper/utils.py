@@ -4,13 +4,16 @@ from urllib.parse import urlparse, parse_qs
 from bs4 import BeautifulSoup
 import config
 import hashlib
-import requests
+import http_session
 import sys
+import url_canon
 
 import content_filter
 
 
+# cache key and corpus file name of a url, made from its canonical form (see url_canon.py)
 def clean_url(url):
+    url = url_canon.canonicalize(url)
     url = url.replace('https://', '')
     url = url.replace('http://', '')
     return url.rstrip('/')
@@ -27,7 +30,7 @@ def error(*args, **kwargs):
 
 
 def download_url(url, path):
-    response = requests.get(url, headers=config.headers)
+    response = http_session.get(url, headers=config.headers)
     with open(path, 'wb') as file:
         file.write(response.content)
 
@@ -46,7 +49,7 @@ def get_txt_file_name(pdf_filename):
 def get_wayback_url(url):
     """Fetch the closest archived version of a URL from Archive.org."""
     params = {"url": url}
-    response = requests.get(config.WAYBACK_API, params=params)
+    response = http_session.get(config.WAYBACK_API, params=params)
     if response.status_code == 200:
         result = response.json()
         if "archived_snapshots" in result and "closest" in result["archived_snapshots"]:
@@ -81,6 +84,11 @@ def hash_html_content(html):
     #return hashlib.sha256(normalized.encode('utf-8')).hexdigest()
 
 
+# hash of raw (binary) content such as PDF files
+def hash_bytes(content):
+    return hashlib.sha256(content).hexdigest()
+
+
 def hash_soup(soup: BeautifulSoup) -> str:
     html = soup.prettify()
     return hash_html_content(html)
@@ -94,10 +102,14 @@ def is_html_file(filename):
     return filename.lower().endswith((".html", ".htm"))
 
 
-def save_txt_content_to_file(txt_filename, html_content):
-    title, content = content_filter.extract_content_newspaper(html_content)
+def save_txt_content_to_file(txt_filename, html_content, page=None):
+    title, content = content_filter.extract_content_newspaper(html_content, page)
     # content = content_filter.extract_content_from_soup(soup)
+    return save_txt_to_file(txt_filename, title, content)
+
 
+# saves already extracted text, returns False if there was no text to save
+def save_txt_to_file(txt_filename, title, content):
     if len(content) == 0:
         return False
 
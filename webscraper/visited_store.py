@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+
+"""This module provides the visited url store of the crawler.
+
+A python set of full url strings costs well over 100 bytes per url and is lost when the crawler stops.
+VisitedStore keeps a 64-bit fingerprint (blake2b) per url instead, in an open-addressing hash table
+(linear probing) backed by a flat array, so it needs about 12-16 bytes per url and holds tens of
+millions of urls:
+- add(url) is an atomic check-and-insert, it returns False if the url was already in the store
+- `url in store` and discard(url) are safe to call from any thread
+- the table doubles when it gets 70% full
+- save() snapshots the table to disk (atomically, through a temp file), add() also does so every
+  VISITED_STORE_SNAPSHOT_EVERY_N new urls. The table is copied under the lock and written outside of it,
+  so the other threads keep adding urls while a large table is written. load() restores a snapshot so a resumed crawl skips the
+  urls it already visited without fetching them
+
+Two different urls share a fingerprint with a probability of about n^2 / 2^65 (~1e-4 for 50M urls).
+"""
+import hashlib
+import os
+import struct
+import tempfile
+import threading
+from array import array
+
+import config
+from utils import debug, error
+
+MAX_LOAD_FACTOR = 0.7
+
+# snapshot header: magic, format version, number of urls, table size
+SNAPSHOT_MAGIC = b"VURL"
+SNAPSHOT_VERSION = 1
+SNAPSHOT_HEADER = struct.Struct("<4sIQQ")
+
+
+# 64-bit fingerprint of a url, never 0 (0 marks an empty slot)
+def url_fingerprint(url):
+    fp = int.from_bytes(hashlib.blake2b(url.encode("utf-8"), digest_size=8).digest(), "little")
+    return fp or 1
+
+
+def _table_size(capacity):
+    size = 1024
+    while size * MAX_LOAD_FACTOR < capacity:
+        size *= 2
+    return size
+
+
+class VisitedStore:
+    def __init__(self, capacity=config.VISITED_STORE_INITIAL_CAPACITY, path=None,
+                 snapshot_every=config.VISITED_STORE_SNAPSHOT_EVERY_N):
+        self.path = path
+        self.snapshot_every = snapshot_every
+        self.lock = threading.Lock()
+        self.save_lock = threading.Lock()  # one snapshot written at a time, in the order they were taken
+        self._reset(_table_size(capacity))
+        self.num_since_snapshot = 0
+
+    def _reset(self, size):
+        self.table = array("Q", bytes(8 * size))
+        self.mask = size - 1
+        self.count = 0
+
+    # returns the slot holding fp, or the empty slot where it belongs
+    def _find(self, fp):
+        table = self.table
+        mask = self.mask
+        i = fp & mask
+        while True:
+            v = table[i]
+            if v == 0 or v == fp:
+                return i
+            i = (i + 1) & mask
+
+    def _grow(self):
+        old_table = self.table
+        self._reset(len(old_table) * 2)
+        for fp in old_table:
+            if fp:
+                self.table[self._find(fp)] = fp
+                self.count += 1
+        debug(f"Visited store grew to {len(self.table)} slots")
+
+    # Adds url, returns False if it was already in the store
+    def add(self, url):
+        fp = url_fingerprint(url)
+        with self.lock:
+            i = self._find(fp)
+            if self.table[i] == fp:
+                return False
+            self.table[i] = fp
+            self.count += 1
+            if self.count > len(self.table) * MAX_LOAD_FACTOR:
+                self._grow()
+
+            self.num_since_snapshot += 1
+            snapshot_due = (self.path is not None and self.snapshot_every
+                            and self.num_since_snapshot >= self.snapshot_every)
+            if snapshot_due:
+                self.num_since_snapshot = 0
+        if snapshot_due:
+            self.save()
+        return True
+
+    def __contains__(self, url):
+        fp = url_fingerprint(url)
+        with self.lock:
+            return self.table[self._find(fp)] == fp
+
+    # Removes url (e.g. to visit it again after a rate limited response), returns False if it wasn't there
+    def discard(self, url):
+        fp = url_fingerprint(url)
+        with self.lock:
+            table = self.table
+            mask = self.mask
+            i = self._find(fp)
+            if table[i] != fp:
+                return False
+            # backward shift deletion: move later entries of the probe run into the hole
+            j = i
+            while True:
+                j = (j + 1) & mask
+                v = table[j]
+                if v == 0:
+                    break
+                home = v & mask
+                if (i < j and i < home <= j) or (i > j and (home > i or home <= j)):
+                    continue
+                table[i] = v
+                i = j
+            table[i] = 0
+            self.count -= 1
+            return True
+
+    def __len__(self):
+        return self.count
+
+    def _write(self, count, table):
+        dir_name = os.path.dirname(self.path) or "."
+        os.makedirs(dir_name, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=dir_name, suffix=".tmp")
+        with os.fdopen(fd, "wb") as file:
+            file.write(SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, count, len(table)))
+            table.tofile(file)
+        os.replace(tmp_path, self.path)
+        debug(f"Visited store saved {count} urls to {self.path}")
+
+    # Snapshots the store to its path, only the copy of the table is made under the lock
+    def save(self):
+        with self.save_lock:
+            with self.lock:
+                count, table = self.count, array("Q", self.table)
+                self.num_since_snapshot = 0
+            self._write(count, table)
+
+    # Deletes the snapshot, the next crawl starts with an empty store
+    def delete_snapshot(self):
+        if self.path is not None and os.path.exists(self.path):
+            os.remove(self.path)
+
+    # Replaces the contents with the snapshot at the store's path, returns False if there is none
+    def load(self):
+        if self.path is None or not os.path.exists(self.path):
+            return False
+        with open(self.path, "rb") as file:
+            magic, version, count, size = SNAPSHOT_HEADER.unpack(file.read(SNAPSHOT_HEADER.size))
+            if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION:
+                error(f"Ignoring visited store snapshot {self.path} with unknown format")
+                return False
+            table = array("Q")
+            table.fromfile(file, size)
+        with self.lock:
+            self.table = table
+            self.mask = size - 1
+            self.count = count
+            self.num_since_snapshot = 0
+        return True
+
+    def stats(self):
+        with self.lock:
+            return {"urls": self.count, "slots": len(self.table), "bytes": len(self.table) * self.table.itemsize}
+
+
+# Returns the crawl's visited store, restored from its last snapshot if resume is True
+def open_store(resume, path=None):
+    store = VisitedStore(path=path or config.VISITED_STORE_PATH)
+    if resume and store.load():
+        error(f"Visited store resumed with {len(store)} urls from {store.path}")
+    return store
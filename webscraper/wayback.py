@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+
+"""This module provides the recovery of broken links from the Wayback Machine.
+
+A page that does not return 200 is looked up in the Wayback Machine availability API and its closest
+snapshot is downloaded instead. archive.org is slow, so recovery is a stage of its own:
+- WaybackPool runs recoveries in WAYBACK_WORKERS threads, crawl workers hand a broken link over and move
+  on to the next url, at most WAYBACK_MAX_PENDING broken links wait for recovery
+- availability lookups are cached in the wayback_lookups table of the cache db, urls without a snapshot
+  too (looked up again after WAYBACK_NEGATIVE_TTL_SECS), so dead links of a re-crawl cost no lookup
+- the snapshot is downloaded unmodified (the id_ form of the snapshot url, without the archive.org toolbar
+  and link rewriting) with a timeout through the shared http session
+The crawler saves the snapshot like a fetched page, see web_scraper_base.recover_broken_link.
+"""
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import requests
+
+import cache
+import config
+import http_session
+from utils import clean_url, debug, error
+
+SNAPSHOT_TIMESTAMP = re.compile(r"(/web/\d+)(/)")
+
+_stats_lock = threading.Lock()
+_stats = {"lookups": 0, "cached_lookups": 0, "snapshots": 0, "downloads": 0}
+
+
+def _count(key):
+    with _stats_lock:
+        _stats[key] += 1
+
+
+# Returns the url of the unmodified snapshot content, e.g. /web/20050101000000id_/http://site.org/
+def get_raw_snapshot_url(archived_url):
+    return SNAPSHOT_TIMESTAMP.sub(r"\1id_\2", archived_url, count=1)
+
+
+# Asks the availability API for the closest snapshot of url, returns its url or None if there is none
+def query_availability(url):
+    response = http_session.get(config.WAYBACK_API, params={"url": url}, headers=config.headers,
+                                timeout=config.WAYBACK_TIMEOUT_SECS)
+    if response.status_code != 200:
+        raise requests.exceptions.HTTPError(f"availability api returned status {response.status_code}")
+    closest = response.json().get("archived_snapshots", {}).get("closest")
+    if closest and closest.get("available", True) and closest.get("url"):
+        return closest["url"]
+    return None
+
+
+# Returns the url of the closest snapshot of url, None if there is none. Uses the cached lookup if there is one.
+def lookup(url):
+    cleaned_url = clean_url(url)
+    cached = cache.get_wayback_lookup(cleaned_url, config.DB_CACHE_PATH)
+    if cached is not None:
+        archived_url, lookup_time = cached
+        if archived_url is not None or \
+                (datetime.now() - lookup_time).total_seconds() < config.WAYBACK_NEGATIVE_TTL_SECS:
+            _count("cached_lookups")
+            return archived_url
+
+    _count("lookups")
+    try:
+        archived_url = query_availability(url)
+    except (requests.exceptions.RequestException, ValueError) as e:
+        # not cached, the next broken link to this url tries again
+        error(f"Wayback availability lookup failed for {url}: {e}")
+        return None
+    cache.save_wayback_lookup(cleaned_url, archived_url, config.DB_CACHE_PATH)
+    return archived_url
+
+
+# Returns (archived_url, content_type, content) of the closest snapshot of url, None if there is none
+def fetch_archived(url):
+    archived_url = lookup(url)
+    if archived_url is None:
+        return None
+    _count("snapshots")
+    try:
+        response = http_session.get(get_raw_snapshot_url(archived_url), headers=config.headers,
+                                    timeout=config.WAYBACK_TIMEOUT_SECS)
+    except requests.exceptions.RequestException as e:
+        error(f"Failed to download archived version {archived_url}: {e}")
+        return None
+    if response.status_code != 200:
+        error(f"Failed to download archived version {archived_url} (Status: {response.status_code})")
+        return None
+    _count("downloads")
+    return archived_url, response.headers.get("Content-Type", ""), response.content
+
+
+class WaybackPool:
+    def __init__(self, num_workers=config.WAYBACK_WORKERS, max_pending=config.WAYBACK_MAX_PENDING):
+        self.executor = ThreadPoolExecutor(max_workers=num_workers, thread_name_prefix="wayback")
+        self.max_pending = max_pending
+        self.lock = threading.Lock()
+        self.num_pending = 0
+        self.num_submitted = 0
+        self.num_dropped = 0
+
+    def _run(self, fn, args):
+        try:
+            return fn(*args)
+        finally:
+            with self.lock:
+                self.num_pending -= 1
+
+    # Runs fn(*args) in the pool, returns its Future or None if too many recoveries are already waiting
+    def submit(self, fn, *args):
+        with self.lock:
+            if self.num_pending >= self.max_pending:
+                self.num_dropped += 1
+                return None
+            self.num_pending += 1
+            self.num_submitted += 1
+        return self.executor.submit(self._run, fn, args)
+
+    def shutdown(self):
+        self.executor.shutdown(wait=True)
+
+    def stats(self):
+        with self.lock:
+            pool_stats = {"submitted": self.num_submitted, "dropped": self.num_dropped}
+        with _stats_lock:
+            pool_stats.update(_stats)
+        return pool_stats
+
+
+# Returns the crawl's wayback recovery pool, None if disabled
+def open_pool():
+    if not config.WAYBACK_ENABLED:
+        return None
+    debug(f"Starting wayback pool with {config.WAYBACK_WORKERS} workers")
+    return WaybackPool()
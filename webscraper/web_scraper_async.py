@@ -0,0 +1,311 @@
+"""
+ PEERS AI Project asyncio Website Scraper
+ Alternative crawl engine to web_scraper_mt. A single event loop keeps up to ASYNC_MAX_IN_FLIGHT fetches
+ in flight using aiohttp, while parsing, file writes and sqlite access run in an executor so the loop never stalls.
+ Select it with CRAWLER_FETCH_STRATEGY = CRAWLER_FETCH_AIOHTTP in config.py.
+"""
+import asyncio
+import queue
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+import aiohttp
+from requests.structures import CaseInsensitiveDict
+
+import cache
+import config
+import discovery
+import hot_cache
+import near_dup
+import ocr
+import seen_filter
+import url_canon
+import visited_store
+import wayback
+from host_scheduler import HostFrontier
+from utils import *
+from web_scraper_base import *
+
+
+# Return tuple (cleaned_url, status_code, content_type, content, was_cached)
+# response_headers is filled with the headers of the http response (if one was made)
+# stale cached copies are revalidated with a conditional request like cache.get_cached_content_or_request()
+async def get_cached_content_or_async_request(session, loop, executor, url, timeout, response_headers):
+    cleaned_url = clean_url(url)
+
+    cached_data = None
+    request_headers = {}
+    if config.CACHE_ENABLED:
+        cached_data = await loop.run_in_executor(executor, cache.get_cached_file_content, cleaned_url, config.DB_CACHE_PATH)
+        if cached_data is not None:
+            conditional_headers = await loop.run_in_executor(executor, cache.get_revalidation_headers, cleaned_url, config.DB_CACHE_PATH)
+            if conditional_headers is None:
+                content, content_type = cached_data
+                debug(f"cleaned_url {cleaned_url} was retrieved from cache")
+                return cleaned_url, 200, content_type, content, True
+            debug(f"cleaned_url {cleaned_url} cached copy is stale. Revalidating using async http request...")
+            request_headers = conditional_headers
+
+    if cached_data is None:
+        debug(f"cleaned_url {cleaned_url} not found in cache. Retrieving using async http request...")
+    try:
+        async with session.get(url, headers=request_headers, timeout=aiohttp.ClientTimeout(total=timeout)) as response:
+            content = await response.read()
+            content_type = response.headers.get('Content-Type', '')
+            response_headers.update(response.headers)
+            status_code = response.status
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        if cached_data is None:
+            raise
+        error(f"Revalidating {url} failed, using the stale cached copy: {e}")
+        content, content_type = cached_data
+        return cleaned_url, 200, content_type, content, cache.CACHED_AFTER_REQUEST
+
+    if cached_data is not None and status_code == 304:
+        debug(f"cleaned_url {cleaned_url} not modified, using cached copy")
+        await loop.run_in_executor(executor, cache.mark_cache_entry_validated, cleaned_url,
+                                   response_headers.get('ETag'), response_headers.get('Last-Modified'),
+                                   config.DB_CACHE_PATH)
+        content, content_type = cached_data
+        return cleaned_url, 200, content_type, content, cache.CACHED_AFTER_REQUEST
+    if cached_data is not None and status_code >= 500:
+        error(f"Revalidating {url} got status {status_code}, using the stale cached copy")
+        content, content_type = cached_data
+        return cleaned_url, 200, content_type, content, cache.CACHED_AFTER_REQUEST
+    return cleaned_url, status_code, content_type, content, False
+
+
+async def crawl_site_async(start_url, output_dir, max_depth=2, max_pages=-1, refresh_queue=True):
+    init_working_dirs(output_dir)
+    loop = asyncio.get_running_loop()
+    executor = ThreadPoolExecutor(max_workers=config.ASYNC_EXECUTOR_WORKERS)
+
+    # visited tracks the urls we have visited, restored from the last snapshot when resuming
+    visited = visited_store.open_store(resume=refresh_queue)
+
+    # seen_content_hashes tracks the hashed value of the url contents to see if we have seen it before
+    # memory-mapped to disk and reloaded when resuming, its add() is an atomic check-and-insert
+    seen_content_hashes = seen_filter.open_filter(resume=refresh_queue)
+
+    # SimHash index of the saved page texts, None if near-duplicate detection is disabled
+    near_dups = near_dup.open_index(resume=refresh_queue)
+
+    # sitemap and feed discovery of the peers family hosts, None if disabled. The async engine has no crawl
+    # frontier, so a frontier of its own paces the discovery fetches of each host (and backs off on 429s)
+    discovery_hosts = HostFrontier()
+    discoverer = discovery.open_discovery(discovery_hosts)
+
+    # broken link recovery from the Wayback Machine, None if disabled
+    wayback_pool = wayback.open_pool()
+
+    # OCR of scanned PDF pages, None if disabled
+    ocr_pool = ocr.open_pool()
+
+    num_pages_visited = 0
+    next_num_pages_visited_report = config.PROGRESS_REPORT_N_PAGES
+
+    # holds the urls we have not yet visited
+    url_queue = asyncio.Queue()
+    stop_event = asyncio.Event()
+
+    # returns True and records the hash if this content has not been seen before
+    def is_new_content(hash_val):
+        return seen_content_hashes.add(hash_val)
+
+    async def add_url_to_crawl(url, depth_actual, depth_effective):
+        url_queue.put_nowait((url, depth_actual, depth_effective))
+        await loop.run_in_executor(executor, cache.save_pending_url_to_db, url, depth_actual, depth_effective)
+        debug(f"Adding url_to_crawl: {url}")
+
+    # broken link recoveries and site discoveries running in their pools, url_queue.join() does not wait for them
+    background_tasks = set()
+
+    def start_background(coro):
+        task = asyncio.create_task(coro)
+        background_tasks.add(task)
+        task.add_done_callback(background_tasks.discard)
+
+    # queues the children of a broken link once the wayback pool has recovered it
+    async def finish_recovery(url, future):
+        try:
+            for child_url, child_depth_actual, child_depth in await asyncio.wrap_future(future):
+                await add_url_to_crawl(child_url, child_depth_actual, child_depth)
+        except Exception as e:
+            error(f"ERROR EXCEPTION WHILE RECOVERING {url}: {e}")
+
+    # queues the pages listed in the sitemaps and feeds of a host once the discoverer has read them
+    async def finish_discovery(url, future):
+        try:
+            for child_url, child_depth_actual, child_depth in await asyncio.wrap_future(future):
+                await add_url_to_crawl(child_url, child_depth_actual, child_depth)
+        except Exception as e:
+            error(f"ERROR EXCEPTION WHILE DISCOVERING {url}: {e}")
+
+    async def crawl(session, url, depth_actual, depth_effective):
+        nonlocal num_pages_visited
+        nonlocal next_num_pages_visited_report
+
+        is_peers_family = False
+        if config.pattern_peers_family.match(url):
+            depth_effective = 0  # Effective depth is how many hops from home domain(s)
+            is_peers_family = True
+            debug(f"URL is in Home Domain(s): {url}", flush=config.FLUSH_LOG)
+        else:
+            debug(f"URL is NOT in Home Domain(s) {url}", flush=config.FLUSH_LOG)
+
+        # atomic check-and-insert, the same url can be queued more than once before it is crawled
+        if not visited.add(url):
+            debug(f"Skipping already visited url {url}")
+            return
+
+        # StopIteration can't be raised through a coroutine, so signal the stop event directly
+        num_pages_visited = num_pages_visited + 1
+        if max_pages > 0 and num_pages_visited > max_pages:
+            # not crawled, so a resumed crawl must still visit it
+            visited.discard(url)
+            if not stop_event.is_set():
+                print("Maximum pages hit. Stopping crawl.")
+                error("-- Stopping iteration. Max pages hit.")
+                sys.stderr.write("\n-- Stopping iteration. Max pages hit.")
+                stop_event.set()
+            return
+
+        if num_pages_visited > next_num_pages_visited_report:
+            error(f"Webcrawler crawled {num_pages_visited} number of pages.")
+            next_num_pages_visited_report = next_num_pages_visited_report + config.PROGRESS_REPORT_N_PAGES
+
+        # the first page of a peers family host queues the pages listed in its sitemaps and feeds, read in the
+        # discoverer's threads while this worker fetches the page, they are queued by finish_discovery
+        if is_peers_family and discoverer is not None and discoverer.claim(url):
+            start_background(finish_discovery(url, discoverer.submit(discover_site_urls, discoverer, url, visited)))
+
+        print(f"({depth_actual}/{depth_effective}) CRAWLING: {url}", flush=config.FLUSH_LOG)
+
+        try:
+            timeout = config.ASYNC_REQUEST_TIMEOUT_SECS
+            response_headers = CaseInsensitiveDict()
+            cleaned_url, status_code, content_type, content, was_cached = \
+                await get_cached_content_or_async_request(session, loop, executor, url, timeout, response_headers)
+
+            num_retries = 0
+            while status_code == 429 and num_retries < config.RATELIMIT_RETRIES:  # handle relimiting
+                debug(f"Got rate limiting response 429. Will wait and retry for url: {url}")
+                await asyncio.sleep(config.RATELIMIT_RETRY_TIME_SECS)
+                cleaned_url, status_code, content_type, content, was_cached = \
+                    await get_cached_content_or_async_request(session, loop, executor, url, timeout, response_headers)
+                num_retries = num_retries + 1
+            if num_retries >= config.RATELIMIT_RETRIES:
+                error(f"Exceeded allowed number of retries for url: {url}")
+
+            if status_code == 200:
+                # parsing and saving is cpu and disk heavy, keep it off the event loop
+                child_urls = await loop.run_in_executor(
+                    executor, process_page, url, cleaned_url, content_type, content, was_cached, depth_actual,
+                    depth_effective, is_peers_family, output_dir, max_depth, visited, is_new_content, response_headers,
+                    None, near_dups, ocr_pool)
+                for child_url, child_depth_actual, child_depth in child_urls:
+                    if child_url not in visited:
+                        await add_url_to_crawl(child_url, child_depth_actual, child_depth)
+            else:  # status code not 200
+                # archive.org is slow, the broken link is recovered in the wayback pool while this worker
+                # moves on to the next url, its children are queued by finish_recovery
+                future = None
+                if wayback_pool is not None:
+                    future = wayback_pool.submit(recover_broken_link, url, status_code, depth_actual, depth_effective,
+                                                 is_peers_family, output_dir, max_depth, visited, is_new_content,
+                                                 near_dups, ocr_pool)
+                if future is not None:
+                    start_background(finish_recovery(url, future))
+                else:
+                    error(f"Broken link not recovered: {url} (Status: {status_code})")
+        except asyncio.TimeoutError:
+            error(f"ERROR: The request for {url} timed out")
+        except aiohttp.ClientError as e:
+            error(f"ERROR: The request for {url} failed: {e}")
+        except Exception as e:
+            error(f"ERROR EXCEPTION WHILE CRAWLING {url}: {e}")
+
+    async def worker(session, id):
+        while True:
+            url, depth_actual, depth_effective = await url_queue.get()
+            try:
+                if not stop_event.is_set():
+                    await crawl(session, url, depth_actual, depth_effective)
+            finally:
+                url_queue.task_done()
+
+    # loads any pending urls from the last run that haven't been processed yet
+    if refresh_queue:
+        pending_queue = queue.Queue()
+        cache.load_pending_urls_from_db(pending_queue)
+        qsize = pending_queue.qsize()
+        while not pending_queue.empty():
+            url_queue.put_nowait(pending_queue.get_nowait())
+        if qsize > 0:
+            error(f"Pending url_queue was refreshed with {qsize} elements")
+            cache.clear_pending_url_queue_db()
+
+    # group-commit queue and download writes for the rest of the crawl
+    cache.start_batch_writes()
+
+    # adds the initial seed url to crawl
+    await add_url_to_crawl(url_canon.canonicalize(start_url), 0, 0)
+
+    connector = aiohttp.TCPConnector(limit=config.ASYNC_MAX_IN_FLIGHT, limit_per_host=config.ASYNC_LIMIT_PER_HOST,
+                                     ttl_dns_cache=300)
+    async with aiohttp.ClientSession(connector=connector, headers=config.headers) as session:
+        error(f"Starting {config.ASYNC_MAX_IN_FLIGHT} number of async workers...")
+        workers = [asyncio.create_task(worker(session, id)) for id in range(1, config.ASYNC_MAX_IN_FLIGHT + 1)]
+
+        error("Waiting for url_queue to join...")
+        await url_queue.join()
+        # pending recoveries and discoveries can queue more urls
+        while background_tasks:
+            if stop_event.is_set():
+                # the pages are not crawled anyway, unblocks the discovery fetches waiting for their host
+                discovery_hosts.close()
+            await asyncio.gather(*background_tasks)
+            await url_queue.join()
+        stopped_early = stop_event.is_set()
+        stop_event.set()
+
+        for w in workers:
+            w.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+
+    executor.shutdown(wait=True)
+    discovery_hosts.close()
+    if discoverer is not None:
+        discoverer.shutdown()
+    if wayback_pool is not None:
+        wayback_pool.shutdown()
+        error(f"Wayback pool stats: {wayback_pool.stats()}")
+    if ocr_pool is not None:
+        ocr_pool.shutdown()
+        error(f"OCR pool stats: {ocr_pool.stats()}")
+    error("Workers completed.")
+    cache.stop_batch_writes()
+
+    # a finished crawl starts over next time, a stopped one resumes from the snapshot
+    if stopped_early:
+        visited.save()
+        seen_content_hashes.close()
+        if near_dups is not None:
+            near_dups.save()
+    else:
+        visited.delete_snapshot()
+        seen_content_hashes.delete()
+        if near_dups is not None:
+            near_dups.delete_snapshot()
+
+    output_msg = "\n** Async web crawl finished, visited num pages: " + str(num_pages_visited)
+    error(output_msg)  # just stderr
+    error(f"Hot cache stats: {hot_cache.stats()}")
+    error(f"Visited store stats: {visited.stats()}")
+    if discoverer is not None:
+        error(f"Discovery stats: {discoverer.stats()}")
+
+
+# Blocking entry point with the same signature as web_scraper_mt.crawl_site()
+def crawl_site(start_url, output_dir, max_depth=2, max_pages=-1, refresh_queue=True):
+    asyncio.run(crawl_site_async(start_url, output_dir, max_depth, max_pages, refresh_queue))
@@ -1,43 +1,38 @@
 import os
 import re
+from urllib.parse import urljoin
 
+import blob_store
+import cache
 import config
+import content_filter
+import discovery
+import html_pipeline
+import near_dup
+import pdf_fetcher
+import url_canon
+import url_filter
 import utils
+import wayback
 from utils import *
 
 # Check if this url should be processed
 # Note preferable check this prior to recursive call of crawl
+# Runs for every link of every page, so it only formats debug output when debugging is enabled
 def should_visit(url, depth_effective, visited_set):
-    debug(f"Should visit url {url} depth {depth_effective}?", flush=config.FLUSH_LOG)
-
-    if config.pattern_filter_list.search(url):
-        debug(f"Visit declined. Skipping pattern filter list {url}", flush=config.FLUSH_LOG)
-        return False
-
-    if config.pattern_archive_url.match(url):
-        debug(f"Visit declined. Skipping Archive URL {url}", flush=config.FLUSH_LOG)
+    reason = url_filter.classify(url)
+    if reason != url_filter.ACCEPTED:
+        if config.DEBUG_ENABLED:
+            debug(f"Visit declined ({reason}): {url}", flush=config.FLUSH_LOG)
         return False
 
     if url in visited_set:
-        debug(f"Visit declined. Previously visited: {url}", flush=config.FLUSH_LOG)
+        if config.DEBUG_ENABLED:
+            debug(f"Visit declined. Previously visited: {url}", flush=config.FLUSH_LOG)
         return False
 
-    # Don't process image files
-    if (bool(re.search('.jpe+g$', url)) or bool(re.search('.gif$', url)) or bool(re.search('.png$', url))):
-        debug(f"Visit declined. Skipping image: {url}", flush=config.FLUSH_LOG)
-        return False
-
-    # Don't process mailto's
-    if (bool(re.search('^mailto:', url))):
-        debug(f"Visit declined. Skipping mailto: {url}", flush=config.FLUSH_LOG)
-        return False
-
-    # don't process substack comments
-    if utils.is_substack_comment_page(url):
-        debug(f"Visit declined. Referred to substack comment: {url}", flush=config.FLUSH_LOG)
-        return False
-
-    debug(f"Accepted visit url {url} depth {depth_effective}", flush=config.FLUSH_LOG)
+    if config.DEBUG_ENABLED:
+        debug(f"Accepted visit url {url} depth {depth_effective}", flush=config.FLUSH_LOG)
     return True
 
 
@@ -56,9 +51,256 @@ def should_process_child_links(depth_effective, is_peers_family, max_depth):
     return True
 
 
+# Saves fetched content to the corpus, as flat_filename or in the content-addressed blob store if enabled.
+# Returns (url_file_path, url_file_size) of what was written, for the cache entry.
+def save_corpus_content(cleaned_url, content, hash_val, ext, flat_filename):
+    if config.CORPUS_BLOB_STORE_ENABLED:
+        blob_path, blob_size = blob_store.put_blob(hash_val, content, ext)
+        cache.save_url_blob(cleaned_url, hash_val, blob_path, blob_size, ext)
+        return blob_path, blob_size
+    save_resp_content(content, flat_filename)
+    return flat_filename, os.path.getsize(flat_filename)
+
+
+# CPU-bound part of the html processing: parses the page once, hashes it, reads its links and
+# extracts its text and the text's SimHash (only if want_text). Picklable, so it can run in the extract process pool.
+# If is_new_content is given (inline runs only) the text is not extracted for already seen content.
+# Returns (hash_val, html_content, hrefs, title, text, text_fp), html_content is None if the page was rejected
+# by is_new_content and hash_val is None too if it could not be parsed.
+def extract_html(content, want_text, is_new_content=None):
+    page = html_pipeline.parse_html(content)
+    if page is None:
+        return None, None, None, None, None, None
+    html_pipeline.body_adjustments(page)
+    html_content = page.html_bytes
+    hash_val = hash_html_content(html_content)
+    if is_new_content is not None and not is_new_content(hash_val):
+        return hash_val, None, None, None, None, None
+
+    # read the links before the text extraction, which cleans the tree in place
+    hrefs = html_pipeline.extract_links(page)
+    title, text, text_fp = None, None, None
+    if want_text:
+        title, text = content_filter.extract_content_newspaper(html_content, page)
+        if config.NEAR_DUP_ENABLED:
+            text_fp = near_dup.text_fingerprint(text)
+    return hash_val, html_content, hrefs, title, text, text_fp
+
+
+# Handles a fetched page with status 200: saves it to the corpus, updates the cache and
+# returns the list of (child_url, depth_actual, depth_effective) entries that should be crawled next.
+# is_new_content is called with the content hash and returns False if that content was already seen.
+# If extract_pool (an extract_pool.ExtractPool) is given, parsing and text extraction run in its processes.
+# If ocr_pool (an ocr.OcrPool) is given, the pages of PDFs without a text layer are OCRed in the background.
+# If near_dup_index (a near_dup.NearDupIndex) is given, new html pages whose text is a near duplicate
+# of an already saved page are not saved.
+# Shared by all crawl engines so that they save identical corpus output.
+def process_page(url, cleaned_url, content_type, content, was_cached, depth_actual, depth_effective,
+                 is_peers_family, output_dir, max_depth, visited_set, is_new_content, response_headers=None,
+                 extract_pool=None, near_dup_index=None, ocr_pool=None):
+    child_urls = []
+
+    # validators stored with the cache entry so it can be revalidated later
+    etag, last_modified = None, None
+    if response_headers is not None:
+        etag, last_modified = response_headers.get('ETag'), response_headers.get('Last-Modified')
+
+    if config.ENABLE_PROCESS_PDFS and 'application/pdf' in content_type:
+        print(f"File appears to be PDF {url}", flush=config.FLUSH_LOG)
+
+        pdf_output_path = os.path.join(output_dir, cleaned_url.replace('/', '_') + '.pdf')
+        pdf_output_txt_filename = pdf_output_path.replace('.pdf', '.txt')
+
+        # identical PDFs are often linked under several urls
+        hash_val = hash_bytes(content)
+        if not is_new_content(hash_val):
+            debug(f"Already seen content url: {url}. No more processing done.")
+            return child_urls
+
+        if was_cached and os.path.exists(pdf_output_txt_filename):
+            debug(f"Skipped url {cleaned_url} for corpus collection because it was already in cache.")
+            return child_urls
+
+        # Step 1: Save the PDF bytes we already fetched (only written once, never downloaded twice)
+        if not was_cached:
+            debug(f"SAVE pdf filename: {pdf_output_path}", flush=config.FLUSH_LOG)
+            url_file_path, url_file_size = save_corpus_content(cleaned_url, content, hash_val, 'pdf', pdf_output_path)
+
+        # Step 2: Extract text from the PDF in memory, each page is written to the txt file as it is extracted
+        print(f"Save PDF-to-text: {pdf_output_txt_filename}", flush=config.FLUSH_LOG)
+        if extract_pool is not None:
+            _, ocr_pages = pdf_fetcher.extract_clean_pdf_text_parallel(content, pdf_output_txt_filename, extract_pool)
+        else:
+            _, ocr_pages = pdf_fetcher.extract_clean_pdf_text_to_file(content, pdf_output_txt_filename)
+
+        # save cache metadata entry
+        if config.CACHE_ENABLED and not was_cached:
+            txt_file_size = os.path.getsize(pdf_output_txt_filename)
+            cache.update_cache(cleaned_url, 'application/pdf', url_file_path, url_file_size,
+                               pdf_output_txt_filename, txt_file_size, hash_val, etag=etag, last_modified=last_modified)
+
+        # Step 3: scanned pages are OCRed in the background, the txt file (and its size in the cache entry)
+        # is written again when they are done
+        if ocr_pages:
+            print(f"PDF has {len(ocr_pages)} pages without text: {url}", flush=config.FLUSH_LOG)
+            cache_url = cleaned_url if config.CACHE_ENABLED else None
+            if ocr_pool is None or \
+                    ocr_pool.submit(content, hash_val, pdf_output_txt_filename, ocr_pages, cache_url) is None:
+                error(f"Pages without text not OCRed: {url}")
+
+    elif 'text/html' in content_type:
+        debug(f"File appears to be HTML {url}", flush=config.FLUSH_LOG)
+        if was_cached:
+            # if cached, the text is only needed to regenerate a missing txt file
+            want_text = not os.path.exists(os.path.join(output_dir, cleaned_url.replace('/', '_') + '.txt'))
+        else:
+            want_text = config.SAVE_HTML_CONTENT
+
+        # hash contents and compare if we need to process this page
+        if extract_pool is not None:
+            hash_val, html_content, hrefs, title, text, text_fp = extract_pool.run(extract_html, content, want_text)
+            if hash_val is not None and not is_new_content(hash_val):
+                html_content = None
+        else:
+            hash_val, html_content, hrefs, title, text, text_fp = extract_html(content, want_text, is_new_content)
+        if hash_val is None:
+            error(f"Failed to parse html of url: {url}")
+            return child_urls
+        if html_content is None:
+            debug(f"Already seen content url: {url}. No more processing done.")
+            return child_urls
+        debug(f"Adding hash {hash_val} to seen content for url: {url}")
+
+        # pages that differ from a saved one only by a date, counter or ad slot are not saved again
+        near_dup_fp = None
+        if near_dup_index is not None and text_fp is not None and not was_cached:
+            near_dup_fp = near_dup_index.add_if_new(text_fp)
+
+        # Save the page to the corpus
+        if near_dup_fp is not None:
+            distance = near_dup.hamming_distance(text_fp, near_dup_fp)
+            debug(f"Near duplicate content url: {url} (distance {distance}). Not saved to the corpus.")
+        elif not was_cached:
+            debug(f"Processing url {cleaned_url} for corpus collection")
+            filename = os.path.join(output_dir, cleaned_url.replace('/', '_') + '.html')
+            if config.SAVE_HTML_CONTENT:
+                # save html content
+                debug(f"SAVE page filename: {filename}", flush=config.FLUSH_LOG)
+                url_file_path, url_file_size = save_corpus_content(cleaned_url, html_content, hash_val, 'html', filename)
+
+                txt_filename = filename.replace('.html', '.txt')
+                txt_file_saved = utils.save_txt_to_file(txt_filename, title, text)
+
+                # save cache metadata entry
+                if config.CACHE_ENABLED:
+                    txt_file_size = 0
+                    if txt_file_saved:
+                        txt_file_size = os.path.getsize(txt_filename)
+
+                    cache.update_cache(cleaned_url, 'text/html', url_file_path, url_file_size, txt_filename, txt_file_size, hash_val,
+                                       etag=etag, last_modified=last_modified)
+            else:
+                debug(f"MARK page filename: {filename}", flush=config.FLUSH_LOG)
+        else:
+            # if cached, lets check if we need to regenerate the txt file if it doesn't exist
+            txt_filename = os.path.join(output_dir, cleaned_url.replace('/', '_') + '.txt')
+            if not os.path.exists(txt_filename):
+                error(f"Regenerating {txt_filename}")
+                utils.save_txt_to_file(txt_filename, title, text)
+            else:
+                debug(f"Not Regenerating {txt_filename}")
+            debug(f"Skipped url {cleaned_url} for corpus collection because it was already in cache.")
+
+        # Crawl internal and external links
+        child_depth = depth_effective + 1
+        if should_process_child_links(child_depth, is_peers_family, max_depth):
+            debug(f"Processing child links for {url}", flush=config.FLUSH_LOG)
+            for href in hrefs:
+                child_url = urljoin(url, href)
+
+                # one form per page: no #fragment, no tracking parameters, sorted query (see url_canon.py)
+                child_url = url_canon.canonicalize(child_url)
+
+                # if full_url not in visited and full_url <> url:
+                # Previous - if full_url not in visited:
+                if should_visit(child_url, child_depth, visited_set):
+                    print(f"ADD_TO_CRAWL:({depth_actual}/{depth_effective}) Parent: '{url}' Child: '{child_url}'",
+                          flush=config.FLUSH_LOG)
+                    child_urls.append((child_url, depth_actual + 1, child_depth))
+        else:
+            debug(f"Skipping of child links for {url}", flush=config.FLUSH_LOG)
+
+    elif 'application/xml' in content_type or 'text/xml' in content_type or '+xml' in content_type:
+        debug(f"File appears to be XML {url}", flush=config.FLUSH_LOG)
+        # sitemaps and feeds list pages to crawl
+        child_depth = depth_effective + 1
+        kind, entries = discovery.parse_discovery_xml(content, url)
+        if kind is not None and should_process_child_links(child_depth, is_peers_family, max_depth):
+            debug(f"Processing {kind} urls of {url}", flush=config.FLUSH_LOG)
+            for child_url, _ in entries:
+                child_url = url_canon.canonicalize(child_url)
+                if should_visit(child_url, child_depth, visited_set):
+                    child_urls.append((child_url, depth_actual + 1, child_depth))
+    elif 'text/css' in content_type:
+        debug(f"File appears to be CSS {url}", flush=config.FLUSH_LOG)
+    elif 'application/javascript' in content_type or 'text/javascript' in content_type:
+        debug(f"File appears to be Javascript {url}", flush=config.FLUSH_LOG)
+    elif 'image/jpeg' in content_type:
+        debug(f"File appears to be JPEG image {url}", flush=config.FLUSH_LOG)
+    elif 'image/png' in content_type:
+        debug(f"File appears to be PNG image {url}", flush=config.FLUSH_LOG)
+    elif 'image/gif' in content_type:
+        debug(f"File appears to be GIF image {url}", flush=config.FLUSH_LOG)
+    elif 'application/vnd.ms-powerpoint' in content_type:
+        debug(f"File appears to be PPT Powerpoint {url}", flush=config.FLUSH_LOG)
+    else:  # Unknown type
+        debug(f"SKIPPING NOT HTML/PDF/XML: {url}", flush=config.FLUSH_LOG)
+        # endif content_type
+
+    return child_urls
+
+
+# Runs the sitemap and feed discovery (see discovery.py) of the host of url, call it once per host (discoverer.claim).
+# Cached pages that changed since they were downloaded are dropped from the cache so they are fetched again.
+# Returns the list of (url, depth_actual, depth_effective) entries that should be crawled next.
+def discover_site_urls(discoverer, url, visited_set):
+    child_urls = []
+    num_expired = 0
+    for child_url, lastmod in discoverer.discover(url):
+        child_url = url_canon.canonicalize(child_url)
+        if not should_visit(child_url, 1, visited_set):
+            continue
+        if lastmod is not None and config.CACHE_ENABLED and cache.expire_if_modified(clean_url(child_url), lastmod):
+            num_expired += 1
+        child_urls.append((child_url, 1, 1))
+    if num_expired > 0:
+        error(f"Discovery found {num_expired} changed pages of {url} to fetch again")
+    return child_urls
+
+
+# Handles a page that did not return status 200 by fetching its closest Wayback Machine snapshot (see wayback.py),
+# which is saved and cached under url like a fetched page. Runs in the wayback.WaybackPool of the crawl.
+# Returns the list of (child_url, depth_actual, depth_effective) entries that should be crawled next.
+def recover_broken_link(url, status_code, depth_actual, depth_effective, is_peers_family, output_dir, max_depth,
+                        visited_set, is_new_content, near_dup_index=None, ocr_pool=None):
+    print(f"Broken link: {url} (Status: {status_code})", flush=config.FLUSH_LOG)
+    archived = wayback.fetch_archived(url)
+    if archived is None:
+        error(f"ERROR: No archived version found for: {url}")
+        return []
+
+    archived_url, content_type, content = archived
+    print(f"Retrieved archived version from: {archived_url}", flush=config.FLUSH_LOG)
+    return process_page(url, clean_url(url), content_type, content, False, depth_actual, depth_effective,
+                        is_peers_family, output_dir, max_depth, visited_set, is_new_content,
+                        near_dup_index=near_dup_index, ocr_pool=ocr_pool)
+
+
 # make sure all artifact dirs exists
 def init_working_dirs(output_dir):
     os.makedirs(output_dir, exist_ok=True)
+    if config.CORPUS_BLOB_STORE_ENABLED:
+        os.makedirs(config.BLOB_STORE_LOCATION, exist_ok=True)
     os.makedirs(config.LOGS_FOLDER_LOCATION, exist_ok=True)
     os.makedirs(config.DB_CACHE_LOCATION, exist_ok=True)
 
@@ -6,23 +6,36 @@ import queue
 import threading
 import time
 
+import browser_pool
 import cache
+import discovery
 import config
-from pybloom_live import BloomFilter
+import hot_cache
+import http_session
+import near_dup
+import ocr
+import seen_filter
+import url_canon
+import visited_store
+import wayback
 
 import content_filter
 import pdf_fetcher
 import os
 import re
+import requests
 import fitz  # PyMuPDF
 import sys
 
 import utils
+import web_scraper_async
 import web_scraper_old
 from utils import *
 from bs4 import BeautifulSoup
 from urllib.parse import urljoin
-from queue import Queue
+from extract_pool import ExtractPool
+from host_scheduler import HostFrontier
+from requests.structures import CaseInsensitiveDict
 from web_scraper_base import *
 
 # Set the number of multithreaded workers here
@@ -32,26 +45,46 @@ NUM_WORKERS = 12
 def crawl_site(start_url, output_dir, max_depth=2, max_pages=-1, refresh_queue=True):
     init_working_dirs(output_dir)
 
-    # visited tracks the urls we have visited
-    visited = set()
-    visited_lock = threading.Lock()
+    # visited tracks the urls we have visited, restored from the last snapshot when resuming
+    visited = visited_store.open_store(resume=refresh_queue)
 
     # seen_content_hashes tracks the hashed value of the url contents to see if we have seen it before
-    seen_content_hashes = BloomFilter(capacity=1_000_000, error_rate=0.00001)
-    seen_content_hashes_lock = threading.Lock()
+    # memory-mapped to disk and reloaded when resuming, its add() is an atomic check-and-insert
+    seen_content_hashes = seen_filter.open_filter(resume=refresh_queue)
+
+    # SimHash index of the saved page texts, None if near-duplicate detection is disabled
+    near_dups = near_dup.open_index(resume=refresh_queue)
+
+    # broken link recovery from the Wayback Machine, None if disabled
+    wayback_pool = wayback.open_pool()
+
+    # OCR of scanned PDF pages, None if disabled
+    ocr_pool = ocr.open_pool()
 
     num_pages_visited = 0
     num_pages_visited_lock = threading.Lock()
     next_num_pages_visited_report = config.PROGRESS_REPORT_N_PAGES
 
-    # holds the urls we have not yet visited
-    url_queue = Queue()
+    # holds the urls we have not yet visited, best first, with one politeness-scheduled sub-queue per host
+    url_queue = HostFrontier()
     stop_event = threading.Event()
 
+    # sitemap and feed discovery of the peers family hosts, None if disabled. Runs in its own threads,
+    # its fetches wait for the host's politeness delay in url_queue.
+    discoverer = discovery.open_discovery(url_queue)
+
+    # fetched pages waiting for the extraction stage, fetch workers block when it is full
+    extract_pool = None
+    process_queue = queue.Queue(maxsize=config.EXTRACT_QUEUE_SIZE)
+    if config.EXTRACT_PROCESS_POOL_ENABLED:
+        extract_pool = ExtractPool()
+
 
     def stop_crawl(id):
         error(f"Worker {id} signaled to stop the crawl")
         stop_event.set()
+        # wakes up the main thread in url_queue.join() and all idle workers
+        url_queue.close()
 
 
     def worker(id):
@@ -61,22 +94,18 @@ def crawl_site(start_url, output_dir, max_depth=2, max_pages=-1, refresh_queue=T
                 debug(f"Worker id got stop event{id}")
                 break
 
-            try:
-                url, depth_actual, depth_effective = url_queue.get(timeout=1)
-            except queue.Empty:
-                # error(f"Worker {id} got empty")
-                time.sleep(1.0)
-                continue
+            # blocks until a host has work that may be fetched now, or the queue is closed
+            url, depth_actual, depth_effective = url_queue.get()
+            if url is None:
+                debug(f"Worker id got queue shutdown {id}")
+                break
 
+            handed_off = False
             try:
-                if url is None:
-                    debug(f"Worker id got queue shutdown {id}")
-                    break
-
                 debug(f"Worker {id} got work {url}")
 
                 if not stop_event.is_set():
-                    crawl(url, depth_actual, depth_effective)
+                    handed_off = crawl(url, depth_actual, depth_effective)
 
             except StopIteration:
                 # only need to output this once
@@ -88,40 +117,84 @@ def crawl_site(start_url, output_dir, max_depth=2, max_pages=-1, refresh_queue=T
                 error(f"Worker id {id} got runtime exception: {e}")
                 break
             finally:
-                url_queue.task_done()
+                # pages handed to the extraction stage are finished there
+                if not handed_off:
+                    url_queue.task_done(url)
 
         if not stop_event.is_set():
             stop_crawl(id)
 
+        # playwright browsers belong to the thread that launched them
+        browser_pool.release_thread()
         debug(f"Finished worker id {id}")
 
+    # extraction stage, keeps one extract_pool process busy until it gets the None sentinel
+    def extractor(id):
+        debug(f"Extractor id {id} started")
+        while True:
+            page = process_queue.get()
+            if page is None:
+                break
+            try:
+                process_fetched_page(*page)
+            except Exception as e:
+                error(f"ERROR EXCEPTION WHILE PROCESSING {page[0]}: {e}")
+            finally:
+                url_queue.task_done(page[0], release_host=False)
+        debug(f"Finished extractor id {id}")
+
+    def process_fetched_page(url, cleaned_url, content_type, content, was_cached, depth_actual, depth_effective,
+                             is_peers_family, response_headers):
+        child_urls = process_page(url, cleaned_url, content_type, content, was_cached, depth_actual, depth_effective,
+                                  is_peers_family, output_dir, max_depth, visited, is_new_content, response_headers,
+                                  extract_pool, near_dups, ocr_pool)
+        for child_url, child_depth_actual, child_depth in child_urls:
+            add_url_to_crawl(child_url, child_depth_actual, child_depth)
+
     def add_url_to_crawl(url, depth_actual, depth_effective):
-        url_queue.put((url, depth_actual, depth_effective))
-        cache.save_pending_url_to_db(url, depth_actual, depth_effective)
+        priority = url_queue.put((url, depth_actual, depth_effective))
+        cache.save_pending_url_to_db(url, depth_actual, depth_effective, priority)
         debug(f"Adding url_to_crawl: {url}")
 
+    # returns True and records the hash if this content has not been seen before
+    def is_new_content(hash_val):
+        return seen_content_hashes.add(hash_val)
+
     def finalize_url_to_crawl(url):
         cache.delete_pending_url_from_db(url)
         debug(f"Finalized url_to_crawl: {url}")
 
-    def queue_join_with_timeout(timeout=1.0):
-        nonlocal num_pages_visited
-        nonlocal next_num_pages_visited_report
-
-        """Wait for queue to be empty or stop_event to be set."""
-        while url_queue.unfinished_tasks > 0:
-            with num_pages_visited_lock:
-                if num_pages_visited > 0 and num_pages_visited > next_num_pages_visited_report:
-                    error(f"Webcrawler crawled {num_pages_visited} number of pages.")
-                    next_num_pages_visited_report = next_num_pages_visited_report + config.PROGRESS_REPORT_N_PAGES
+    # done callback of a broken link recovery in the wayback pool
+    def finish_recovery(url, future):
+        try:
+            for child_url, child_depth_actual, child_depth in future.result():
+                add_url_to_crawl(child_url, child_depth_actual, child_depth)
+        except Exception as e:
+            error(f"ERROR EXCEPTION WHILE RECOVERING {url}: {e}")
+        finally:
+            url_queue.task_done(url, release_host=False)
 
-            if stop_event.is_set():
-                break
+    # done callback of a site discovery
+    def finish_discovery(url, future):
+        try:
+            for child_url, child_depth_actual, child_depth in future.result():
+                add_url_to_crawl(child_url, child_depth_actual, child_depth)
+        except Exception as e:
+            error(f"ERROR EXCEPTION WHILE DISCOVERING {url}: {e}")
+        finally:
+            url_queue.task_done(url, release_host=False)
 
-            time.sleep(timeout)
+    # progress callback, crawl calls it with the page count for every page it counts
+    def report_progress(num_pages):
+        nonlocal next_num_pages_visited_report
+        if num_pages > next_num_pages_visited_report:
+            error(f"Webcrawler crawled {num_pages} number of pages.")
+            error(f"HTTP connection stats: {http_session.get_connection_stats()}")
+            next_num_pages_visited_report = next_num_pages_visited_report + config.PROGRESS_REPORT_N_PAGES
 
 
     # crawl should process only already filtered urls
+    # Returns True if the page was handed to the extraction stage or the wayback pool, which then call task_done for it
     def crawl(url, depth_actual, depth_effective):
         nonlocal num_pages_visited
 
@@ -133,14 +206,28 @@ def crawl_site(start_url, output_dir, max_depth=2, max_pages=-1, refresh_queue=T
         else:
             debug(f"URL is NOT in Home Domain(s) {url}", flush=config.FLUSH_LOG)
 
+        # atomic check-and-insert, the same url can be queued more than once before it is crawled
+        if not visited.add(url):
+            debug(f"Skipping already visited url {url}")
+            # nothing was fetched, give back the host's politeness delay
+            url_queue.record_response(url, 0, was_cached=True)
+            return False
+
         with num_pages_visited_lock:
             num_pages_visited = num_pages_visited + 1
             if max_pages > 0 and num_pages_visited > max_pages:
+                # not crawled, so a resumed crawl must still visit it
+                visited.discard(url)
                 print("Maximum pages hit. Stopping crawl.")
                 raise StopIteration("Maximum pages hit")
+            report_progress(num_pages_visited)
 
-        debug(f"Adding {url} to visited set")
-        visited.add(url)
+        # the first page of a peers family host queues the pages listed in its sitemaps and feeds,
+        # discovered in the background while the page is crawled
+        if is_peers_family and discoverer is not None and discoverer.claim(url):
+            url_queue.add_task()
+            future = discoverer.submit(discover_site_urls, discoverer, url, visited)
+            future.add_done_callback(lambda f: finish_discovery(url, f))
 
         print(f"({depth_actual}/{depth_effective}) CRAWLING: {url}", flush=config.FLUSH_LOG)
 
@@ -154,146 +241,52 @@ def crawl_site(start_url, output_dir, max_depth=2, max_pages=-1, refresh_queue=T
             was_cached = False
 
             # uses http requests library to fetch
+            response_headers = CaseInsensitiveDict()
+            fetch_start_time = time.monotonic()
             if config.CRAWLER_FETCH_STRATEGY == config.CRAWLER_FETCH_REQUESTS:
-                cleaned_url, status_code, content_type, content, was_cached = cache.get_cached_content_or_request(url, headers=config.headers, timeout=15)
+                cleaned_url, status_code, content_type, content, was_cached = cache.get_cached_content_or_request(url, headers=config.headers, timeout=15, response_headers=response_headers)
             # uses playwright library to fetch
             elif config.CRAWLER_FETCH_STRATEGY == config.CRAWLER_FETCH_PLAYWRIGHT:
-                    cleaned_url, status_code, content_type, content, was_cached = cache.get_cached_content_or_playwright_request(url, headers=config.headers, timeout=60000)
+                    cleaned_url, status_code, content_type, content, was_cached = cache.get_cached_content_or_playwright_request(url, headers=config.headers, timeout=60000, response_headers=response_headers)
             else:
                 raise Exception("Crawl failed due to unknown fetch strategy")
 
-            num_retries = 0
-            while status_code == 429 and num_retries < config.RATELIMIT_RETRIES:  # handle relimiting
-                debug(f"Got rate limiting response 429. Will wait and retry for url: {url}")
-                cleaned_url, status_code, content_type, content, was_cached = cache.get_cached_content_or_playwright_request(url, headers=config.headers, timeout=60000)
-                time.sleep(config.RATELIMIT_RETRY_TIME_SECS)
-                num_retries = num_retries + 1
-            if num_retries >= config.RATELIMIT_RETRIES:
+            # feed latency and throttling back into the per-host limits, revalidated cached copies were requested
+            url_queue.record_response(url, status_code, latency=time.monotonic() - fetch_start_time,
+                                      retry_after=response_headers.get('Retry-After'),
+                                      was_cached=was_cached is True)
+
+            # handle ratelimiting, the frontier backs off this host while workers move on to other hosts
+            if status_code == 429:
+                if url_queue.retry_later((url, depth_actual, depth_effective)):
+                    debug(f"Got rate limiting response 429. Rescheduled url: {url}")
+                    with num_pages_visited_lock:
+                        num_pages_visited = num_pages_visited - 1
+                    visited.discard(url)
+                    return
                 error(f"Exceeded allowed number of retries for url: {url}")
 
             if status_code == 200:
-                if config.ENABLE_PROCESS_PDFS and 'application/pdf' in content_type:
-                    print(f"File appears to be PDF {url}", flush=config.FLUSH_LOG)
-
-                    pdf_output_path = os.path.join(output_dir, cleaned_url.replace('/', '_') + '.pdf')
-                    pdf_output_txt_filename = pdf_output_path.replace('.pdf', '.txt')
-                    print(f"Save PDF-to-text: {pdf_output_txt_filename}", flush=config.FLUSH_LOG)
-
-                    # Step 1: Download the PDF
-                    pdf_fetcher.download_pdf(url, pdf_output_path)
-
-                    # Step 2: Extract text from the PDF
-                    #title, extracted_text = pdf_fetcher.extract_text_from_pdf(pdf_output_path)
-                    title, extracted_text = pdf_fetcher.extract_clean_pdf_text(pdf_output_path)
-
-                    # Step 3: Save the extracted text to a file
-                    pdf_fetcher.save_text_to_file(title, extracted_text, pdf_output_txt_filename)
-
-                elif 'text/html' in content_type:
-                    debug(f"File appears to be HTML {url}", flush=config.FLUSH_LOG)
-                    soup = BeautifulSoup(content, 'html.parser')
-                    utils.body_adjustments(soup)
-                    soup_content = soup.prettify().encode()
-
-                    # hash contents and compare if we need to process this page
-                    hash_val = hash_html_content(soup_content)
-                    if already_seen(seen_content_hashes, hash_val):
-                        debug(f"Already seen content url: {url}. No more processing done.")
-                        return
-                    debug(f"Adding hash {hash_val} to seen content for url: {url}")
-                    seen_content_hashes.add(hash_val)
-
-                    # Save the page to the corpus
-                    if not was_cached:
-                        debug(f"Processing url {cleaned_url} for corpus collection")
-                        filename = os.path.join(output_dir, cleaned_url.replace('/', '_') + '.html')
-                        if config.SAVE_HTML_CONTENT:
-                            # save html content
-                            debug(f"SAVE page filename: {filename}", flush=config.FLUSH_LOG)
-                            save_resp_content(soup_content, filename)
-
-                            txt_filename = filename.replace('.html', '.txt')
-                            txt_file_saved = utils.save_txt_content_to_file(txt_filename, soup_content)
-
-                            # save cache metadata entry
-                            if config.CACHE_ENABLED:
-                                url_file_size = os.path.getsize(filename)
-
-                                txt_file_size = 0
-                                if txt_file_saved:
-                                    txt_file_size = os.path.getsize(txt_filename)
-
-                                cache.update_cache(cleaned_url, 'text/html', filename, url_file_size, txt_filename, txt_file_size, hash_val)
-                        else:
-                            debug(f"MARK page filename: {filename}", flush=config.FLUSH_LOG)
-                    else:
-                        # if cached, lets check if we need to regenerate the txt file if it doesn't exist
-                        txt_filename = os.path.join(output_dir, cleaned_url.replace('/', '_') + '.txt')
-                        if not os.path.exists(txt_filename):
-                            error(f"Regenerating {txt_filename}")
-                            utils.save_txt_content_to_file(txt_filename, soup_content)
-                        else:
-                            debug(f"Not Regenerating {txt_filename}")
-                        debug(f"Skipped url {cleaned_url} for corpus collection because it was already in cache.")
-
-
-                    # Crawl internal and external links
-                    child_depth = depth_effective + 1
-                    if should_process_child_links(child_depth, is_peers_family, max_depth):
-                        debug(f"Processing child links for {url}", flush=config.FLUSH_LOG)
-                        for link in soup.find_all('a', href=True):
-                            child_url = urljoin(url, link['href'])
-
-                            # Remove the hash and the following alphanumeric (or dash) characters at the end of the string (if any)
-                            child_url = re.sub(config.pattern_hash_url, '', child_url)
-
-                            # if full_url not in visited and full_url <> url:
-                            # Previous - if full_url not in visited:
-                            if should_visit(child_url, child_depth, visited):
-                                print(f"ADD_TO_CRAWL:({depth_actual}/{depth_effective}) Parent: '{url}' Child: '{child_url}'",
-                                      flush=config.FLUSH_LOG)
-                                add_url_to_crawl(child_url, depth_actual + 1, child_depth)
-                    else:
-                        debug(f"Skipping of child links for {url}", flush=config.FLUSH_LOG)
-
-                elif 'application/xml' in content_type or 'text/xml' in content_type:
-                    debug(f"File appears to be XML {url}", flush=config.FLUSH_LOG)
-                elif 'text/css' in content_type:
-                    debug(f"File appears to be CSS {url}", flush=config.FLUSH_LOG)
-                elif 'application/javascript' in content_type or 'text/javascript' in content_type:
-                    debug(f"File appears to be Javascript {url}", flush=config.FLUSH_LOG)
-                elif 'image/jpeg' in content_type:
-                    debug(f"File appears to be JPEG image {url}", flush=config.FLUSH_LOG)
-                elif 'image/png' in content_type:
-                    debug(f"File appears to be PNG image {url}", flush=config.FLUSH_LOG)
-                elif 'image/gif' in content_type:
-                    debug(f"File appears to be GIF image {url}", flush=config.FLUSH_LOG)
-                elif 'application/vnd.ms-powerpoint' in content_type:
-                    debug(f"File appears to be PPT Powerpoint {url}", flush=config.FLUSH_LOG)
-                else:  # Unknown type
-                    debug(f"SKIPPING NOT HTML/PDF/XML: {url}", flush=config.FLUSH_LOG)
-                    # endif content_type
+                page = (url, cleaned_url, content_type, content, was_cached, depth_actual, depth_effective,
+                        is_peers_family, response_headers)
+                if extract_pool is not None:
+                    # the host slot is free for the next fetch while the page is being extracted
+                    process_queue.put(page)
+                    url_queue.release_host(url)
+                    return True
+                process_fetched_page(*page)
 
             else:  # status code not 200
-                # Handle broken link
-                print(f"Broken link: {url} (Status: {status_code})", flush=config.FLUSH_LOG)
-                archived_url = get_wayback_url(url)
-                if archived_url:
-                    print(f"Retrieving archived version from: {archived_url}", flush=config.FLUSH_LOG)
-                    cleaned_url = archived_url.replace('https://', '')
-                    cleaned_url = cleaned_url.replace('http://', '')
-                    cleaned_url = cleaned_url.rstrip('/')
-                    cleaned_url = cleaned_url.replace('?', 'QQ')
-                    cleaned_url = cleaned_url.replace('=', 'EQ')
-                    cleaned_url = cleaned_url.replace('&', 'AMP')
-                    download_url(archived_url, os.path.join(output_dir, "archived_" + cleaned_url.replace('/',
-                                                                                                          '_')))  # handle html or pdf?
-                    #download_url(archived_url, os.path.join(output_dir, "archived_" + clean_url.replace('/', '_') + '.html'))
-                    # Unless it's a PDF and not an HTML file ???
-                    debug("Fetched archive url {url}")
-                else:
-                    error(f"ERROR: No archived version found for: {url}")
-                # endif for if archived
+                # archive.org is slow, the broken link is recovered in the wayback pool (which calls task_done)
+                if wayback_pool is not None:
+                    future = wayback_pool.submit(recover_broken_link, url, status_code, depth_actual, depth_effective,
+                                                 is_peers_family, output_dir, max_depth, visited, is_new_content,
+                                                 near_dups, ocr_pool)
+                    if future is not None:
+                        url_queue.release_host(url)
+                        future.add_done_callback(lambda f: finish_recovery(url, f))
+                        return True
+                error(f"Broken link not recovered: {url} (Status: {status_code})")
             # endif for status code 200
         except requests.exceptions.Timeout:
             error(f"ERROR: The request for {url} timed out")
@@ -301,6 +294,7 @@ def crawl_site(start_url, output_dir, max_depth=2, max_pages=-1, refresh_queue=T
             raise  # max pages hit
         except Exception as e:
             error(f"ERROR EXCEPTION WHILE CRAWLING {url}: {e}")
+        return False
 
 
     # start the initial crawl
@@ -312,14 +306,17 @@ def crawl_site(start_url, output_dir, max_depth=2, max_pages=-1, refresh_queue=T
 
     # loads any pending urls from the last run that haven't been processed yet
     if refresh_queue:
-        cache.load_pending_urls_from_db(url_queue)
+        cache.load_pending_urls_from_db(url_queue, restore_priority=True)
         qsize = url_queue.qsize()
         if qsize > 0:
             error(f"Pending url_queue was refreshed with {qsize} elements")
             cache.clear_pending_url_queue_db()
 
+    # group-commit queue and download writes for the rest of the crawl
+    cache.start_batch_writes()
+
     # adds the initial seed url to crawl
-    add_url_to_crawl(start_url, 0, 0)
+    add_url_to_crawl(url_canon.canonicalize(start_url), 0, 0)
 
     id = 1
     threads = []
@@ -331,10 +328,21 @@ def crawl_site(start_url, output_dir, max_depth=2, max_pages=-1, refresh_queue=T
         id = id + 1
         threads.append(t)
 
+    extractors = []
+    if extract_pool is not None:
+        error(f"Starting {extract_pool.num_processes} number of extractor threads...")
+        for extractor_id in range(1, extract_pool.num_processes + 1):
+            t = threading.Thread(target=extractor, args=(extractor_id, ), daemon=False)
+            t.start()
+            extractors.append(t)
+
     error("Waiting for url_queue to join...")
-    queue_join_with_timeout()
+    url_queue.join()
 
+    # done (or stopped), release the workers waiting in url_queue.get()
+    stopped_early = stop_event.is_set()
     stop_event.set()
+    url_queue.close()
 
     error("Waiting for worker threads to join...")
     for t in threads:
@@ -342,8 +350,44 @@ def crawl_site(start_url, output_dir, max_depth=2, max_pages=-1, refresh_queue=T
 
     error("Workers completed.")
 
+    # the extractors finish the pages still queued before they see the sentinel
+    for _ in extractors:
+        process_queue.put(None)
+    for t in extractors:
+        t.join()
+    if extract_pool is not None:
+        error(f"Extract pool stats: {extract_pool.stats()}")
+        extract_pool.shutdown()
+    if discoverer is not None:
+        discoverer.shutdown()
+    if wayback_pool is not None:
+        wayback_pool.shutdown()
+        error(f"Wayback pool stats: {wayback_pool.stats()}")
+    if ocr_pool is not None:
+        ocr_pool.shutdown()
+        error(f"OCR pool stats: {ocr_pool.stats()}")
+
+    cache.stop_batch_writes()
+
+    # a finished crawl starts over next time, a stopped one resumes from the snapshot
+    if stopped_early:
+        visited.save()
+        seen_content_hashes.close()
+        if near_dups is not None:
+            near_dups.save()
+    else:
+        visited.delete_snapshot()
+        seen_content_hashes.delete()
+        if near_dups is not None:
+            near_dups.delete_snapshot()
+
     output_msg = "\n** Parallel web crawl finished, visited num pages: " + str(num_pages_visited)
     error(output_msg)  # just stderr
+    error(f"HTTP connection stats: {http_session.get_connection_stats()}")
+    error(f"Hot cache stats: {hot_cache.stats()}")
+    error(f"Visited store stats: {visited.stats()}")
+    if discoverer is not None:
+        error(f"Discovery stats: {discoverer.stats()}")
 
 
 def main():
@@ -389,7 +433,10 @@ def main():
 
     error(f"*** CRAWL SITE BEGIN at url: {start_url}")  # just stderr logging
 
-    crawl_site(start_url, corpus_location, max_depth, max_pages, refresh_queue)
+    if config.CRAWLER_FETCH_STRATEGY == config.CRAWLER_FETCH_AIOHTTP:
+        web_scraper_async.crawl_site(start_url, corpus_location, max_depth, max_pages, refresh_queue)
+    else:
+        crawl_site(start_url, corpus_location, max_depth, max_pages, refresh_queue)
 
     #crawl_site("http://www.wanttoknow.info", corpus_location, max_depth, max_pages)
     #crawl_site("http://www.momentoflove.org", corpus_location, max_depth, max_pages)
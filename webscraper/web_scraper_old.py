@@ -55,6 +55,7 @@ import content_filter
 import pdf_fetcher
 import os
 import re
+import requests
 import fitz  # PyMuPDF
 import sys
 from web_scraper_base import *